@@ -10,7 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
-from os import getenv, path
+from os import cpu_count, getenv, path
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -23,7 +23,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = getenv("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = getenv("DEBUG", "True") == "True"
 
 ALLOWED_HOSTS = []
 
@@ -49,10 +49,14 @@ INSTALLED_APPS = [
     "homepage.apps.HomepageConfig",
     "users.apps.UsersConfig",
     "projects.apps.ProjectsConfig",
+    "monitoring.apps.MonitoringConfig",
 ]
 
 MIDDLEWARE = [
+    "monitoring.middleware.TracingMiddleware",
+    "monitoring.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "datanalytics.static_assets.StaticFilesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -157,9 +161,61 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+CELERY_BEAT_SCHEDULE = {
+    "enforce-retention": {
+        "task": "projects.tasks.enforce_retention",
+        "schedule": float(getenv("RETENTION_INTERVAL_SECONDS", 3600)),
+    },
+    "sweep-outbox": {
+        "task": "users.tasks.sweep_outbox",
+        "schedule": float(getenv("EMAIL_SWEEP_INTERVAL_SECONDS", 300)),
+    },
+}
+
+# Emails are queued in an outbox and sent in batches over one SMTP connection
+EMAIL_OUTBOX_BACKEND = getenv("EMAIL_OUTBOX_BACKEND", "redis")  # "redis" shares the outbox across processes, "memory" does not
+EMAIL_OUTBOX_REDIS_URL = getenv("EMAIL_OUTBOX_REDIS_URL", CELERY_BROKER_URL)
+EMAIL_OUTBOX_KEY = "mail:outbox"
+EMAIL_BATCH_SIZE = int(getenv("EMAIL_BATCH_SIZE", 100))  # Messages popped from the outbox at a time
+EMAIL_BATCH_DELAY = float(getenv("EMAIL_BATCH_DELAY", 2))  # Seconds a burst has to gather before it is sent
+EMAIL_DRAIN_CLAIM_SECONDS = 300  # A scheduled drain that never ran stops blocking new ones after this
+
 ALLOWED_HOSTS = ["localhost", "127.0.0.1", "0.0.0.0"]
 
 
+# CACHE SETTINGS
+CACHE_REDIS_URL = getenv("CACHE_REDIS_URL", "redis://redis:6379/1")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CACHE_REDIS_URL,
+        "KEY_PREFIX": "datanalytics",
+    }
+}
+PAGE_CACHE_TIMEOUT = int(getenv("PAGE_CACHE_TIMEOUT", 300))  # Seconds cached project page data is kept, and so stale at most
+
+
+# MONITORING SETTINGS
+METRICS_BACKEND = getenv("METRICS_BACKEND", "redis")  # "redis" shares samples across processes, "memory" does not
+METRICS_REDIS_URL = getenv("METRICS_REDIS_URL", CELERY_BROKER_URL)
+METRICS_KEY_PREFIX = "metrics"
+METRICS_TOKEN = getenv("METRICS_TOKEN")  # Bearer token required on /metrics when set
+TRACE_SPAN_LOG = getenv("TRACE_SPAN_LOG", path.join(BASE_DIR, "spans.log"))
+TASK_TRACEMALLOC_TOP = int(getenv("TASK_TRACEMALLOC_TOP", 0))  # Allocations kept per report task, 0 disables tracemalloc
+
+
+# REPORT SETTINGS
+REPORT_SAMPLE_ROWS = int(getenv("REPORT_SAMPLE_ROWS", 100_000))  # Row budget of sampled reports
+REPORT_SAMPLE_THRESHOLD_BYTES = int(getenv("REPORT_SAMPLE_THRESHOLD_BYTES", 100 * 1024 * 1024))  # Larger inputs are sampled automatically
+REPORT_CACHE_QUOTA_BYTES = int(getenv("REPORT_CACHE_QUOTA_BYTES", 5 * 1024 ** 3))  # Disk space of the report cache
+REPORT_WORKERS = int(getenv("REPORT_WORKERS", cpu_count() or 1))  # Processes profiling a wide input with the built-in engine
+REPORT_PARALLEL_MIN_COLUMNS = int(getenv("REPORT_PARALLEL_MIN_COLUMNS", 32))  # Narrower inputs are profiled in one process
+REPORT_SCRATCH_DIR = getenv("REPORT_SCRATCH_DIR") or None  # Where the columnar copy is written, default is the system temp dir
+BINNING_WORKERS = int(getenv("BINNING_WORKERS", cpu_count() or 1))  # Processes binning the optimal binning columns
+PREP_WORKERS = int(getenv("PREP_WORKERS", cpu_count() or 1))  # Processes computing missing value fills of a wide input
+PROJECTS_PER_PAGE = int(getenv("PROJECTS_PER_PAGE", 24))  # Projects per page of the project list
+
+
 # INTERNATIONALIZATION
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "Europe/Sofia"
@@ -171,10 +227,32 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATICFILES_DIRS = [path.join(BASE_DIR, "static")]
 STATIC_ROOT = path.join(BASE_DIR, "staticfiles")
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    # Content-hashed names and gzip/brotli copies, served by datanalytics.static_assets.StaticFilesMiddleware
+    "staticfiles": {"BACKEND": "datanalytics.static_assets.CompressedManifestStorage"},
+}
 
 
 # MEDIA FILES SETTINGS
 MEDIA_ROOT = path.join(BASE_DIR, "gizmo")
+# Uploads are hashed while they stream in and stored once per content, see projects.blobs
+FILE_UPLOAD_HANDLERS = [
+    "projects.blobs.HashingMemoryFileUploadHandler",
+    "projects.blobs.HashingTemporaryFileUploadHandler",
+]
+
+
+# GIZMO SETTINGS
+GIZMO_DIR = path.join(BASE_DIR, "gizmo")
+GIZMO_CONDA_ENV = getenv("GIZMO_CONDA_ENV", "gizmo")
+GIZMO_PYTHON = getenv("GIZMO_PYTHON")  # Run gizmo with this interpreter instead of `conda run`
+
+
+# RETENTION SETTINGS
+RETENTION_KEEP_SESSIONS = int(getenv("RETENTION_KEEP_SESSIONS", 5))  # Training runs kept per project without a RetentionPolicy
+RETENTION_BATCH_SIZE = int(getenv("RETENTION_BATCH_SIZE", 50))  # Entries archived per scheduled run
+RETENTION_ARCHIVE_DIR = getenv("RETENTION_ARCHIVE_DIR", path.join(MEDIA_ROOT, "archive"))
 
 
 # MISCELLANEOUS SETTINGS
@@ -182,28 +260,89 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
 # LOGGING SETTINGS
+LOG_FILE = getenv("LOG_FILE", "django.log")
+LOG_MAX_BYTES = int(getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))  # Size at which a log file is rotated
+LOG_BACKUP_COUNT = int(getenv("LOG_BACKUP_COUNT", 5))  # Rotated files kept
+LOG_MAX_MESSAGE_CHARS = int(getenv("LOG_MAX_MESSAGE_CHARS", 10_000))  # Longer messages are truncated
+LOG_FORMAT = getenv("LOG_FORMAT", "text")  # "json" writes one JSON object per line
+LOG_FORMATTER = "json" if LOG_FORMAT == "json" else "traced"
+
+# Loggers write to the queued handlers; listener threads do the console and file I/O.
+# Every web and worker process appends to the same files, which the shared rotating
+# handlers rotate under a file lock (see monitoring.logs).
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "trace_id": {
+            "()": "monitoring.tracing.TraceIdFilter",
+        },
+    },
+    "formatters": {
+        "traced": {
+            "format": "%(asctime)s - %(name)s - %(levelname)s - [trace=%(trace_id)s] - %(message)s",
+        },
+        "json": {
+            "()": "monitoring.logs.JsonFormatter",
+        },
+        "raw": {
+            "format": "%(message)s",
+        },
+    },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
+            "formatter": LOG_FORMATTER,
         },
         "file": {
-            "class": "logging.FileHandler",
-            "filename": "django.log",
-        }
+            "class": "monitoring.logs.SharedRotatingFileHandler",
+            "filename": LOG_FILE,
+            "maxBytes": LOG_MAX_BYTES,
+            "backupCount": LOG_BACKUP_COUNT,
+            "formatter": LOG_FORMATTER,
+        },
+        "queue": {
+            "()": "monitoring.logs.QueuedHandler",
+            "handlers": ["cfg://handlers.console", "cfg://handlers.file"],
+            "max_message_chars": LOG_MAX_MESSAGE_CHARS,
+            "filters": ["trace_id"],
+        },
+        "spans": {
+            "class": "monitoring.logs.SharedRotatingFileHandler",
+            "filename": TRACE_SPAN_LOG,
+            "maxBytes": LOG_MAX_BYTES,
+            "backupCount": LOG_BACKUP_COUNT,
+            "formatter": "raw",
+        },
+        "spans_queue": {
+            "()": "monitoring.logs.QueuedHandler",
+            "handlers": ["cfg://handlers.spans"],
+        },
+    },
+    "root": {
+        "handlers": ["queue"],
+        "level": "WARNING",
     },
     "loggers": {
-        "users.email_backend": {
-            "handlers": ["console", "file"],
+        "django": {
+            "handlers": ["queue"],
             "level": "INFO",
-            "propagate": True,
+            "propagate": False,
         },
-        "django": {
-            "handlers": ["console", "file"],
+        "projects": {
+            "handlers": ["queue"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "users": {
+            "handlers": ["queue"],
+            "level": "INFO",
+            "propagate": False,
+        },
+        "monitoring.spans": {
+            "handlers": ["spans_queue"],
             "level": "INFO",
-            "propagate": True,
+            "propagate": False,
         },
     },
 }
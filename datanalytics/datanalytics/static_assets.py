@@ -0,0 +1,128 @@
+"""Fingerprinted, precompressed static files served by the application.
+
+``collectstatic`` stores each asset under a name holding the hash of its content
+(``css/base.3f2a9c1e04b7.css``) through ``ManifestStaticFilesStorage``, and
+``CompressedManifestStorage`` writes gzip and, when the ``brotli`` package is
+installed, brotli copies of the hashed text assets next to them.
+
+``StaticFilesMiddleware`` answers requests under ``STATIC_URL`` from
+``STATIC_ROOT`` before they reach the URL resolver. It sends the best
+precompressed copy the client accepts, and marks hashed names immutable for a
+year: their content never changes, so a browser that has a page's assets does
+not ask for them again. Other names are revalidated with their ``ETag``.
+
+Until ``collectstatic`` has written a manifest (development server, tests),
+``{% static %}`` gives the plain names and the files are served as before.
+"""
+
+import mimetypes
+import os
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, HttpRequest, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from projects.delivery import negotiate
+from projects.report_cache import compress_report
+
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".svg", ".html", ".json", ".map", ".txt", ".xml")
+# Smaller files gain less from compression than the coding header costs
+MIN_COMPRESS_BYTES = 512
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also writes compressed copies of the hashed assets."""
+
+    def url_converter(self, name: str, hashed_files: Dict[str, str], template: Optional[str] = None) -> Callable:
+        """Rewrite references to hashed names, leaving those to files that are not shipped.
+
+        Vendored files such as ``bootstrap.min.css`` name source maps the
+        repository does not include; they are kept as they are rather than
+        failing ``collectstatic``.
+        """
+        converter = super().url_converter(name, hashed_files, template)
+
+        def convert(matchobj) -> str:
+            try:
+                return converter(matchobj)
+            except ValueError:
+                return matchobj["matched"]
+        return convert
+
+    def url(self, name: str, force: bool = False) -> str:
+        """Return the hashed URL of a file, the plain one until a manifest is collected."""
+        if not self.hashed_files and not force:
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def post_process(self, paths: Dict[str, Tuple], dry_run: bool = False, **options) -> Iterator[Tuple]:
+        """Hash the collected files, then compress the hashed text assets."""
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            path = self.path(name)
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and os.path.getsize(path) >= MIN_COMPRESS_BYTES:
+                compress_report(path)
+
+
+def hashed_names() -> frozenset:
+    """Return the hashed names in the static files manifest, empty without one."""
+    return frozenset(getattr(staticfiles_storage, "hashed_files", {}).values())
+
+
+class StaticFilesMiddleware:
+    """Serve collected static files with compression and long-lived cache headers."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        """Initialize the middleware."""
+        self.get_response = get_response
+        self.prefix = "/" + settings.STATIC_URL.lstrip("/")
+        self.root = settings.STATIC_ROOT
+        self.immutable = hashed_names()
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        """Answer static file requests, pass anything else on."""
+        if request.method in ("GET", "HEAD") and request.path.startswith(self.prefix) and self.root:
+            name = request.path[len(self.prefix):]
+            try:
+                path = safe_join(self.root, name)
+            except ValueError:
+                path = None
+            if path and os.path.isfile(path):
+                return self.serve(request, name, path)
+        return self.get_response(request)
+
+    def serve(self, request: HttpRequest, name: str, path: str) -> HttpResponse:
+        """Send one static file, or a 304 response when the client's copy is current.
+
+        :param request: The HTTP request
+        :param name: Name of the file relative to ``STATIC_ROOT``
+        :param path: Absolute path of the file
+        :return: The response
+        """
+        send_path, encoding = negotiate(request, path)
+        stat = os.stat(path)
+        tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        etag = quote_etag(f"{tag}-{encoding}" if encoding else tag)
+        last_modified = int(stat.st_mtime)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            content_type, _ = mimetypes.guess_type(path)
+            response = FileResponse(open(send_path, "rb"), content_type=content_type or "application/octet-stream")
+            if encoding:
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        if name in self.immutable:
+            response["Cache-Control"] = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            response["Cache-Control"] = "public, no-cache"
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
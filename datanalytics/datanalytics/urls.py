@@ -74,5 +74,6 @@ urlpatterns = [
     
     # App URLs
     path("projects/", include("projects.urls")),
-    path("users/", include("users.urls"))
+    path("users/", include("users.urls")),
+    path("", include("monitoring.urls")),
 ]
@@ -9,22 +9,64 @@ The commands that are used for gizmo are:
 
 import os
 import sys
-from time import sleep
+import json
+import secrets
+from time import sleep, time
 from datetime import datetime
 import logging
 
+PROCESS_START = time()
+
+# Trace context handed over by the Datanalytics worker, if any
+TRACE_ID = os.environ.get("DATANALYTICS_TRACE_ID")
+PARENT_SPAN_ID = os.environ.get("DATANALYTICS_PARENT_SPAN_ID")
+
+
+class TraceIdFilter(logging.Filter):
+    """Add the trace id of the current run to every log record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Annotate the record; never drops it."""
+        record.trace_id = TRACE_ID or "-"
+        return True
+
+
+console_handler = logging.StreamHandler(sys.stdout)  # Log to console
+console_handler.addFilter(TraceIdFilter())
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),  # Log to console
-    ]
+    format="%(asctime)s - %(name)s - %(levelname)s - [trace=%(trace_id)s] - %(message)s",
+    handlers=[console_handler]
 )
 
 logger = logging.getLogger(__name__)
 
+
+def write_span(name: str, start: float, end: float, **attributes) -> None:
+    """Append a finished span to the span log shared with the Datanalytics worker.
+
+    Nothing is written when gizmo runs outside a trace.
+    """
+    span_log = os.environ.get("DATANALYTICS_SPAN_LOG")
+    if not TRACE_ID or not span_log:
+        return
+    record = {
+        "trace_id": TRACE_ID,
+        "span_id": secrets.token_hex(8),
+        "parent_span_id": PARENT_SPAN_ID,
+        "name": name,
+        "start": start,
+        "duration_ms": round((end - start) * 1000, 3),
+        **attributes,
+    }
+    try:
+        with open(span_log, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not write span to {span_log}: {e}")
+
 INPUT_DATA_DIR = os.path.join(os.getcwd(), "input_data")
 OUTPUT_DATA_DIR = os.path.join(os.getcwd(), "output_data")
 SESSION_DATA_DIR = os.path.join(os.getcwd(), "sessions")
@@ -111,6 +153,10 @@ def main(timeout: int = 5) -> None:
     logger.info("Starting gizmo main function")
     logger.info("Arguments passed to the main function: %s", sys.argv)
 
+    spawn_time = os.environ.get("DATANALYTICS_SPAWN_TS")
+    if spawn_time:
+        write_span("gizmo.conda_start", float(spawn_time), PROCESS_START)
+
     setup_directories()
 
     try:
@@ -125,6 +171,7 @@ def main(timeout: int = 5) -> None:
         validate_project_name(project_name)
 
         module_type = sys.argv[3]
+        stage_start = time()
         if module_type == "--data_prep_module":
             if sys.argv[4] == "standard":
                 handle_data_prep(project_name, timeout)
@@ -148,10 +195,12 @@ def main(timeout: int = 5) -> None:
             logger.warning("Invalid module type passed to the main function")
             raise ValueError("Invalid module type passed to the main function")
 
+        write_span("gizmo.stage_work", stage_start, time(), module=module_type.lstrip("-"))
+
     except ValueError as e:
         logger.exception("Error in main function")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    main(timeout=int(os.environ.get("GIZMO_TIMEOUT", 5)))
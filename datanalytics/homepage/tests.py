@@ -1,3 +1,49 @@
-from django.test import TestCase
+"""Tests for the homepage app and the static files it links."""
 
-# Create your tests here.
+import gzip
+import shutil
+import tempfile
+
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+
+class StaticAssetTests(TestCase):
+    """Tests for the fingerprinted, precompressed static files."""
+    def setUp(self) -> None:
+        """Collect the static files into a temporary root."""
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        settings_override = override_settings(STATIC_ROOT=static_root, METRICS_BACKEND="memory")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def test_hashed_asset_is_compressed_and_immutable(self) -> None:
+        """Test that pages link hashed names, served compressed and cacheable for a year."""
+        url = staticfiles_storage.url("css/bootstrap.min.css")
+        self.assertRegex(url, r"^/static/css/bootstrap\.min\.[0-9a-f]{12}\.css$")
+        self.assertContains(self.client.get("/"), url)
+
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Content-Type"], "text/css")
+        with open(finders.find("css/bootstrap.min.css"), "rb") as f:
+            self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), f.read())
+
+    def test_missing_source_map_is_left_alone(self) -> None:
+        """Test that a reference to a source map that is not shipped is kept unchanged."""
+        with staticfiles_storage.open(staticfiles_storage.stored_name("css/bootstrap.min.css")) as f:
+            self.assertTrue(f.read().endswith(b"/*# sourceMappingURL=bootstrap.min.css.map */"))
+
+    def test_plain_name_is_revalidated(self) -> None:
+        """Test that unhashed names must be revalidated and answer 304 when unchanged."""
+        response = self.client.get("/static/css/base.css")
+        self.assertEqual(response["Cache-Control"], "public, no-cache")
+        self.assertNotIn("Content-Encoding", response)
+        again = self.client.get("/static/css/base.css", headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(again.status_code, 304)
+        self.assertNotEqual(self.client.get("/static/%2e%2e/manage.py").status_code, 200)
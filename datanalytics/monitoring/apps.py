@@ -0,0 +1,13 @@
+"""Config for the monitoring app."""
+
+from django.apps import AppConfig
+
+
+class MonitoringConfig(AppConfig):
+    """Configuration for the monitoring app."""
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "monitoring"
+
+    def ready(self) -> None:
+        """Connect the Celery signal handlers."""
+        from . import signals  # noqa: F401
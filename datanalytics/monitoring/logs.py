@@ -0,0 +1,175 @@
+"""Non-blocking log handlers.
+
+Loggers write to a ``QueuedHandler``, which only puts the record on an
+in-memory queue. A ``QueueListener`` thread takes records off the queue and
+hands them to the handlers doing the I/O, typically a ``SharedRotatingFileHandler``,
+so a request thread never waits on the disk, a slow terminal or another process.
+
+Every web and worker process, and gizmo for the span log, appends to the same
+files. ``SharedRotatingFileHandler`` rotates them by size all the same: each
+write holds an exclusive lock on ``<file>.lock``, so one process rotates while
+the others wait, and a process that finds the file rotated by another reopens
+it before writing. Gizmo opens the span log for every span and needs neither.
+
+The queued handler also caps the length of each message: task results carry the
+whole stdout of gizmo, which would otherwise fill the log one record at a time.
+Filters attached to it, such as ``monitoring.tracing.TraceIdFilter``, run in the
+thread that logged, where the trace context is still active.
+
+``JsonFormatter`` writes one JSON object per line for log shippers; pick it with
+``LOG_FORMAT = "json"``.
+
+Each process runs its own listener. A forked child, such as a Celery prefork
+worker, starts a new one, since the parent's thread does not exist in it.
+Queued records are written out at interpreter exit, and by
+``monitoring.signals`` when a Celery pool process shuts down, as those exit
+without running ``atexit`` handlers.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import weakref
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the development server runs a single process
+    fcntl = None
+
+_queued_handlers = weakref.WeakSet()
+
+
+class QueuedHandler(QueueHandler):
+    """Queue records for a listener thread that passes them to the target handlers."""
+
+    def __init__(self, handlers: List[logging.Handler], max_message_chars: Optional[int] = None) -> None:
+        """Start the listener.
+
+        :param handlers: Handlers the listener writes to; in ``LOGGING`` give
+            them as ``cfg://handlers.<name>`` of handlers named before this one
+        :param max_message_chars: Longest message kept whole, None for no limit
+        """
+        super().__init__(queue.SimpleQueue())
+        # Indexing, unlike iterating, resolves the cfg:// references of dictConfig
+        self.targets = [handlers[i] for i in range(len(handlers))]
+        for target in self.targets:
+            if not isinstance(target, logging.Handler):
+                raise ValueError(f"{target!r} is not a configured handler, name it before the queued handler")
+        self.max_message_chars = max_message_chars
+        self.listener: Optional[QueueListener] = None
+        self._start()
+        _queued_handlers.add(self)
+        os.register_at_fork(after_in_child=self._restart)
+
+    def _start(self) -> None:
+        """Start a listener thread on the queue."""
+        self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+
+    def _restart(self) -> None:
+        """Give a forked child its own queue and listener."""
+        self.queue = queue.SimpleQueue()
+        self._start()
+
+    def stop(self) -> None:
+        """Write out the queued records and stop the listener."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments and traceback into the message and cap its length."""
+        record = super().prepare(record)
+        if self.max_message_chars and len(record.msg) > self.max_message_chars:
+            dropped = len(record.msg) - self.max_message_chars
+            record.msg = f"{record.msg[:self.max_message_chars]}... [{dropped} characters truncated]"
+            record.message = record.msg
+        return record
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """Rotate by size a file that several processes append to."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Open the file and its lock file; takes the arguments of ``RotatingFileHandler``."""
+        super().__init__(*args, **kwargs)
+        self.lock_path = f"{self.baseFilename}.lock"
+        self.lock_file = None
+        self.opened: Optional[Tuple[int, int]] = None
+        if fcntl is not None:
+            self.lock_file = open(self.lock_path, "a")
+        os.register_at_fork(after_in_child=self._reopen_lock)
+
+    def _reopen_lock(self) -> None:
+        """Give a forked child its own lock file, as flock sees processes sharing one as one holder."""
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = open(self.lock_path, "a")
+
+    def _open(self):
+        """Open the file and remember which one it is."""
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self.opened = (stat.st_dev, stat.st_ino)
+        return stream
+
+    def _reopen_if_rotated(self) -> None:
+        """Reopen the path when another process has moved the open file away."""
+        try:
+            stat = os.stat(self.baseFilename)
+            current = (stat.st_dev, stat.st_ino)
+        except FileNotFoundError:
+            current = None
+        if self.stream is not None and current != self.opened:
+            self.stream.close()
+            self.stream = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Write the record under the lock, rotating first when the file on disk is full."""
+        if self.lock_file is None:
+            super().emit(record)
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            self._reopen_if_rotated()
+            # shouldRollover measures the file from its end, so writes of every process count
+            super().emit(record)
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        """Close the file and the lock file."""
+        super().close()
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+
+@atexit.register
+def stop_queued_handlers() -> None:
+    """Write out the records queued in this process and stop its listeners."""
+    for handler in list(_queued_handlers):
+        handler.stop()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Return the record as JSON with time, level, logger, trace id and message."""
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", None),
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
@@ -0,0 +1,48 @@
+"""Print the span breakdown of one trace from the span log."""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.tracing import load_trace
+
+
+class Command(BaseCommand):
+    """Show every span of a trace as an indented timeline."""
+
+    help = "Show the spans of a trace (the X-Trace-Id of a request) with their timings."
+
+    def add_arguments(self, parser) -> None:
+        """Add command line arguments."""
+        parser.add_argument("trace_id", help="Trace id to show")
+        parser.add_argument("--span-log", default=settings.TRACE_SPAN_LOG, help="Span log file to read")
+
+    def handle(self, *args, **options) -> None:
+        """Print the trace."""
+        try:
+            spans = load_trace(options["span_log"], options["trace_id"])
+        except FileNotFoundError:
+            raise CommandError(f"Span log not found: {options['span_log']}")
+        if not spans:
+            raise CommandError(f"No spans for trace {options['trace_id']}")
+
+        children = defaultdict(list)
+        known = {record["span_id"] for record in spans}
+        for record in spans:
+            parent = record.get("parent_span_id")
+            children[parent if parent in known else None].append(record)
+
+        origin = spans[0]["start"]
+
+        def show(record: dict, depth: int) -> None:
+            offset = (record["start"] - origin) * 1000
+            self.stdout.write(
+                f"{offset:>10.1f} ms  {'  ' * depth}{record['name']:<{40 - 2 * depth}}"
+                f"{record['duration_ms']:>12.1f} ms"
+            )
+            for child in children[record["span_id"]]:
+                show(child, depth + 1)
+
+        for root in children[None]:
+            show(root, 0)
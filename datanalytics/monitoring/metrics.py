@@ -0,0 +1,294 @@
+"""Counters and histograms shared by every web and worker process.
+
+Samples are not kept in process memory: every update is an increment on a Redis
+hash, so the figures of all gunicorn workers and all Celery prefork children add
+up without any coordination between them. ``render`` reads the hashes back and
+produces the Prometheus text exposition format served on ``/metrics``.
+
+Set ``METRICS_BACKEND = "memory"`` to keep the samples in the current process,
+which is what the tests and a single ``runserver`` process need.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0, 10800.0)
+
+
+class MemoryStore:
+    """Keeps metric hashes in the memory of the current process."""
+
+    def __init__(self) -> None:
+        """Initialize an empty store."""
+        self._data: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def increment(self, key: str, updates: Dict[str, float]) -> None:
+        """Add each value to its field of the hash stored at key."""
+        with self._lock:
+            for field, amount in updates.items():
+                self._data[key][field] += amount
+
+    def read_many(self, keys: Sequence[str]) -> List[Dict[str, float]]:
+        """Return a copy of each hash, in the order of the keys."""
+        with self._lock:
+            return [dict(self._data.get(key, {})) for key in keys]
+
+
+class RedisStore:
+    """Keeps metric hashes in Redis so all processes share them.
+
+    Metrics must never break a request or a task, so Redis errors are logged and
+    the store stays silent for ``RETRY_AFTER`` seconds before trying again.
+    """
+
+    RETRY_AFTER = 30
+
+    def __init__(self, url: str, prefix: str) -> None:
+        """Initialize the store without connecting yet."""
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._down_until = 0.0
+
+    def _get_client(self):
+        """Return the Redis client, or None while Redis is considered down."""
+        if time.monotonic() < self._down_until:
+            return None
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return self._client
+
+    def _failed(self, exc: Exception) -> None:
+        """Back off after a Redis error."""
+        logger.warning("Metrics store unavailable, dropping samples for %ss: %s", self.RETRY_AFTER, exc)
+        self._down_until = time.monotonic() + self.RETRY_AFTER
+
+    def increment(self, key: str, updates: Dict[str, float]) -> None:
+        """Add each value to its field of the hash stored at key."""
+        import redis
+
+        client = self._get_client()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for field, amount in updates.items():
+                pipe.hincrbyfloat(f"{self.prefix}:{key}", field, amount)
+            pipe.execute()
+        except redis.RedisError as exc:
+            self._failed(exc)
+
+    def read_many(self, keys: Sequence[str]) -> List[Dict[str, float]]:
+        """Return each hash in one round trip, in the order of the keys."""
+        import redis
+
+        client = self._get_client()
+        if client is None:
+            return [{} for _ in keys]
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(f"{self.prefix}:{key}")
+            hashes = pipe.execute()
+        except redis.RedisError as exc:
+            self._failed(exc)
+            return [{} for _ in keys]
+        return [
+            {field.decode(): float(value) for field, value in data.items()}
+            for data in hashes
+        ]
+
+
+_store = None
+_registry: Dict[str, "Metric"] = {}
+
+
+def get_store():
+    """Return the store selected by ``METRICS_BACKEND``, creating it on first use."""
+    global _store
+    if _store is None:
+        if settings.METRICS_BACKEND == "memory":
+            _store = MemoryStore()
+        else:
+            _store = RedisStore(settings.METRICS_REDIS_URL, settings.METRICS_KEY_PREFIX)
+    return _store
+
+
+@receiver(setting_changed)
+def reset_store(setting: str, **kwargs) -> None:
+    """Drop the cached store when a metrics setting is overridden."""
+    global _store
+    if setting.startswith("METRICS_"):
+        _store = None
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    """Format a sample value, dropping the fraction of whole numbers."""
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    """Base class for metrics with a fixed set of label names.
+
+    Fields of the backing hash are ``"<labels>\\t<part>"`` where labels is the
+    rendered label set and part names the counter, sum, count or bucket.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        """Register the metric."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _labels(self, labels: Dict[str, str]) -> str:
+        """Render the label set in declaration order."""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return ",".join(f'{name}="{_escape(labels[name])}"' for name in self.labelnames)
+
+    def samples(self, data: Dict[str, float]) -> Iterator[Tuple[str, float]]:
+        """Yield (sample name with labels, value) pairs from the stored hash."""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """Increase the counter for a label set."""
+        get_store().increment(self.name, {f"{self._labels(labels)}\ttotal": amount})
+
+    def samples(self, data: Dict[str, float]) -> Iterator[Tuple[str, float]]:
+        """Yield one sample per label set."""
+        for field, value in sorted(data.items()):
+            labels, _ = field.split("\t")
+            yield f"{self.name}{{{labels}}}" if labels else self.name, value
+
+
+class Histogram(Metric):
+    """A distribution of observed values in fixed buckets.
+
+    Buckets are stored non-cumulatively so an observation costs three hash
+    increments; they are accumulated when rendering.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = REQUEST_BUCKETS) -> None:
+        """Register the histogram with its upper bucket bounds."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record one observation for a label set.
+
+        NaN and infinite values are dropped: they fall in no bucket and would
+        turn the stored sum into NaN or inf for good.
+        """
+        rendered = self._labels(labels)
+        if not math.isfinite(value):
+            logger.warning("Dropping non-finite observation %r for %s", value, self.name)
+            return
+        bound = next(b for b in self.buckets if value <= b)
+        get_store().increment(self.name, {
+            f"{rendered}\tbucket:{bound!r}": 1,
+            f"{rendered}\tsum": value,
+            f"{rendered}\tcount": 1,
+        })
+
+    def samples(self, data: Dict[str, float]) -> Iterator[Tuple[str, float]]:
+        """Yield cumulative buckets, sum and count per label set."""
+        grouped: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for field, value in data.items():
+            labels, part = field.split("\t")
+            grouped[labels][part] = value
+
+        for labels, parts in sorted(grouped.items()):
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0.0
+            for bound in self.buckets:
+                cumulative += parts.get(f"bucket:{bound!r}", 0.0)
+                le = "+Inf" if bound == float("inf") else _format(bound)
+                yield f'{self.name}_bucket{{{prefix}le="{le}"}}', cumulative
+            suffix = f"{{{labels}}}" if labels else ""
+            yield f"{self.name}_sum{suffix}", parts.get("sum", 0.0)
+            yield f"{self.name}_count{suffix}", parts.get("count", 0.0)
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    hashes = get_store().read_many([metric.name for metric in metrics])
+    lines = []
+    for metric, data in zip(metrics, hashes):
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{sample} {_format(value)}" for sample, value in metric.samples(data))
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_LATENCY = Histogram(
+    "datanalytics_http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ["method", "view", "status"],
+)
+TASK_DURATION = Histogram(
+    "datanalytics_celery_task_duration_seconds",
+    "Run time of Celery tasks on the worker.",
+    ["task", "state"],
+    buckets=TASK_BUCKETS,
+)
+TASK_QUEUE_WAIT = Histogram(
+    "datanalytics_celery_task_queue_wait_seconds",
+    "Time between publishing a Celery task and a worker starting it.",
+    ["task"],
+    buckets=TASK_BUCKETS,
+)
+TASK_RETRIES = Counter(
+    "datanalytics_celery_task_retries_total",
+    "Celery task retries.",
+    ["task"],
+)
+TASK_FAILURES = Counter(
+    "datanalytics_celery_task_failures_total",
+    "Celery tasks that raised an exception.",
+    ["task"],
+)
+GIZMO_STAGE_DURATION = Histogram(
+    "datanalytics_gizmo_stage_duration_seconds",
+    "Run time of gizmo subprocesses by stage.",
+    ["stage", "outcome"],
+    buckets=TASK_BUCKETS,
+)
+PAGE_CACHE_LOOKUPS = Counter(
+    "datanalytics_page_cache_lookups_total",
+    "Lookups of cached page data by outcome.",
+    ["page", "result"],
+)
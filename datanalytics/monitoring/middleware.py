@@ -0,0 +1,54 @@
+"""Middleware recording request latency metrics and request traces."""
+
+import time
+from typing import Callable
+
+from django.http import HttpRequest, HttpResponse
+
+from . import tracing
+from .metrics import REQUEST_LATENCY
+
+
+class TracingMiddleware:
+    """Run every request inside a trace, continuing an incoming ``traceparent`` if present.
+
+    The trace id is returned in the ``X-Trace-Id`` response header so a slow run
+    can be looked up in the span log.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        """Initialize the middleware."""
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        """Open the request span and activate its context for the view."""
+        token = tracing.activate(tracing.from_traceparent(request.headers.get("traceparent")))
+        try:
+            with tracing.span("http.request", method=request.method, path=request.path) as context:
+                request.trace_id = context.trace_id
+                response = self.get_response(request)
+                response["X-Trace-Id"] = context.trace_id
+        finally:
+            tracing.deactivate(token)
+        return response
+
+
+class MetricsMiddleware:
+    """Record the latency of every request, labelled by view name rather than path."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        """Initialize the middleware."""
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        """Time the rest of the middleware chain and the view."""
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, "resolver_match", None)
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            view=match.view_name if match else "unmatched",
+            status=str(response.status_code),
+        )
+        return response
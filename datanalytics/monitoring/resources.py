@@ -0,0 +1,173 @@
+"""Wall time, CPU time and peak memory of Celery tasks and their gizmo children.
+
+``track`` measures the task itself with ``getrusage`` on the worker process.
+Peak RSS is a per-process high-water mark, so it is reset at the start of the
+task through ``/proc/self/clear_refs`` where Linux allows it; elsewhere the
+figure is the peak of the worker process so far.
+
+Child processes are started with ``RusagePopen``, which reaps them with
+``os.wait4``. The kernel then reports the CPU time of the whole process tree
+(the shell, ``conda run`` and gizmo's python) and the peak RSS of its largest
+member, which is what a worker's memory limit has to accommodate.
+"""
+
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ru_maxrss is reported in bytes on macOS and in kilobytes everywhere else
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+@dataclass
+class Usage:
+    """Resources used by a task or by one child process tree."""
+
+    wall_seconds: float
+    cpu_user_seconds: float
+    cpu_system_seconds: float
+    peak_rss_bytes: int
+
+
+@dataclass
+class TaskResources:
+    """Everything measured while a task ran."""
+
+    usage: Optional[Usage] = None
+    stages: List[Tuple[str, Usage]] = field(default_factory=list)
+    top_allocations: List[Dict[str, object]] = field(default_factory=list)
+
+    def as_dict(self) -> Dict[str, object]:
+        """Return the measurements as a JSON serializable dictionary for the task result."""
+        return {
+            "task": asdict(self.usage) if self.usage else None,
+            "stages": [{"stage": stage, **asdict(usage)} for stage, usage in self.stages],
+            "top_allocations": self.top_allocations,
+        }
+
+
+_current: ContextVar[Optional[TaskResources]] = ContextVar("datanalytics_resources", default=None)
+
+
+class RusagePopen(subprocess.Popen):
+    """``Popen`` that keeps the resource usage the kernel reports when reaping the child."""
+
+    rusage = None
+
+    def _try_wait(self, wait_flags: int) -> Tuple[int, int]:
+        """Wait for the child with ``os.wait4`` instead of ``os.waitpid``."""
+        try:
+            pid, status, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return self.pid, 0
+        if pid == self.pid:
+            self.rusage = rusage
+        return pid, status
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS of the current process.
+
+    :return: True if the kernel accepted the reset, False if the peak cannot be reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes() -> int:
+    """Return the peak RSS of the current process since start or since the last reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+def child_usage(rusage, wall_seconds: float) -> Usage:
+    """Convert the rusage of a reaped child into a ``Usage``.
+
+    :param rusage: ``resource.struct_rusage`` returned by ``os.wait4``
+    :param wall_seconds: How long the child ran
+    :return: Usage of the child process tree
+    """
+    return Usage(
+        wall_seconds=wall_seconds,
+        cpu_user_seconds=rusage.ru_utime,
+        cpu_system_seconds=rusage.ru_stime,
+        peak_rss_bytes=rusage.ru_maxrss * MAXRSS_UNIT,
+    )
+
+
+def record_stage(stage: str, usage: Usage) -> None:
+    """Attach the usage of a child process to the task being tracked, if any.
+
+    :param stage: Name of the gizmo stage the child ran
+    :param usage: Usage of the child process tree
+    """
+    resources = _current.get()
+    if resources is not None:
+        resources.stages.append((stage, usage))
+
+
+def _top_allocations(limit: int) -> List[Dict[str, object]]:
+    """Return the largest live allocations by source line from a tracemalloc snapshot."""
+    statistics = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    )).statistics("lineno")
+    return [
+        {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+        for stat in statistics[:limit]
+    ]
+
+
+@contextmanager
+def track(top_allocations: int = 0) -> Iterator[TaskResources]:
+    """Measure the block and collect the usage of the child processes it starts.
+
+    :param top_allocations: Number of tracemalloc entries to keep, 0 disables tracemalloc
+    :return: Context manager yielding the ``TaskResources`` filled in on exit
+    """
+    resources = TaskResources()
+    token = _current.set(resources)
+    start_tracing = top_allocations > 0 and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    reset_peak_rss()
+    start = time.monotonic()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        yield resources
+    finally:
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        resources.usage = Usage(
+            wall_seconds=time.monotonic() - start,
+            cpu_user_seconds=after.ru_utime - before.ru_utime,
+            cpu_system_seconds=after.ru_stime - before.ru_stime,
+            peak_rss_bytes=peak_rss_bytes(),
+        )
+        if top_allocations > 0:
+            try:
+                resources.top_allocations = _top_allocations(top_allocations)
+            except RuntimeError:
+                logger.warning("tracemalloc is not tracing, no allocation snapshot taken")
+        if start_tracing:
+            tracemalloc.stop()
+        _current.reset(token)
@@ -0,0 +1,112 @@
+"""Celery signal handlers recording task metrics, carrying the trace context and flushing logs."""
+
+import time
+from typing import Dict, Tuple
+
+from celery.signals import (
+    after_task_publish,
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_retry,
+    worker_process_shutdown,
+)
+
+from . import tracing
+from .logs import stop_queued_handlers
+from .metrics import TASK_DURATION, TASK_FAILURES, TASK_QUEUE_WAIT, TASK_RETRIES
+
+# Start time, span context, parent span id and context token of the tasks
+# running in this worker process, by task id
+_task_starts: Dict[str, Tuple[float, float, tracing.SpanContext, str, object]] = {}
+
+# Publish start time and span context of the messages being sent, by task id
+_publish_starts: Dict[str, Tuple[float, tracing.SpanContext, str]] = {}
+
+
+def get_header(request, name: str):
+    """Read a custom message header from a task request.
+
+    :param request: The task's request context
+    :param name: Header name
+    :return: The header value or None
+    """
+    value = getattr(request, name, None)
+    if value is None:
+        value = (getattr(request, "headers", None) or {}).get(name)
+    return value
+
+
+@before_task_publish.connect
+def stamp_task_headers(sender: str = None, headers: dict = None, **kwargs) -> None:
+    """Add the publish time and the trace context to the outgoing message."""
+    if headers is None:
+        return
+    parent = tracing.current()
+    context = tracing.SpanContext(parent.trace_id if parent else tracing.new_trace_id(), tracing.new_span_id())
+    headers["enqueued_at"] = time.time()
+    headers["trace_id"] = context.trace_id
+    headers["parent_span_id"] = context.span_id
+    if headers.get("id"):
+        _publish_starts[headers["id"]] = (headers["enqueued_at"], context, parent.span_id if parent else None)
+
+
+@after_task_publish.connect
+def record_enqueue(sender: str = None, headers: dict = None, **kwargs) -> None:
+    """Record how long sending the message to the broker took."""
+    started = _publish_starts.pop((headers or {}).get("id"), None)
+    if started:
+        start, context, parent_span_id = started
+        tracing.record_span("enqueue", start, time.time(), context, parent_span_id, task=sender)
+
+
+@task_prerun.connect
+def record_task_start(task_id: str = None, task=None, **kwargs) -> None:
+    """Restore the trace context and record how long the task waited in the queue."""
+    now = time.time()
+    trace_id = get_header(task.request, "trace_id") or tracing.new_trace_id()
+    parent_span_id = get_header(task.request, "parent_span_id")
+    context = tracing.SpanContext(trace_id, tracing.new_span_id())
+
+    enqueued_at = get_header(task.request, "enqueued_at")
+    if enqueued_at:
+        TASK_QUEUE_WAIT.observe(max(now - float(enqueued_at), 0.0), task=task.name)
+        tracing.record_span(
+            "queue_wait", float(enqueued_at), now,
+            tracing.SpanContext(trace_id, tracing.new_span_id()), parent_span_id, task=task.name,
+        )
+
+    token = tracing.activate(context)
+    _task_starts[task_id] = (time.monotonic(), now, context, parent_span_id, token)
+
+
+@task_postrun.connect
+def record_task_end(task_id: str = None, task=None, state: str = None, **kwargs) -> None:
+    """Record the task run time with its final state and close its span."""
+    started = _task_starts.pop(task_id, None)
+    if started is None:
+        return
+    monotonic_start, start, context, parent_span_id, token = started
+    TASK_DURATION.observe(time.monotonic() - monotonic_start, task=task.name, state=state or "UNKNOWN")
+    tracing.record_span(f"task {task.name}", start, time.time(), context, parent_span_id,
+                        task_id=task_id, state=state)
+    tracing.deactivate(token)
+
+
+@task_retry.connect
+def record_task_retry(sender=None, **kwargs) -> None:
+    """Count a retry."""
+    TASK_RETRIES.inc(task=sender.name)
+
+
+@task_failure.connect
+def record_task_failure(sender=None, **kwargs) -> None:
+    """Count a failure."""
+    TASK_FAILURES.inc(task=sender.name)
+
+
+@worker_process_shutdown.connect
+def flush_logs(**kwargs) -> None:
+    """Write out queued log records before a pool process exits."""
+    stop_queued_handlers()
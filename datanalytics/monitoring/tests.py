@@ -0,0 +1,215 @@
+"""Tests for the monitoring app."""
+
+import json
+import logging
+import logging.config
+import os
+import shutil
+import sys
+import tempfile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from . import resources, tracing
+from .logs import JsonFormatter, QueuedHandler, SharedRotatingFileHandler
+from .metrics import Counter, Histogram, render
+
+
+@override_settings(METRICS_BACKEND="memory")
+class MetricsTests(TestCase):
+    """Tests for the metric types and the text rendering."""
+    def test_histogram_buckets_are_cumulative(self) -> None:
+        """Test that rendered buckets accumulate and sum/count are exposed."""
+        histogram = Histogram("test_histogram_seconds", "Test histogram.", ["stage"], buckets=(1, 5))
+        histogram.observe(0.5, stage="train")
+        histogram.observe(3, stage="train")
+        histogram.observe(7, stage="train")
+        output = render()
+        self.assertIn('test_histogram_seconds_bucket{stage="train",le="1"} 1', output)
+        self.assertIn('test_histogram_seconds_bucket{stage="train",le="5"} 2', output)
+        self.assertIn('test_histogram_seconds_bucket{stage="train",le="+Inf"} 3', output)
+        self.assertIn('test_histogram_seconds_sum{stage="train"} 10.5', output)
+        self.assertIn('test_histogram_seconds_count{stage="train"} 3', output)
+        self.assertIn("# TYPE test_histogram_seconds histogram", output)
+
+    def test_histogram_drops_non_finite(self) -> None:
+        """Test that NaN and infinite observations are skipped."""
+        histogram = Histogram("test_non_finite_seconds", "Test histogram.", buckets=(1,))
+        histogram.observe(float("nan"))
+        histogram.observe(float("inf"))
+        histogram.observe(0.5)
+        output = render()
+        self.assertIn('test_non_finite_seconds_bucket{le="+Inf"} 1', output)
+        self.assertIn("test_non_finite_seconds_sum 0.5", output)
+        self.assertIn("test_non_finite_seconds_count 1", output)
+
+    def test_counter_labels_validated(self) -> None:
+        """Test that counters reject unknown label sets and escape values."""
+        counter = Counter("test_counter_total", "Test counter.", ["task"])
+        with self.assertRaises(ValueError):
+            counter.inc(queue="email")
+        counter.inc(task='say "hi"')
+        self.assertIn('test_counter_total{task="say \\"hi\\""} 1', render())
+
+
+@override_settings(METRICS_BACKEND="memory")
+class MetricsViewTests(TestCase):
+    """Tests for the request middleware and the metrics endpoint."""
+    def test_requests_are_recorded(self) -> None:
+        """Test that a request shows up on /metrics labelled by view name."""
+        self.client.get(reverse("about_us"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            'datanalytics_http_request_duration_seconds_count{method="GET",view="about_us",status="200"} 1',
+            response.content.decode(),
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token_required(self) -> None:
+        """Test that the endpoint enforces the configured bearer token."""
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(METRICS_BACKEND="memory")
+class TracingTests(TestCase):
+    """Tests for trace context propagation and the span log."""
+    def test_incoming_traceparent_is_continued(self) -> None:
+        """Test that a request joins the caller's trace and returns its id."""
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+        with self.assertLogs("monitoring.spans", level="INFO") as logs:
+            response = self.client.get(
+                reverse("about_us"),
+                HTTP_TRACEPARENT=f"00-{trace_id}-00f067aa0ba902b7-01",
+            )
+        self.assertEqual(response["X-Trace-Id"], trace_id)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record["name"], "http.request")
+        self.assertEqual(record["parent_span_id"], "00f067aa0ba902b7")
+
+    def test_nested_spans_share_trace(self) -> None:
+        """Test that child spans keep the trace id and point at their parent."""
+        with self.assertLogs("monitoring.spans", level="INFO") as logs:
+            with tracing.span("outer") as outer:
+                with tracing.span("inner") as inner:
+                    env = tracing.subprocess_env(inner)
+        inner_record, outer_record = [json.loads(r.getMessage()) for r in logs.records]
+        self.assertEqual(inner.trace_id, outer.trace_id)
+        self.assertEqual(inner_record["parent_span_id"], outer.span_id)
+        self.assertIsNone(outer_record["parent_span_id"])
+        self.assertEqual(env[tracing.TRACE_ID_ENV], outer.trace_id)
+        self.assertEqual(env[tracing.PARENT_SPAN_ENV], inner.span_id)
+        self.assertIsNone(tracing.current())
+
+    def test_trace_id_filter(self) -> None:
+        """Test that log records carry the active trace id."""
+        record = logging.LogRecord("x", logging.INFO, __file__, 1, "message", None, None)
+        with tracing.span("outer") as context:
+            tracing.TraceIdFilter().filter(record)
+        self.assertEqual(record.trace_id, context.trace_id)
+        self.assertIsNone(tracing.from_traceparent("garbage"))
+
+
+class ResourceTests(TestCase):
+    """Tests for task and child process resource accounting."""
+    def test_child_usage_is_attached_to_task(self) -> None:
+        """Test that a child reaped by RusagePopen is recorded against the tracked task."""
+        code = "x = bytearray(50 * 1024 * 1024); sum(range(10 ** 6))"
+        with resources.track() as measured:
+            process = resources.RusagePopen([sys.executable, "-c", code])
+            process.wait()
+            resources.record_stage("train", resources.child_usage(process.rusage, 0.0))
+        stage, usage = measured.stages[0]
+        self.assertEqual(stage, "train")
+        self.assertGreater(usage.peak_rss_bytes, 50 * 1024 * 1024)
+        self.assertGreater(usage.cpu_user_seconds + usage.cpu_system_seconds, 0)
+        self.assertGreaterEqual(measured.usage.wall_seconds, 0)
+        self.assertEqual(measured.as_dict()["stages"][0]["stage"], "train")
+
+    def test_top_allocations(self) -> None:
+        """Test that tracemalloc reports the allocation made inside the block."""
+        with resources.track(top_allocations=3) as measured:
+            data = [bytearray(1024) for _ in range(2000)]
+        self.assertEqual(len(measured.top_allocations), 3)
+        self.assertIn("tests.py", measured.top_allocations[0]["location"])
+        del data
+
+
+class LoggingTests(TestCase):
+    """Tests for the queued log handlers and the shared rotating log files."""
+    def setUp(self) -> None:
+        """Send a test logger through a queued handler to a shared rotating file."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "app.log")
+        logging.config.dictConfig({
+            "version": 1,
+            "disable_existing_loggers": False,
+            "filters": {"trace_id": {"()": "monitoring.tracing.TraceIdFilter"}},
+            "formatters": {"json": {"()": "monitoring.logs.JsonFormatter"}},
+            "handlers": {
+                "file": {"class": "monitoring.logs.SharedRotatingFileHandler", "filename": self.path,
+                         "maxBytes": 2000, "backupCount": 2, "formatter": "json"},
+                "queue": {"()": "monitoring.logs.QueuedHandler", "handlers": ["cfg://handlers.file"],
+                          "max_message_chars": 100, "filters": ["trace_id"]},
+            },
+            "loggers": {"monitoring.test_logs": {"handlers": ["queue"], "level": "INFO", "propagate": False}},
+        })
+        self.logger = logging.getLogger("monitoring.test_logs")
+        self.handler = self.logger.handlers[0]
+        self.addCleanup(self.logger.handlers.clear)
+        self.addCleanup(self.handler.stop)
+
+    def read_entries(self) -> list:
+        """Stop the listener and return the JSON entries of the current log file."""
+        self.handler.stop()
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_are_queued_and_capped(self) -> None:
+        """Test that records reach the file from the listener with the trace id and a capped message."""
+        self.assertIsInstance(self.handler, QueuedHandler)
+        with tracing.span("request") as context:
+            self.logger.info("stdout: %s", "x" * 500)
+        entry, = self.read_entries()
+        self.assertEqual((entry["logger"], entry["level"], entry["trace_id"]),
+                         ("monitoring.test_logs", "INFO", context.trace_id))
+        self.assertTrue(entry["message"].startswith("stdout: xxx"))
+        self.assertTrue(entry["message"].endswith("[408 characters truncated]"))
+
+    def test_file_is_rotated(self) -> None:
+        """Test that the file is rotated by size and only the configured backups are kept."""
+        for i in range(100):
+            self.logger.warning("message %d", i)
+        entries = self.read_entries()
+        self.assertEqual(entries[-1]["message"], "message 99")
+        self.assertLess(os.path.getsize(self.path), 2000)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self.path))),
+                         ["app.log", "app.log.1", "app.log.2", "app.log.lock"])
+
+    def test_processes_share_the_rotation(self) -> None:
+        """Test that handlers of different processes rotate in turn and lose no line."""
+        handlers = [SharedRotatingFileHandler(self.path, maxBytes=100, backupCount=9) for _ in range(2)]
+        for handler in handlers:
+            self.addCleanup(handler.close)
+        for i in range(60):
+            handlers[i % 2].emit(logging.LogRecord("test", logging.INFO, __file__, 1, "line %02d", (i,), None))
+        lines = []
+        for name in sorted(os.listdir(os.path.dirname(self.path)), reverse=True):
+            if name != "app.log.lock":
+                with open(os.path.join(os.path.dirname(self.path), name)) as f:
+                    lines.extend(f.read().splitlines())
+                    self.assertLessEqual(f.tell(), 100)
+        self.assertEqual(lines, [f"line {i:02d}" for i in range(60)])
+
+    def test_json_formatter_includes_exception(self) -> None:
+        """Test that a formatted exception is kept in its own field."""
+        try:
+            raise ValueError("bad input")
+        except ValueError:
+            record = logging.LogRecord("test", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "failed")
+        self.assertIn("ValueError: bad input", entry["exception"])
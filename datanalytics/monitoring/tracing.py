@@ -0,0 +1,174 @@
+"""Trace context that follows a request through Celery into gizmo.
+
+A trace is created per HTTP request (or continued from an incoming W3C
+``traceparent`` header) and kept in a context variable. Publishing a task copies
+it into the message headers, the worker restores it before the task runs and
+``run_command`` hands it to gizmo through environment variables.
+
+Finished spans are written as JSON lines to the ``monitoring.spans`` logger,
+which ``settings.LOGGING`` sends to ``TRACE_SPAN_LOG``. Gizmo appends its own
+spans to the same file, so grouping the file by ``trace_id`` gives the full
+breakdown of one run.
+"""
+
+import json
+import logging
+import re
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+span_logger = logging.getLogger("monitoring.spans")
+
+TRACE_ID_ENV = "DATANALYTICS_TRACE_ID"
+PARENT_SPAN_ENV = "DATANALYTICS_PARENT_SPAN_ID"
+SPAWN_TIME_ENV = "DATANALYTICS_SPAWN_TS"
+SPAN_LOG_ENV = "DATANALYTICS_SPAN_LOG"
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """Identifies the trace and the span that new spans become children of."""
+
+    trace_id: str
+    span_id: str
+
+    @property
+    def traceparent(self) -> str:
+        """The context as a W3C ``traceparent`` header value."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("datanalytics_span", default=None)
+
+
+def new_trace_id() -> str:
+    """Return a random 128-bit trace id in hex."""
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    """Return a random 64-bit span id in hex."""
+    return secrets.token_hex(8)
+
+
+def current() -> Optional[SpanContext]:
+    """Return the active span context, if any."""
+    return _current.get()
+
+
+def current_trace_id() -> str:
+    """Return the active trace id, or an empty string outside a trace."""
+    context = _current.get()
+    return context.trace_id if context else ""
+
+
+def activate(context: Optional[SpanContext]):
+    """Make a span context current and return the token that restores the previous one."""
+    return _current.set(context)
+
+
+def deactivate(token) -> None:
+    """Restore the span context that was current before ``activate``."""
+    _current.reset(token)
+
+
+def from_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C ``traceparent`` header.
+
+    :param header: Header value or None
+    :return: The remote span context, or None if the header is missing or invalid
+    """
+    match = TRACEPARENT_RE.match((header or "").strip().lower())
+    return SpanContext(match.group(1), match.group(2)) if match else None
+
+
+def record_span(name: str, start: float, end: float, context: SpanContext,
+                parent_span_id: Optional[str], **attributes) -> None:
+    """Write one finished span to the span log.
+
+    :param name: Span name, for example ``queue_wait`` or ``gizmo.train``
+    :param start: Start time as a Unix timestamp
+    :param end: End time as a Unix timestamp
+    :param context: Trace id and id of the span itself
+    :param parent_span_id: Id of the parent span, None for a root span
+    :param attributes: Extra key/value pairs stored with the span
+    """
+    span_logger.info(json.dumps({
+        "trace_id": context.trace_id,
+        "span_id": context.span_id,
+        "parent_span_id": parent_span_id,
+        "name": name,
+        "start": start,
+        "duration_ms": round((end - start) * 1000, 3),
+        **attributes,
+    }, default=str))
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[SpanContext]:
+    """Time a block as a child of the current span, starting a trace if needed.
+
+    :param name: Span name
+    :param attributes: Extra key/value pairs stored with the span
+    :return: Context manager yielding the new span's context
+    """
+    parent = _current.get()
+    context = SpanContext(parent.trace_id if parent else new_trace_id(), new_span_id())
+    token = _current.set(context)
+    start = time.time()
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        record_span(name, start, time.time(), context, parent.span_id if parent else None, **attributes)
+
+
+def subprocess_env(context: SpanContext) -> Dict[str, str]:
+    """Environment variables that let a child process join the trace.
+
+    :param context: The span the child process runs under
+    :return: Variables to add to the child's environment
+    """
+    return {
+        TRACE_ID_ENV: context.trace_id,
+        PARENT_SPAN_ENV: context.span_id,
+        SPAWN_TIME_ENV: repr(time.time()),
+        SPAN_LOG_ENV: str(settings.TRACE_SPAN_LOG),
+    }
+
+
+def load_trace(path: str, trace_id: str) -> List[dict]:
+    """Read every span of one trace from a span log, ordered by start time.
+
+    :param path: Span log file
+    :param trace_id: Trace to collect
+    :return: List of span dictionaries
+    """
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("trace_id") == trace_id:
+                spans.append(record)
+    return sorted(spans, key=lambda record: record["start"])
+
+
+class TraceIdFilter(logging.Filter):
+    """Add the active trace id to every log record as ``trace_id``."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Annotate the record; never drops it."""
+        if not hasattr(record, "trace_id"):
+            record.trace_id = current_trace_id() or "-"
+        return True
@@ -0,0 +1,8 @@
+"""URL configuration for the monitoring app."""
+
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path("metrics", views.metrics, name="metrics"),
+]
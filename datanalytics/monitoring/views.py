@@ -0,0 +1,24 @@
+"""Views for the monitoring app."""
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.views.decorators.http import require_http_methods
+
+from .metrics import CONTENT_TYPE, render
+
+
+@require_http_methods(["GET"])
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Expose all metrics in the Prometheus text format.
+
+    When ``METRICS_TOKEN`` is set, scrapers must send it as a bearer token.
+
+    :param request: The HTTP request
+    :type request: HttpRequest
+    :return: Plain text metrics page
+    :rtype: HttpResponse
+    """
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -1,6 +1,38 @@
-"""Admin configuration for the Project model."""
+"""Admin configuration for the projects app models."""
 
 from django.contrib import admin
-from .models import Project
+from .models import DatasetBlob, ParameterSet, Project, ResourceUsage, RetentionPolicy
 
-admin.site.register(Project)
\ No newline at end of file
+admin.site.register(Project)
+
+
+@admin.register(DatasetBlob)
+class DatasetBlobAdmin(admin.ModelAdmin):
+    """Uploaded input files, stored once per content."""
+
+    list_display = ("digest", "size_bytes", "refcount", "created_at", "updated_at")
+    readonly_fields = ("digest", "size_bytes", "refcount", "schema", "created_at", "updated_at")
+
+
+@admin.register(ResourceUsage)
+class ResourceUsageAdmin(admin.ModelAdmin):
+    """Run history of task and gizmo stage resource usage."""
+
+    list_display = ("project", "task_name", "stage", "wall_seconds", "cpu_user_seconds",
+                    "cpu_system_seconds", "peak_rss_bytes", "created_at")
+    list_filter = ("task_name", "stage")
+
+
+@admin.register(ParameterSet)
+class ParameterSetAdmin(admin.ModelAdmin):
+    """Saved versions of project parameters."""
+
+    list_display = ("project", "version", "digest", "created_at")
+    readonly_fields = ("project", "version", "params", "digest", "created_at")
+
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    """Sessions kept per user or per project."""
+
+    list_display = ("user", "project", "keep_sessions")
\ No newline at end of file
@@ -6,3 +6,7 @@ from django.apps import AppConfig
 class ProjectsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "projects"
+
+    def ready(self) -> None:
+        """Connect the Celery signal handlers and the page cache invalidation."""
+        from . import page_cache, signals  # noqa: F401
@@ -0,0 +1,362 @@
+"""Monotonic optimal binning of the project's ``optimal_binning_columns``.
+
+Each selected column is binned against the binary criterion in three steps:
+
+1. Its labelled values are sorted once and cut at exact quantiles into
+   ``PREBINS`` fine bins, whose good and bad counts come from cumulative sums
+   over the sorted criterion. Text columns start from one bin per value instead,
+   ordered by bad rate.
+2. Adjacent fine bins are pooled until the bad rate is monotonic (the
+   pool-adjacent-violators algorithm), in the increasing and the decreasing
+   direction.
+3. Bins holding less than ``MIN_BIN_SHARE`` of the rows are merged into a
+   neighbour, then the adjacent pair whose merge loses the least information
+   value is merged until at most ``MAX_BINS`` remain. Merging neighbours keeps
+   the bad rate monotonic. The direction with the higher IV is kept.
+
+Missing values get a bin of their own. Columns are binned in parallel, one per
+task on a billiard pool working from the columnar copy of ``projects.columnar``,
+and results are cached per input digest, column and criterion, so previewing the
+bins again, or after changing the selection, only bins the new columns.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from billiard.pool import Pool
+from django.conf import settings
+
+from .columnar import build_columnar, pool_map, read_text, read_values
+from .models import Project
+from .params import current_params
+
+BINNING_DIR = "binning"
+BINNING_VERSION = "2"
+
+PREBINS = 100
+MAX_BINS = 10
+MIN_BIN_SHARE = 0.05
+MAX_CATEGORIES = 1_000
+# Added to every good and bad count so empty bins have a finite WoE
+SMOOTHING = 0.5
+
+
+def woe_iv(goods: np.ndarray, bads: np.ndarray, total_goods: float, total_bads: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the weight of evidence and information value of each bin.
+
+    :param goods: Good counts per bin
+    :param bads: Bad counts per bin
+    :param total_goods: Good count over all bins, the missing bin included
+    :param total_bads: Bad count over all bins, the missing bin included
+    :return: Tuple of (WoE per bin, IV per bin)
+    """
+    share_goods = (goods + SMOOTHING) / (total_goods + SMOOTHING)
+    share_bads = (bads + SMOOTHING) / (total_bads + SMOOTHING)
+    woe = np.log(share_goods / share_bads)
+    return woe, (share_goods - share_bads) * woe
+
+
+def pool_adjacent_violators(goods: np.ndarray, bads: np.ndarray, increasing: bool) -> List[int]:
+    """Pool adjacent bins until their bad rates are monotonic.
+
+    :param goods: Good counts of the ordered fine bins
+    :param bads: Bad counts of the ordered fine bins
+    :param increasing: Direction of the bad rate
+    :return: Index of the first fine bin of every pooled bin
+    """
+    sign = 1.0 if increasing else -1.0
+    # Stack of pooled bins: (start, goods, bads)
+    stack: List[List[float]] = []
+    for start, (good, bad) in enumerate(zip(goods, bads)):
+        stack.append([start, good, bad])
+        while len(stack) > 1:
+            _, g1, b1 = stack[-2]
+            _, g2, b2 = stack[-1]
+            # Compare bad rates without dividing: b1 / (g1 + b1) > b2 / (g2 + b2)
+            if sign * (b1 * (g2 + b2) - b2 * (g1 + b1)) <= 0:
+                break
+            stack[-2][1] += g2
+            stack[-2][2] += b2
+            stack.pop()
+    return [int(start) for start, _, _ in stack]
+
+
+def merge_bins(starts: List[int], goods: np.ndarray, bads: np.ndarray, total_goods: float, total_bads: float,
+               max_bins: int, min_share: float) -> List[int]:
+    """Merge pooled bins that are too small, then the least informative pairs.
+
+    :param starts: Index of the first fine bin of every bin
+    :param goods: Good counts of the fine bins
+    :param bads: Bad counts of the fine bins
+    :param total_goods: Good count used for the WoE, the missing bin included
+    :param total_bads: Bad count used for the WoE, the missing bin included
+    :param max_bins: Maximum number of bins
+    :param min_share: Minimum share of the binned rows in every bin
+    :return: Index of the first fine bin of every remaining bin
+    """
+    starts = list(starts)
+    cumulative_goods = np.concatenate([[0.0], np.cumsum(goods)])
+    cumulative_bads = np.concatenate([[0.0], np.cumsum(bads)])
+    rows = cumulative_goods[-1] + cumulative_bads[-1]
+
+    def totals(bounds: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        edges = np.array(bounds + [len(goods)])
+        return np.diff(cumulative_goods[edges]), np.diff(cumulative_bads[edges])
+
+    while len(starts) > 1:
+        bin_goods, bin_bads = totals(starts)
+        sizes = bin_goods + bin_bads
+        smallest = int(np.argmin(sizes))
+        if sizes[smallest] >= min_share * rows:
+            break
+        if smallest == 0:
+            neighbour = 1
+        elif smallest == len(starts) - 1:
+            neighbour = smallest - 1
+        else:
+            # Join the neighbour with the closer bad rate
+            rates = bin_bads / np.maximum(sizes, 1)
+            left, right = abs(rates[smallest] - rates[smallest - 1]), abs(rates[smallest] - rates[smallest + 1])
+            neighbour = smallest - 1 if left <= right else smallest + 1
+        del starts[max(smallest, neighbour)]
+
+    while len(starts) > max_bins:
+        bin_goods, bin_bads = totals(starts)
+        _, iv = woe_iv(bin_goods, bin_bads, total_goods, total_bads)
+        _, merged_iv = woe_iv(bin_goods[:-1] + bin_goods[1:], bin_bads[:-1] + bin_bads[1:], total_goods, total_bads)
+        loss = iv[:-1] + iv[1:] - merged_iv
+        del starts[int(np.argmin(loss)) + 1]
+    return starts
+
+
+def optimal_bins(goods: np.ndarray, bads: np.ndarray, missing_goods: float = 0.0, missing_bads: float = 0.0,
+                 max_bins: int = MAX_BINS, min_share: float = MIN_BIN_SHARE) -> Dict[str, object]:
+    """Bin ordered fine bins monotonically with the highest information value.
+
+    :param goods: Good counts of the ordered fine bins
+    :param bads: Bad counts of the ordered fine bins
+    :param missing_goods: Good count of the missing values
+    :param missing_bads: Bad count of the missing values
+    :param max_bins: Maximum number of bins, the missing bin not included
+    :param min_share: Minimum share of the non-missing rows in every bin
+    :return: Dictionary with ``starts`` (first fine bin of every bin), ``direction`` and ``iv``
+    """
+    goods, bads = np.asarray(goods, dtype=np.float64), np.asarray(bads, dtype=np.float64)
+    total_goods = goods.sum() + missing_goods
+    total_bads = bads.sum() + missing_bads
+    best = None
+    for direction in ("increasing", "decreasing"):
+        starts = pool_adjacent_violators(goods, bads, increasing=direction == "increasing")
+        starts = merge_bins(starts, goods, bads, total_goods, total_bads, max_bins, min_share)
+        bin_goods = np.add.reduceat(goods, starts) if len(goods) else np.empty(0)
+        bin_bads = np.add.reduceat(bads, starts) if len(goods) else np.empty(0)
+        if missing_goods or missing_bads:
+            bin_goods, bin_bads = np.append(bin_goods, missing_goods), np.append(bin_bads, missing_bads)
+        _, iv = woe_iv(bin_goods, bin_bads, total_goods, total_bads)
+        candidate = {"starts": starts, "direction": direction, "iv": float(iv.sum())}
+        if best is None or candidate["iv"] > best["iv"]:
+            best = candidate
+    return best
+
+
+def describe_bins(labels: List[object], goods: np.ndarray, bads: np.ndarray, missing_goods: float,
+                  missing_bads: float) -> Tuple[List[Dict[str, object]], float]:
+    """Return the figures of every final bin and the total information value.
+
+    :param labels: Label of each bin, the missing bin last if it has rows
+    :param goods: Good counts of the bins, the missing bin excluded
+    :param bads: Bad counts of the bins, the missing bin excluded
+    :param missing_goods: Good count of the missing values
+    :param missing_bads: Bad count of the missing values
+    :return: Tuple of (bins, IV)
+    """
+    has_missing = bool(missing_goods or missing_bads)
+    goods = np.append(goods, missing_goods) if has_missing else goods
+    bads = np.append(bads, missing_bads) if has_missing else bads
+    woe, iv = woe_iv(goods, bads, goods.sum(), bads.sum())
+    bins = [
+        {**label, "count": int(good + bad), "goods": int(good), "bads": int(bad),
+         "bad_rate": float(bad / (good + bad)) if good + bad else None, "woe": float(w), "iv": float(v)}
+        for label, good, bad, w, v in zip(labels, goods, bads, woe, iv)
+    ]
+    return bins, float(iv.sum())
+
+
+def numeric_prebins(values: np.ndarray, target: np.ndarray, prebins: int = PREBINS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Cut sorted values at exact quantiles into fine bins and count goods and bads.
+
+    :param values: Labelled values without NaN
+    :param target: Criterion of each value, 1 for bad and 0 for good
+    :param prebins: Number of quantile bins before duplicate edges are dropped
+    :return: Tuple of (lower edge of every fine bin, goods, bads)
+    """
+    if not len(values):
+        return np.empty(0), np.empty(0), np.empty(0)
+    order = np.argsort(values, kind="stable")
+    ordered = values[order]
+    cumulative_bads = np.concatenate([[0.0], np.cumsum(target[order])])
+    lows = np.unique(ordered[(np.arange(prebins) * len(ordered)) // prebins])
+    bounds = np.append(np.searchsorted(ordered, lows, side="left"), len(ordered))
+    bads = np.diff(cumulative_bads[bounds])
+    return lows, np.diff(bounds) - bads, bads
+
+
+def bin_numeric(values: np.ndarray, target: np.ndarray) -> Dict[str, object]:
+    """Bin a numeric column, NaN values going to the missing bin."""
+    missing = np.isnan(values)
+    lows, goods, bads = numeric_prebins(values[~missing], target[~missing])
+    missing_bads = float(target[missing].sum())
+    missing_goods = float(missing.sum()) - missing_bads
+    result = optimal_bins(goods, bads, missing_goods, missing_bads)
+    starts = result["starts"]
+    # Open ends are None: browsers reject the Infinity that json would write
+    bounds = [None] + [float(lows[start]) for start in starts[1:]] + [None]
+    labels = [{"low": low, "high": high} for low, high in zip(bounds[:-1], bounds[1:])] if len(lows) else []
+    if missing_goods or missing_bads:
+        labels.append({"missing": True})
+    bins, iv = describe_bins(labels, np.add.reduceat(goods, starts) if len(goods) else goods,
+                             np.add.reduceat(bads, starts) if len(bads) else bads, missing_goods, missing_bads)
+    return {"kind": "numeric", "direction": result["direction"], "iv": iv, "bins": bins}
+
+
+def bin_text(counts: pd.DataFrame, missing_goods: float, missing_bads: float) -> Dict[str, object]:
+    """Bin a text column from its good and bad counts per value.
+
+    :param counts: DataFrame indexed by value with ``goods`` and ``bads`` columns
+    :param missing_goods: Good count of the missing values
+    :param missing_bads: Bad count of the missing values
+    :return: Binning of the column
+    """
+    counts = counts.assign(rows=counts["goods"] + counts["bads"]).sort_values("rows", ascending=False)
+    if len(counts) > MAX_CATEGORIES:
+        rest = counts.iloc[MAX_CATEGORIES:][["goods", "bads"]].sum()
+        counts = counts.iloc[:MAX_CATEGORIES]
+        counts.loc["Other"] = [rest["goods"], rest["bads"], rest["goods"] + rest["bads"]]
+    counts = counts.assign(rate=counts["bads"] / counts["rows"]).sort_values(["rate", "rows"], kind="stable")
+    goods, bads = counts["goods"].to_numpy(dtype=np.float64), counts["bads"].to_numpy(dtype=np.float64)
+    result = optimal_bins(goods, bads, missing_goods, missing_bads)
+    starts = result["starts"]
+    values = [str(value) for value in counts.index]
+    labels = [{"values": values[start:end]} for start, end in zip(starts, starts[1:] + [len(values)])]
+    if missing_goods or missing_bads:
+        labels.append({"missing": True})
+    bins, iv = describe_bins(labels, np.add.reduceat(goods, starts) if len(goods) else goods,
+                             np.add.reduceat(bads, starts) if len(bads) else bads, missing_goods, missing_bads)
+    return {"kind": "text", "direction": "by bad rate", "iv": iv, "bins": bins}
+
+
+def bin_column(args: Tuple[str, int, str, str, int, int]) -> Dict[str, object]:
+    """Bin one column of the columnar copy against the criterion.
+
+    :param args: (directory, column index, column name, kind, criterion index, number of blocks)
+    :return: Binning of the column
+    """
+    directory, index, name, kind, criterion, blocks = args
+    targets = [np.asarray(read_values(directory, block, criterion)) for block in range(blocks)]
+    labelled = [~np.isnan(target) for target in targets]
+    if kind == "numeric":
+        values = np.concatenate([read_values(directory, block, index)[mask] for block, mask in enumerate(labelled)])
+        target = np.concatenate([target[mask] for target, mask in zip(targets, labelled)])
+        result = bin_numeric(values, (target == 1).astype(np.float64))
+    elif kind == "text":
+        parts, missing_goods, missing_bads = [], 0.0, 0.0
+        for block, (target, mask) in enumerate(zip(targets, labelled)):
+            codes, uniques = read_text(directory, block, index)
+            codes = codes[mask]
+            bad = (target[mask] == 1).astype(np.float64)
+            present = codes >= 0
+            bads = np.bincount(codes[present], weights=bad[present], minlength=len(uniques))
+            rows = np.bincount(codes[present], minlength=len(uniques))
+            parts.append(pd.DataFrame({"goods": rows - bads, "bads": bads}, index=pd.Index(uniques.astype(object))))
+            missing_bads += float(bad[~present].sum())
+            missing_goods += float((~present).sum()) - float(bad[~present].sum())
+        counts = pd.concat(parts).groupby(level=0).sum() if parts else pd.DataFrame(columns=["goods", "bads"])
+        result = bin_text(counts, missing_goods, missing_bads)
+    else:
+        return {"column": name, "kind": kind, "error": "Date columns are not binned"}
+    return {"column": name, **result}
+
+
+def bin_columns(path: str, columns: Sequence[str], criterion: str, workers: int,
+                scratch_dir: Optional[str] = None) -> List[Dict[str, object]]:
+    """Bin columns of a CSV file against a binary criterion on a process pool.
+
+    :param path: Path of the CSV file
+    :param columns: Columns to bin
+    :param criterion: Criterion column, 1 for bad and 0 for good, other values are ignored
+    :param workers: Number of worker processes
+    :param scratch_dir: Directory for the columnar copy, defaults to the system temporary directory
+    :return: Binning of each column, in the order requested
+    """
+    if not columns:
+        return []
+    with tempfile.TemporaryDirectory(prefix="binning-", dir=scratch_dir) as directory, Pool(workers) as pool:
+        copy = build_columnar(path, directory, pool, min_blocks=2 * workers, usecols=[*columns, criterion])
+        if copy.kinds[copy.columns.index(criterion)] != "numeric":
+            raise ValueError(f"Criterion column {criterion} is not numeric")
+        results = pool_map(pool, bin_column, [
+            (directory, copy.columns.index(name), name, copy.kinds[copy.columns.index(name)],
+             copy.columns.index(criterion), len(copy.rows))
+            for name in columns
+        ])
+    return results
+
+
+def binning_key(digest: str, column: str, criterion: str) -> str:
+    """Return the cache key of a column's bins."""
+    payload = json.dumps({
+        "input": digest, "column": column, "criterion": criterion, "version": BINNING_VERSION,
+        "prebins": PREBINS, "max_bins": MAX_BINS, "min_share": MIN_BIN_SHARE,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def binning_path(key: str) -> str:
+    """Return the path of a cached binning."""
+    return os.path.join(settings.MEDIA_ROOT, BINNING_DIR, key[:2], f"{key}.json")
+
+
+def cached_bins(digest: str, columns: Sequence[str], criterion: str) -> Dict[str, Dict[str, object]]:
+    """Return the cached bins of the columns that have them.
+
+    :param digest: Digest of the input file
+    :param columns: Columns to look up
+    :param criterion: Criterion column
+    :return: Binning by column name
+    """
+    found = {}
+    for column in columns:
+        try:
+            with open(binning_path(binning_key(digest, column, criterion)), encoding="utf-8") as f:
+                found[column] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return found
+
+
+def store_bins(digest: str, criterion: str, results: Sequence[Dict[str, object]]) -> None:
+    """Cache the bins of columns, each file replaced in one step."""
+    for result in results:
+        path = binning_path(binning_key(digest, result["column"], criterion))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, allow_nan=False)
+        os.replace(tmp_path, path)
+
+
+def binning_params(project: Project) -> Tuple[Optional[str], List[str]]:
+    """Return the criterion column and the columns selected for optimal binning.
+
+    :param project: The project
+    :return: Tuple of (criterion column, selected columns), (None, []) if the parameters are not saved
+    """
+    params = current_params(project)
+    if not params:
+        return None, []
+    return params.get("criterion_column"), list(params.get("optimal_binning_columns") or [])
@@ -0,0 +1,206 @@
+"""Content-addressed storage of uploaded input files.
+
+Each upload is hashed while Django streams it in (see ``FILE_UPLOAD_HANDLERS``)
+and stored once under ``blobs/<xx>/<sha256>.csv`` in ``MEDIA_ROOT``, however many
+projects upload the same file. A project's ``input_data/<user>_<project>/input.csv``
+is a hard link to its blob, so gizmo and the tasks keep reading the path they
+always did. Where the file system refuses hard links the blob is copied instead.
+
+Blobs are read-only: the links share one inode, and a file appended to in place
+would change the input of every project using it.
+
+``Project.input_digest`` is set at upload, so everything keyed by it, the
+analysis reports of ``projects.report_cache`` and the binning results of
+``projects.binning``, is computed once per content. The first validation of a
+file also stores its columns and date column on the ``DatasetBlob``, and later
+uploads of the same content are accepted without parsing it again.
+
+``DatasetBlob.refcount`` counts the projects using a blob and is updated by
+``projects.signals`` when a project is saved or deleted. ``collect_blobs``, run
+by ``projects.retention``, removes blobs no project has used for a day; the input
+directory of a deleted project keeps its link until retention archives it.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.utils import timezone
+
+from .models import DatasetBlob, Project, get_input_dataframe_file_name
+
+BLOB_DIR = "blobs"
+# Unreferenced blobs younger than this may be about to be linked by an upload
+GRACE_SECONDS = 24 * 60 * 60
+CHUNK_BYTES = 1024 * 1024
+
+
+class HashingUploadMixin:
+    """Upload handler mixin that hashes each file as its chunks arrive."""
+
+    def new_file(self, *args, **kwargs) -> None:
+        """Start the hash of a new file."""
+        # Before the parent, which raises StopFutureHandlers when it takes the file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def hashing(self) -> bool:
+        """Whether this handler keeps the file, and so has to hash it."""
+        return True
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> Optional[bytes]:
+        """Add a chunk to the hash and pass it on."""
+        if self.hashing():
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size: int):
+        """Attach the hex digest to the uploaded file as ``sha256``."""
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    """Keep small uploads in memory and hash them."""
+
+    def hashing(self) -> bool:
+        """Hash only when the request is small enough to be kept in memory."""
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    """Stream large uploads to a temporary file and hash them."""
+
+
+def upload_digest(upload) -> str:
+    """Return the SHA-256 of an uploaded file, from the upload handler when it took it.
+
+    :param upload: Uploaded file or any Django ``File``
+    :return: Hex digest
+    """
+    digest = getattr(upload, "sha256", None)
+    if digest is None:
+        sha = hashlib.sha256()
+        for chunk in upload.chunks(CHUNK_BYTES):
+            sha.update(chunk)
+        upload.seek(0)
+        digest = sha.hexdigest()
+    return digest
+
+
+def blob_name(digest: str) -> str:
+    """Return the storage name of a blob relative to ``MEDIA_ROOT``."""
+    return os.path.join(BLOB_DIR, digest[:2], f"{digest}.csv")
+
+
+def blob_path(digest: str) -> str:
+    """Return the absolute path of a blob."""
+    return os.path.join(settings.MEDIA_ROOT, blob_name(digest))
+
+
+def known_schema(digest: str) -> Optional[Dict[str, object]]:
+    """Return the schema stored when a content was first validated.
+
+    :param digest: SHA-256 of the content
+    :return: Columns and date column, None if the content was never stored
+    """
+    schema = DatasetBlob.objects.filter(digest=digest).values_list("schema", flat=True).first()
+    if schema is None or not os.path.exists(blob_path(digest)):
+        return None
+    return schema
+
+
+def store_blob(upload, digest: str, schema: Optional[Dict[str, object]] = None) -> DatasetBlob:
+    """Store an upload as the blob of its digest, writing it only if it is not stored yet.
+
+    :param upload: Uploaded file
+    :param digest: Its SHA-256
+    :param schema: Columns and date column found by validation
+    :return: The blob
+    """
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as dst:
+            for chunk in upload.chunks(CHUNK_BYTES):
+                dst.write(chunk)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+    blob, created = DatasetBlob.objects.get_or_create(
+        digest=digest, defaults={"size_bytes": os.path.getsize(path), "schema": schema}
+    )
+    if not created:
+        # Saving bumps updated_at, which keeps the blob from collection while it is linked
+        if blob.schema is None:
+            blob.schema = schema
+        blob.save()
+    return blob
+
+
+def link_input(project: Project, digest: str) -> str:
+    """Make the project's input file a link to a blob.
+
+    :param project: The project, with its user
+    :param digest: SHA-256 of the blob
+    :return: Storage name of the input file
+    """
+    name = get_input_dataframe_file_name(project, "input.csv")
+    target = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        os.link(blob_path(digest), tmp_path)
+    except OSError:
+        shutil.copyfile(blob_path(digest), tmp_path)
+    os.replace(tmp_path, target)
+    return name
+
+
+def attach_input(project: Project, upload, digest: str, schema: Optional[Dict[str, object]] = None) -> DatasetBlob:
+    """Store an upload once and point the project's input file at it; the project is not saved.
+
+    :param project: The project, with its user
+    :param upload: Uploaded file
+    :param digest: Its SHA-256
+    :param schema: Columns and date column found by validation
+    :return: The blob
+    """
+    blob = store_blob(upload, digest, schema)
+    project.input_dataframe = link_input(project, digest)
+    project.input_digest = digest
+    return blob
+
+
+def update_refcount(digest: str) -> None:
+    """Count again the projects whose input file is the blob of a digest."""
+    DatasetBlob.objects.filter(digest=digest).update(refcount=Project.objects.filter(input_digest=digest).count())
+
+
+def collect_blobs(grace_seconds: int = GRACE_SECONDS) -> Dict[str, int]:
+    """Remove the blobs no project uses.
+
+    :param grace_seconds: Blobs stored or linked more recently are kept
+    :return: Blobs removed and bytes they took
+    """
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    removed, freed = 0, 0
+    for blob in DatasetBlob.objects.filter(refcount=0, updated_at__lt=cutoff):
+        if Project.objects.filter(input_digest=blob.digest).exists():
+            update_refcount(blob.digest)
+            continue
+        try:
+            os.remove(blob_path(blob.digest))
+        except FileNotFoundError:
+            pass
+        blob.delete()
+        removed += 1
+        freed += blob.size_bytes
+    return {"blobs_removed": removed, "blob_bytes_freed": freed}
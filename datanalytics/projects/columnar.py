@@ -0,0 +1,249 @@
+"""Parallel profiling of wide CSV files through a columnar on-disk copy.
+
+The file is cut at line boundaries into byte ranges ("blocks") that pool workers
+parse independently. Each worker writes every column of its block as a ``.npy``
+file: numeric columns as float64 with NaN for missing or unparsable values,
+date columns as int64 nanoseconds with NaT, and text columns as int32 codes plus
+a fixed-width array of the block's distinct values. All of them can be opened
+with ``np.load(mmap_mode="r")``, so the workers that profile a column later map
+its blocks instead of receiving pickled DataFrame slices.
+
+Blocks are only cut when the file contains no quote characters, since a quoted
+field may span lines; otherwise the whole file is one block.
+
+``profile_csv_parallel`` then hands out one column per task, so a file with many
+columns is profiled on all cores. Pools come from billiard, which, unlike
+multiprocessing, may start children from a daemonic Celery worker process.
+"""
+
+import io
+import math
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from billiard.pool import Pool
+from django.conf import settings
+
+from .profiling import DATE_FORMAT, ColumnProfile, DatasetProfile, infer_kind, profile_csv
+
+BLOCK_BYTES = 32 * 1024 * 1024
+QUOTE_SAMPLE_BYTES = 1024 * 1024
+KIND_SAMPLE_ROWS = 10_000
+
+NAT = np.iinfo(np.int64).min
+
+
+@dataclass
+class ColumnarCopy:
+    """Layout of a columnar copy and the per-block counts taken while writing it."""
+
+    directory: str
+    columns: List[str]
+    kinds: List[str]
+    rows: List[int]
+    missing: List[List[int]]
+    invalid: List[List[int]]
+
+    def column_blocks(self, index: int) -> List[Tuple[int, int, int]]:
+        """Return (block, missing, invalid) for every block of a column."""
+        return [(block, self.missing[block][index], self.invalid[block][index]) for block in range(len(self.rows))]
+
+
+def block_path(directory: str, block: int, column: int, part: str = "values") -> str:
+    """Return the file of one part of a column in a block."""
+    return os.path.join(directory, f"{block:05d}_{column:05d}_{part}.npy")
+
+
+def pool_map(pool: Pool, func: Callable, items: Sequence) -> List:
+    """Apply a function to every item on a billiard pool, one task per item.
+
+    Tasks are submitted one by one because billiard credits the results of a
+    ``map`` to a single worker, leaving the others to wait out a 30 second
+    timeout for acknowledgements when the pool shuts down.
+
+    :param pool: Process pool
+    :param func: Picklable function of one argument
+    :param items: Arguments
+    :return: Results in the order of the items
+    """
+    return [result.get() for result in [pool.apply_async(func, (item,)) for item in items]]
+
+
+def split_blocks(path: str, min_blocks: int) -> List[Tuple[int, int]]:
+    """Cut the data rows of a CSV file into byte ranges that start at a line.
+
+    :param path: Path of the CSV file
+    :param min_blocks: Minimum number of blocks, more are used so none exceeds ``BLOCK_BYTES``
+    :return: List of (start, end) byte offsets
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()
+        data_start = f.tell()
+        if b'"' in f.read(QUOTE_SAMPLE_BYTES):
+            return [(data_start, size)]
+
+        blocks = max(min_blocks, math.ceil((size - data_start) / BLOCK_BYTES), 1)
+        boundaries = [data_start]
+        for i in range(1, blocks):
+            f.seek(data_start + (size - data_start) * i // blocks)
+            f.readline()
+            boundary = f.tell()
+            if boundaries[-1] < boundary < size:
+                boundaries.append(boundary)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def convert_block(args: Tuple[str, str, int, int, int, Sequence[str], Sequence[str], Sequence[str]]) -> Dict[str, object]:
+    """Parse one block of the CSV file and write its columns.
+
+    :param args: (path, directory, block, start, end, header, columns, kinds)
+    :return: Rows in the block and the missing and invalid values of each column
+    """
+    path, directory, block, start, end, header, columns, kinds = args
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    dtype = {name: str for name, kind in zip(columns, kinds) if kind != "numeric"}
+    df = pd.read_csv(io.BytesIO(data), header=None, names=list(header), usecols=list(columns), dtype=dtype)
+
+    missing, invalid = [], []
+    for index, (name, kind) in enumerate(zip(columns, kinds)):
+        series = df[name]
+        absent = int(series.isna().sum())
+        if kind == "numeric":
+            values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64)
+            bad = int(np.isnan(values).sum()) - absent
+            np.save(block_path(directory, block, index), values)
+        elif kind == "date":
+            values = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce").to_numpy(dtype="datetime64[ns]")
+            values = values.view(np.int64)
+            bad = int((values == NAT).sum()) - absent
+            np.save(block_path(directory, block, index), values)
+        else:
+            codes, uniques = pd.factorize(series)
+            bad = 0
+            np.save(block_path(directory, block, index, "codes"), codes.astype(np.int32))
+            np.save(block_path(directory, block, index, "uniques"),
+                    np.asarray(uniques, dtype=str) if len(uniques) else np.empty(0, dtype="U1"))
+        missing.append(absent)
+        invalid.append(bad)
+    return {"rows": len(df), "missing": missing, "invalid": invalid}
+
+
+def build_columnar(path: str, directory: str, pool, min_blocks: int,
+                   usecols: Optional[Sequence[str]] = None) -> ColumnarCopy:
+    """Write a columnar copy of a CSV file, parsing its blocks on a process pool.
+
+    :param path: Path of the CSV file
+    :param directory: Empty directory that receives the copy
+    :param pool: Process pool
+    :param min_blocks: Minimum number of blocks, usually a multiple of the pool size
+    :param usecols: Columns to copy, all by default
+    :return: Layout of the copy, with the columns in file order
+    """
+    header = [str(name) for name in pd.read_csv(path, nrows=0).columns]
+    head = pd.read_csv(path, nrows=KIND_SAMPLE_ROWS, usecols=usecols)
+    columns = [str(name) for name in head.columns]
+    kinds = [infer_kind(head[name]) for name in head.columns]
+    ranges = split_blocks(path, min_blocks)
+    results = pool_map(pool, convert_block, [
+        (path, directory, block, start, end, header, columns, kinds)
+        for block, (start, end) in enumerate(ranges)
+    ])
+    return ColumnarCopy(
+        directory=directory,
+        columns=columns,
+        kinds=kinds,
+        rows=[result["rows"] for result in results],
+        missing=[result["missing"] for result in results],
+        invalid=[result["invalid"] for result in results],
+    )
+
+
+def read_text(directory: str, block: int, column: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Map the codes and distinct values of a text column in a block; missing values have code -1."""
+    codes = np.load(block_path(directory, block, column, "codes"), mmap_mode="r")
+    uniques = np.load(block_path(directory, block, column, "uniques"), mmap_mode="r")
+    return codes, uniques
+
+
+def read_text_counts(directory: str, block: int, column: int) -> pd.Series:
+    """Return the number of occurrences of each value of a text column in a block."""
+    codes, uniques = read_text(directory, block, column)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return pd.Series(counts, index=pd.Index(uniques.astype(object)))
+
+
+def read_values(directory: str, block: int, column: int) -> np.ndarray:
+    """Map the values of a numeric or date column in a block."""
+    return np.load(block_path(directory, block, column), mmap_mode="r")
+
+
+def profile_column(args: Tuple[str, int, str, str, List[Tuple[int, int, int]]]) -> ColumnProfile:
+    """Profile one column from its blocks in the columnar copy.
+
+    :param args: (directory, column index, column name, kind, (block, missing, invalid) per block)
+    :return: Profile of the column
+    """
+    directory, index, name, kind, blocks = args
+    column = ColumnProfile(name, kind)
+    for block, missing, invalid in blocks:
+        column.missing += missing
+        if kind == "numeric":
+            values = read_values(directory, block, index)
+            column.update_numeric(values[~np.isnan(values)], invalid=invalid)
+        elif kind == "date":
+            values = read_values(directory, block, index)
+            column.update_dates(values[values != NAT], invalid=invalid)
+        else:
+            column.update_text(read_text_counts(directory, block, index))
+    return column
+
+
+def profile_csv_parallel(path: str, workers: int, scratch_dir: Optional[str] = None,
+                         source: Optional[str] = None) -> DatasetProfile:
+    """Profile a CSV file on a process pool, one column per task.
+
+    The figures match ``profile_csv`` except for the sketched estimates, which
+    see the values in a different order.
+
+    :param path: Path of the CSV file
+    :param workers: Number of worker processes
+    :param scratch_dir: Directory for the columnar copy, defaults to the system temporary directory
+    :param source: Name shown in the report, defaults to the path
+    :return: The dataset profile
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="profile-", dir=scratch_dir) as directory, Pool(workers) as pool:
+        copy = build_columnar(path, directory, pool, min_blocks=2 * workers)
+        columns = pool_map(pool, profile_column, [
+            (directory, index, name, kind, copy.column_blocks(index))
+            for index, (name, kind) in enumerate(zip(copy.columns, copy.kinds))
+        ])
+    return DatasetProfile(
+        source=source or path,
+        rows=sum(copy.rows),
+        columns=columns,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def profile_input(path: str, source: Optional[str] = None) -> DatasetProfile:
+    """Profile a full input file, in parallel when it is wide enough to pay off.
+
+    :param path: Path of the CSV file
+    :param source: Name shown in the report, defaults to the path
+    :return: The dataset profile
+    """
+    workers = settings.REPORT_WORKERS
+    columns = len(pd.read_csv(path, nrows=0).columns)
+    if workers > 1 and columns >= settings.REPORT_PARALLEL_MIN_COLUMNS:
+        return profile_csv_parallel(path, workers, settings.REPORT_SCRATCH_DIR, source=source)
+    return profile_csv(path, source=source)
@@ -0,0 +1,422 @@
+"""Per-period aggregate cube of a project's input file.
+
+The cube holds, for every observation period and every column, the number of
+rows in each bin of the column together with how many of them carry a
+criterion value and the sum of those values. Numeric columns are binned at
+quantile edges and text columns by their most frequent values, plus one bin for
+everything else and one for missing values. Each period also has its own row,
+labelled and criterion totals.
+
+That is enough to answer period stability (PSI) and bad rate by period questions
+without touching the CSV again: a query sums a few small arrays. The cube
+remembers how many bytes of the input it has seen, so when rows are appended to
+the file only the new bytes are read.
+
+The cube is stored as a single ``.npz`` file whose ``manifest`` entry carries the
+JSON metadata (periods, columns, bin edges, categories, input position), and is
+replaced atomically, so readers never see half an update.
+"""
+
+import copy
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .models import Project, get_project_file_name
+from .params import current_params
+from .profiling import infer_kind
+
+CUBE_DIR = "cubes"
+CUBE_VERSION = 1
+
+PERIOD_FORMAT = "%m/%d/%Y"
+NUMERIC_BINS = 10
+TOP_CATEGORIES = 20
+# Bin slots per column: the categories, "other" and "missing"
+WIDTH = TOP_CATEGORIES + 2
+OTHER = WIDTH - 2
+MISSING = WIDTH - 1
+
+HEAD_BYTES = 64 * 1024
+PSI_EPSILON = 1e-4
+
+
+@dataclass
+class Cube:
+    """Aggregates of one input file by period, column and bin."""
+
+    date_column: str
+    criterion_column: str
+    header: List[str]
+    columns: List[str]
+    kinds: List[str]
+    edges: Dict[str, List[float]] = field(default_factory=dict)
+    categories: Dict[str, List[str]] = field(default_factory=dict)
+    periods: List[str] = field(default_factory=list)
+    counts: Optional[np.ndarray] = None
+    labelled: Optional[np.ndarray] = None
+    bads: Optional[np.ndarray] = None
+    period_rows: Optional[np.ndarray] = None
+    period_labelled: Optional[np.ndarray] = None
+    period_bads: Optional[np.ndarray] = None
+    undated_rows: int = 0
+    offset: int = 0
+    head_digest: str = ""
+
+    def __post_init__(self) -> None:
+        """Allocate empty arrays for a new cube."""
+        shape = (len(self.periods), len(self.columns), WIDTH)
+        if self.counts is None:
+            self.counts = np.zeros(shape, dtype=np.int64)
+            self.labelled = np.zeros(shape, dtype=np.int64)
+            self.bads = np.zeros(shape, dtype=np.float64)
+            self.period_rows = np.zeros(len(self.periods), dtype=np.int64)
+            self.period_labelled = np.zeros(len(self.periods), dtype=np.int64)
+            self.period_bads = np.zeros(len(self.periods), dtype=np.float64)
+
+    @property
+    def rows(self) -> int:
+        """Number of rows aggregated, including rows without a valid period."""
+        return int(self.period_rows.sum()) + self.undated_rows
+
+    def manifest(self) -> Dict[str, object]:
+        """Return the metadata stored next to the arrays."""
+        return {
+            "version": CUBE_VERSION,
+            "date_column": self.date_column,
+            "criterion_column": self.criterion_column,
+            "header": self.header,
+            "columns": self.columns,
+            "kinds": self.kinds,
+            "edges": self.edges,
+            "categories": self.categories,
+            "periods": self.periods,
+            "undated_rows": self.undated_rows,
+            "offset": self.offset,
+            "head_digest": self.head_digest,
+        }
+
+    def bin_labels(self, column: str) -> List[str]:
+        """Return the label of every bin slot of a column, unused slots included."""
+        labels = [""] * WIDTH
+        if column in self.edges:
+            bounds = [-np.inf] + self.edges[column] + [np.inf]
+            for i, (low, high) in enumerate(zip(bounds[:-1], bounds[1:])):
+                labels[i] = f"[{low:.6g}, {high:.6g})"
+        else:
+            for i, category in enumerate(self.categories.get(column, [])):
+                labels[i] = category
+            labels[OTHER] = "Other"
+        labels[MISSING] = "Missing"
+        return labels
+
+    def used_bins(self, column: str) -> np.ndarray:
+        """Return the bin slots a column can fill."""
+        if column in self.edges:
+            slots = list(range(len(self.edges[column]) + 1))
+        else:
+            slots = list(range(len(self.categories.get(column, [])))) + [OTHER]
+        return np.array(slots + [MISSING])
+
+    def period_mask(self, periods: Sequence[str]) -> np.ndarray:
+        """Return a boolean mask over the cube's periods."""
+        wanted = set(periods)
+        return np.array([period in wanted for period in self.periods], dtype=bool)
+
+    def psi(self, base: Sequence[str], target: Sequence[str],
+            columns: Optional[Sequence[str]] = None) -> Dict[str, float]:
+        """Return the population stability index of columns between two sets of periods.
+
+        :param base: Periods of the reference distribution
+        :param target: Periods compared with the reference
+        :param columns: Columns to compute, all by default
+        :return: PSI by column, NaN when either side has no rows
+        """
+        indexes = [self.columns.index(column) for column in (columns or self.columns)]
+        expected = self.counts[self.period_mask(base)][:, indexes].sum(axis=0).astype(np.float64)
+        actual = self.counts[self.period_mask(target)][:, indexes].sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            p = np.clip(expected / expected.sum(axis=1, keepdims=True), PSI_EPSILON, None)
+            q = np.clip(actual / actual.sum(axis=1, keepdims=True), PSI_EPSILON, None)
+            values = ((q - p) * np.log(q / p)).sum(axis=1)
+        return {self.columns[i]: float(value) for i, value in zip(indexes, values)}
+
+    def bad_rates(self, column: Optional[str] = None) -> Dict[str, object]:
+        """Return the criterion rate of every period, optionally per bin of a column.
+
+        :param column: Column whose bins are broken down, None for period totals only
+        :return: JSON serializable dictionary
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rates = self.period_bads / self.period_labelled
+        result = {
+            "periods": [
+                {"period": period, "rows": int(rows), "labelled": int(labelled), "bads": float(bads),
+                 "bad_rate": None if np.isnan(rate) else float(rate)}
+                for period, rows, labelled, bads, rate in zip(
+                    self.periods, self.period_rows, self.period_labelled, self.period_bads, rates)
+            ],
+        }
+        if column is not None:
+            index = self.columns.index(column)
+            slots = self.used_bins(column)
+            labels = self.bin_labels(column)
+            counts, labelled, bads = (array[:, index, slots] for array in (self.counts, self.labelled, self.bads))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                bin_rates = bads / labelled
+            result["column"] = column
+            result["bins"] = [labels[slot] for slot in slots]
+            result["counts"] = counts.tolist()
+            result["bad_rates"] = [[None if np.isnan(rate) else float(rate) for rate in row] for row in bin_rates]
+        return result
+
+    def _add_periods(self, periods: Sequence[str]) -> None:
+        """Grow the arrays for periods seen for the first time."""
+        known = set(self.periods)
+        new = [period for period in dict.fromkeys(periods) if period not in known]
+        if not new:
+            return
+        self.periods.extend(new)
+        grow = ((0, len(new)), (0, 0), (0, 0))
+        self.counts = np.pad(self.counts, grow)
+        self.labelled = np.pad(self.labelled, grow)
+        self.bads = np.pad(self.bads, grow)
+        self.period_rows = np.pad(self.period_rows, (0, len(new)))
+        self.period_labelled = np.pad(self.period_labelled, (0, len(new)))
+        self.period_bads = np.pad(self.period_bads, (0, len(new)))
+
+    def _sort_periods(self) -> None:
+        """Order the periods chronologically."""
+        order = np.argsort(pd.to_datetime(self.periods, format=PERIOD_FORMAT).to_numpy(), kind="stable")
+        self.periods = [self.periods[i] for i in order]
+        for name in ("counts", "labelled", "bads", "period_rows", "period_labelled", "period_bads"):
+            setattr(self, name, getattr(self, name)[order])
+
+    def _slots(self, column: str, kind: str, values: pd.Series) -> np.ndarray:
+        """Return the bin slot of every value of a column."""
+        if kind == "numeric":
+            numbers = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+            slots = np.searchsorted(np.asarray(self.edges[column]), numbers, side="right")
+            slots[np.isnan(numbers)] = MISSING
+            return slots
+        # Chunks where a text column happens to look numeric are compared as text too
+        text = values.where(values.isna(), values.astype(str))
+        codes = pd.Categorical(text, categories=self.categories[column]).codes.astype(np.int64)
+        slots = np.where(codes >= 0, codes, OTHER)
+        slots[values.isna().to_numpy()] = MISSING
+        return slots
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """Add the rows of one chunk."""
+        dates = pd.to_datetime(chunk[self.date_column], errors="coerce")
+        dated = dates.notna().to_numpy()
+        self.undated_rows += int((~dated).sum())
+        if not dated.any():
+            return
+        chunk = chunk[dated]
+        labels = dates[dated].dt.strftime(PERIOD_FORMAT)
+        self._add_periods(labels.unique())
+        period = pd.Categorical(labels, categories=self.periods).codes.astype(np.int64)
+
+        criterion = pd.to_numeric(chunk[self.criterion_column], errors="coerce").to_numpy(dtype=np.float64)
+        has_label = ~np.isnan(criterion)
+        criterion = np.where(has_label, criterion, 0.0)
+
+        periods = len(self.periods)
+        self.period_rows += np.bincount(period, minlength=periods)
+        self.period_labelled += np.bincount(period, weights=has_label, minlength=periods).astype(np.int64)
+        self.period_bads += np.bincount(period, weights=criterion, minlength=periods)
+
+        cells = periods * WIDTH
+        for index, (column, kind) in enumerate(zip(self.columns, self.kinds)):
+            flat = period * WIDTH + self._slots(column, kind, chunk[column])
+            self.counts[:, index] += np.bincount(flat, minlength=cells).reshape(periods, WIDTH)
+            self.labelled[:, index] += np.bincount(
+                flat, weights=has_label, minlength=cells).reshape(periods, WIDTH).astype(np.int64)
+            self.bads[:, index] += np.bincount(flat, weights=criterion, minlength=cells).reshape(periods, WIDTH)
+
+
+def head_digest(path: str) -> str:
+    """Return the digest of the first bytes of a file, used to tell appends from replacements."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read(HEAD_BYTES)).hexdigest()
+
+
+def new_cube(first: pd.DataFrame, date_column: str, criterion_column: str) -> Cube:
+    """Create an empty cube whose bins are fitted on a first chunk.
+
+    :param first: First chunk of the file
+    :param date_column: Observation date column
+    :param criterion_column: Criterion column
+    :return: Empty cube
+    """
+    header = [str(name) for name in first.columns]
+    columns = [name for name in header if name not in (date_column, criterion_column)]
+    cube = Cube(date_column=date_column, criterion_column=criterion_column, header=header,
+                columns=columns, kinds=[])
+    for column in columns:
+        kind = infer_kind(first[column])
+        if kind == "numeric":
+            values = first[column].to_numpy(dtype=np.float64)
+            values = values[~np.isnan(values)]
+            quantiles = np.quantile(values, np.linspace(0, 1, NUMERIC_BINS + 1)[1:-1]) if len(values) else []
+            cube.edges[column] = [float(edge) for edge in np.unique(quantiles)]
+        else:
+            kind = "text"
+            top = first[column].dropna().astype(str).value_counts().head(TOP_CATEGORIES)
+            cube.categories[column] = [str(value) for value in top.index]
+        cube.kinds.append(kind)
+    return cube
+
+
+def build_cube(path: str, date_column: str, criterion_column: str, cube: Optional[Cube] = None,
+               chunk_cells: int = 2_000_000) -> Tuple[Cube, bool]:
+    """Build a cube, or bring an existing one up to date with rows appended to the file.
+
+    The existing cube is extended when the file still starts with the bytes it was
+    built from and uses the same key columns; otherwise it is rebuilt.
+
+    :param path: Path of the CSV file
+    :param date_column: Observation date column
+    :param criterion_column: Criterion column
+    :param cube: Cube built from an earlier version of the file, if any
+    :param chunk_cells: Approximate number of cells read per chunk, bounds memory use
+    :return: The cube and whether it was updated incrementally
+    """
+    size = os.path.getsize(path)
+    digest = head_digest(path)
+    incremental = (
+        cube is not None
+        and (cube.date_column, cube.criterion_column) == (date_column, criterion_column)
+        and cube.head_digest == digest
+        and cube.offset <= size
+    )
+    columns = len(pd.read_csv(path, nrows=0).columns) or 1
+    chunk_rows = max(chunk_cells // columns, 1_000)
+
+    with open(path, "rb") as f:
+        if incremental:
+            if cube.offset == size:
+                return cube, True
+            f.seek(cube.offset)
+            dtype = {name: str for name, kind in zip(cube.columns, cube.kinds) if kind == "text"}
+            reader = pd.read_csv(f, header=None, names=cube.header, dtype=dtype, chunksize=chunk_rows)
+        else:
+            cube = None
+            reader = pd.read_csv(f, chunksize=chunk_rows)
+        for chunk in reader:
+            if cube is None:
+                cube = new_cube(chunk, date_column, criterion_column)
+            cube.update(chunk)
+    if cube is None:
+        cube = new_cube(pd.read_csv(path, nrows=0), date_column, criterion_column)
+    cube._sort_periods()
+    cube.offset = size
+    cube.head_digest = digest
+    return cube, incremental
+
+
+def cube_path(project: Project) -> str:
+    """Return the path of a project's cube file."""
+    return os.path.join(settings.MEDIA_ROOT, CUBE_DIR, f"{get_project_file_name(project)}.npz")
+
+
+def save_cube(cube: Cube, path: str) -> None:
+    """Write a cube, replacing the previous version in one step."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path[:-len('.npz')]}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        manifest=np.array(json.dumps(cube.manifest())),
+        counts=cube.counts, labelled=cube.labelled, bads=cube.bads,
+        period_rows=cube.period_rows, period_labelled=cube.period_labelled, period_bads=cube.period_bads,
+    )
+    os.replace(tmp_path, path)
+
+
+@lru_cache(maxsize=32)
+def _load_cube(path: str, mtime_ns: int) -> Cube:
+    """Read a cube file; cached per file version, callers must not modify the result."""
+    with np.load(path) as data:
+        manifest = json.loads(str(data["manifest"]))
+        if manifest.pop("version") != CUBE_VERSION:
+            raise ValueError(f"Unsupported cube version in {path}")
+        arrays = {name: data[name] for name in data.files if name != "manifest"}
+    return Cube(**manifest, **arrays)
+
+
+def load_cube(path: str) -> Optional[Cube]:
+    """Return the cube stored at a path, None if there is none or it is unreadable."""
+    try:
+        return _load_cube(path, os.stat(path).st_mtime_ns)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def cube_params(project: Project) -> Optional[Dict[str, object]]:
+    """Return the project parameters the cube depends on.
+
+    :param project: The project
+    :return: Key columns and period windows, None if the parameters are not saved
+    """
+    params = current_params(project)
+    if not params or not params.get("observation_date_column") or not params.get("criterion_column"):
+        return None
+    return params
+
+
+def default_windows(cube: Cube, params: Dict[str, object]) -> Tuple[List[str], List[str]]:
+    """Return the base and comparison periods defined by the project's time split.
+
+    The base window runs from ``t1df`` up to ``t2df`` and the comparison window
+    from ``t2df`` through ``t3df``; ``periods_to_exclude`` are left out of both.
+
+    :param cube: The cube
+    :param params: Project parameters
+    :return: Tuple of (base periods, comparison periods)
+    """
+    def parse(value):
+        return pd.to_datetime(value, format=PERIOD_FORMAT, errors="coerce")
+
+    excluded = set(params.get("periods_to_exclude") or [])
+    t1, t2, t3 = (parse(params.get(name)) for name in ("t1df", "t2df", "t3df"))
+    base, target = [], []
+    for period in cube.periods:
+        if period in excluded:
+            continue
+        date = parse(period)
+        if t1 <= date < t2:
+            base.append(period)
+        elif t2 <= date <= t3:
+            target.append(period)
+    return base, target
+
+
+def update_project_cube(project: Project) -> Dict[str, object]:
+    """Build or update the cube of a project and store it.
+
+    :param project: The project, with saved parameters
+    :return: Summary of the update
+    """
+    params = cube_params(project)
+    if params is None:
+        raise ValueError("The project parameters must be saved before the cube is built")
+    path = cube_path(project)
+    # Loaded cubes are shared through the read cache, so extend a copy
+    cube, incremental = build_cube(project.input_dataframe.path, params["observation_date_column"],
+                                   params["criterion_column"], copy.deepcopy(load_cube(path)))
+    save_cube(cube, path)
+    return {
+        "incremental": incremental,
+        "rows": cube.rows,
+        "periods": len(cube.periods),
+        "columns": len(cube.columns),
+        "path": path,
+    }
@@ -0,0 +1,110 @@
+"""Delivery of stored HTML reports.
+
+Reports are sent as streamed files, never read into memory. When the client
+accepts a coding whose precompressed copy exists next to the report (see
+``projects.report_cache``), that copy is sent with a ``Content-Encoding`` header
+instead. Responses carry an ``ETag`` and ``Last-Modified`` so browsers revalidate
+a report they already have and get an empty 304 response back.
+"""
+
+import os
+from typing import Dict, Optional, Tuple
+
+from django.http import FileResponse, HttpRequest, HttpResponseBase
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .report_cache import CACHE_DIR, ENCODINGS
+
+CONTENT_TYPE = "text/html; charset=utf-8"
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Parse an ``Accept-Encoding`` header into the quality of each coding.
+
+    :param header: Header value
+    :return: Quality by lower case coding name, codings with quality 0 included
+    """
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def negotiate(request: HttpRequest, path: str) -> Tuple[str, Optional[str]]:
+    """Pick the stored copy of a report to send.
+
+    :param request: The HTTP request
+    :param path: Path of the uncompressed report
+    :return: Path of the file to send and its content coding, None for identity
+    """
+    accepted = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    wildcard = accepted.get("*", 0.0)
+    candidates = [
+        (accepted.get(encoding, wildcard), -rank, encoding, suffix)
+        for rank, (encoding, suffix) in enumerate(ENCODINGS)
+    ]
+    for quality, _, encoding, suffix in sorted(candidates, reverse=True):
+        if quality > 0 and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def report_etag(path: str, encoding: Optional[str]) -> str:
+    """Return the entity tag of one coding of a report.
+
+    Cached reports are named by the hash of everything that determines their
+    content, so the name is the tag; it stays put when a cache hit bumps the
+    file's modification time. Other reports are tagged by size and mtime.
+
+    :param path: Path of the uncompressed report
+    :param encoding: Content coding sent, None for identity
+    :return: Quoted entity tag
+    """
+    if f"{os.sep}{CACHE_DIR.replace('/', os.sep)}{os.sep}" in path:
+        tag = os.path.basename(path)[:-len(".html")]
+    else:
+        stat = os.stat(path)
+        tag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    return quote_etag(f"{tag}-{encoding}" if encoding else tag)
+
+
+def report_response(request: HttpRequest, path: str, filename: Optional[str] = None) -> HttpResponseBase:
+    """Stream a report in the best coding the client accepts, or answer 304.
+
+    :param request: The HTTP request
+    :param path: Path of the uncompressed report
+    :param filename: Offer the report as a download under this name, None to display it
+    :return: File response, or 304 response when the client's copy is current
+    """
+    send_path, encoding = negotiate(request, path)
+    etag = report_etag(path, encoding)
+    last_modified = int(os.stat(path).st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(
+            open(send_path, "rb"),
+            content_type=CONTENT_TYPE,
+            as_attachment=filename is not None,
+            filename=filename or os.path.basename(path),
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    # Reports are private to their owner; browsers keep them but always revalidate
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
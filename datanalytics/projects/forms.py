@@ -1,13 +1,17 @@
 """Forms for the Project app."""
 
+from typing import TYPE_CHECKING
 from django import forms
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
-import pandas as pd
-import json
-from .models import Project
+from .blobs import attach_input, known_schema, upload_digest
+from .models import ParameterSet, Project
+from .params import build_params, save_parameter_set
 
-def is_date_column(series: pd.Series) -> bool:
+# pandas is imported where a file is read, so that loading the URLconf does not
+if TYPE_CHECKING:
+    import pandas as pd
+
+def is_date_column(series: "pd.Series") -> bool:
     """Check if a pandas Series contains date-like values in MM/DD/YYYY format.
 
     :param series: The pandas Series to check.
@@ -15,6 +19,7 @@ def is_date_column(series: pd.Series) -> bool:
     :return: True if the Series contains date-like values, False otherwise.
     :rtype: bool
     """
+    import pandas as pd
     try:
         pd.to_datetime(series, format="%m/%d/%Y", errors="raise")
         return True
@@ -27,12 +32,14 @@ class ProjectForm(forms.ModelForm):
     class Meta:
         """Meta class for ProjectForm."""
         model = Project
-        fields = ["name", "description", "input_dataframe"]
+        fields = ["name", "description", "input_dataframe", "report_backend"]
 
     def __init__(self, *args, **kwargs) -> None:
         """Initialize the ProjectForm."""
         self.user = kwargs.pop("user", None)
         super().__init__(*args, **kwargs)
+        self.input_digest = None
+        self.input_schema = None
         
         self.fields["description"].widget.attrs.update({
             "class": "form-control",
@@ -44,6 +51,11 @@ class ProjectForm(forms.ModelForm):
             "Upload a CSV file. Make sure it's properly formatted with consistent columns and separators."
         )
 
+        self.fields["report_backend"].required = False
+        self.fields["report_backend"].help_text = (
+            "Sweetviz produces the richer report; the built-in profiler handles very large files in bounded memory."
+        )
+
     def clean_name(self) -> str:
         """Validate the project name to ensure it is unique for the user."""
         name = self.cleaned_data.get("name")
@@ -51,10 +63,18 @@ class ProjectForm(forms.ModelForm):
             raise ValidationError("A project with this name already exists.")
         return name
 
+    def clean_report_backend(self) -> str:
+        """Fall back to the default report backend when none is selected."""
+        return self.cleaned_data.get("report_backend") or Project.REPORT_SWEETVIZ
+
     def clean_input_dataframe(self) -> str:
-        """Validate the uploaded CSV file."""
+        """Validate the uploaded CSV file, unless the same content was validated before."""
         input_dataframe = self.cleaned_data.get("input_dataframe")
         if input_dataframe:
+            self.input_digest = upload_digest(input_dataframe)
+            self.input_schema = known_schema(self.input_digest)
+            if self.input_schema is not None:
+                return input_dataframe
             try:
                 # Read the first chunk to check separators
                 chunk = input_dataframe.read(1024).decode("utf-8")
@@ -67,6 +87,7 @@ class ProjectForm(forms.ModelForm):
                     )
 
                 # Read the full CSV
+                import pandas as pd
                 try:
                     df = pd.read_csv(input_dataframe)
                 except pd.errors.EmptyDataError:
@@ -88,6 +109,7 @@ class ProjectForm(forms.ModelForm):
                 for column in df.columns:
                     if is_date_column(df[column]):
                         has_valid_date = True
+                        self.input_schema = {"columns": [str(c) for c in df.columns], "date_column": str(column)}
                         break
 
                 if not has_valid_date:
@@ -107,10 +129,12 @@ class ProjectForm(forms.ModelForm):
                 )
 
     def save(self, commit=True) -> Project:
-        """Save the project instance."""
+        """Save the project instance, its input file stored once per content."""
         project = super().save(commit=False)
         project.user = self.user
         if commit:
+            if self.input_digest:
+                attach_input(project, self.cleaned_data["input_dataframe"], self.input_digest, self.input_schema)
             project.save()
         return project
 
@@ -249,6 +273,7 @@ class ParamForm(forms.Form):
 
     def __init__(self, *args, project=None, **kwargs) -> None:
         """Initialize the ParamForm."""
+        import pandas as pd
         super(ParamForm, self).__init__(*args, **kwargs)
         if project:
             self.project = project
@@ -311,6 +336,7 @@ class ParamForm(forms.Form):
 
     def clean(self) -> dict:
         """Validate the form data."""
+        import pandas as pd
         cleaned_data = super().clean()
         
         criterion = cleaned_data.get("criterion_column")
@@ -365,39 +391,10 @@ class ParamForm(forms.Form):
 
         return cleaned_data
 
-    def save(self, project: Project) -> None:
-        """Save the parameters to a JSON file."""
-        cleaned_data = self.cleaned_data
-        params = {
-            "criterion_column": cleaned_data["criterion_column"],
-            "missing_treatment": cleaned_data["missing_treatment"],
-            "observation_date_column": cleaned_data["observation_date_column"],
-            "secondary_criterion_columns": cleaned_data["secondary_criterion_columns"],
-            "t1df": cleaned_data["t1df"],
-            "t2df": cleaned_data["t2df"],
-            "t3df": cleaned_data["t3df"],
-            "periods_to_exclude": list(cleaned_data.get("periods_to_exclude", [])),
-            "columns_to_exclude": list(cleaned_data.get("columns_to_exclude", [])),
-            "lr_features": [],
-            "lr_features_to_include": [],
-            "trees_features_to_include": [],
-            "trees_features_to_exclude": [],
-            "cut_offs": {
-                "xgb": cleaned_data["xgb_cutoffs"],
-                "lr": cleaned_data["lr_cutoffs"],
-                "dt": cleaned_data["dt_cutoffs"],
-                "rf": cleaned_data["rf_cutoffs"]
-            },
-            "under_sampling": cleaned_data["under_sampling"],
-            "optimal_binning_columns": list(cleaned_data.get("optimal_binning_columns", [])),
-            "main_table": "input.csv",
-            "columns_to_include": [],
-            "custom_calculations": [],
-            "additional_tables": []
-        }
-
-        json_content = json.dumps(params, indent=4)
-        project.param_file.save(
-            f"params_{project.user.get_username()}_{project.name}.json",
-            ContentFile(json_content.encode("utf-8"))
-        )
\ No newline at end of file
+    def save(self, project: Project) -> ParameterSet:
+        """Save the parameters as the project's next version.
+
+        :param project: The project
+        :return: The new version, the latest one if the parameters did not change
+        """
+        return save_parameter_set(project, build_params(self.cleaned_data))
\ No newline at end of file
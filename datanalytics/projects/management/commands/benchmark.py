@@ -0,0 +1,387 @@
+"""Micro-benchmarks for the pandas hot paths of the projects app.
+
+Every benchmark runs against deterministic synthetic datasets across a grid of row
+and column counts. For each (benchmark, dataset) pair the command records the best
+wall time over several repeats and the peak traced memory of one extra run, then
+compares the figures with a stored baseline and fails when any of them regressed
+beyond the tolerance, or has no baseline figure to be compared with.
+
+Wall times only compare on the machine that measured them, so the baseline is
+recorded locally with ``--save-baseline`` and not committed. It stores the CPU
+count and the Python, pandas and numpy versions it was measured with, and a
+baseline recorded with others is refused.
+
+Example::
+
+    python manage.py benchmark --rows 10000,100000 --columns 10,100 --save-baseline
+    python manage.py benchmark --rows 10000,100000 --columns 10,100
+"""
+
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from projects.forms import ParamForm, ProjectForm, is_date_column
+from projects.models import Project
+from projects.binning import bin_columns
+from projects.columnar import profile_csv_parallel
+from projects.profiling import profile_csv
+from projects.synthetic import PERIODS, write_dataset
+from projects.sweetviz_compat import sweetviz_compatible_frame
+from projects.views import download_csv, get_date_values
+
+FULL_ROWS = "10000,100000,1000000,10000000"
+FULL_COLUMNS = "10,100,500,2000"
+
+BENCHMARKS: Dict[str, Callable[["BenchContext"], Callable[[], object]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    """Register a benchmark setup function under a name.
+
+    The setup function receives a :class:`BenchContext` and returns the
+    zero-argument callable that is timed. Work done in setup is not measured.
+    """
+    def register(setup: Callable) -> Callable:
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@dataclass
+class BenchContext:
+    """Everything a benchmark needs for one synthetic dataset."""
+
+    path: str
+    rows: int
+    columns: int
+    user: object
+    project: Project
+    factory: RequestFactory = field(default_factory=RequestFactory)
+    _df: Optional[pd.DataFrame] = None
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """The dataset read once with pandas and cached."""
+        if self._df is None:
+            self._df = pd.read_csv(self.path)
+        return self._df
+
+    def fresh_project(self) -> Project:
+        """Reload the project so its input file handle starts at the beginning."""
+        return Project.objects.get(pk=self.project.pk)
+
+    def param_data(self) -> dict:
+        """Valid ParamForm data for the synthetic dataset."""
+        return {
+            "criterion_column": "default_flag",
+            "observation_date_column": "observation_date",
+            "secondary_criterion_columns": "early_default_flag",
+            "missing_treatment": "Missing",
+            "t1df": PERIODS[0],
+            "t2df": PERIODS[len(PERIODS) // 2],
+            "t3df": PERIODS[-1],
+            "under_sampling": 1,
+            "xgb_cutoffs": "0.2, 0.4, 0.6, 0.8",
+            "lr_cutoffs": "0.2, 0.4, 0.6, 0.8",
+            "dt_cutoffs": "0.2, 0.4, 0.6, 0.8",
+            "rf_cutoffs": "0.2, 0.4, 0.6, 0.8",
+        }
+
+    def get(self, path: str, **params):
+        """Build an authenticated GET request."""
+        request = self.factory.get(path, params)
+        request.user = self.user
+        return request
+
+
+@benchmark("ProjectForm.clean_input_dataframe")
+def bench_clean_input_dataframe(ctx: BenchContext) -> Callable[[], object]:
+    """Validate the uploaded CSV as the creation form does."""
+    def run():
+        with open(ctx.path, "rb") as f:
+            form = ProjectForm(user=ctx.user)
+            form.cleaned_data = {"input_dataframe": File(f, name="input.csv")}
+            return form.clean_input_dataframe()
+    return run
+
+
+@benchmark("is_date_column")
+def bench_is_date_column(ctx: BenchContext) -> Callable[[], object]:
+    """Check every column, the worst case when the date column comes last."""
+    df = ctx.df
+    return lambda: [is_date_column(df[column]) for column in df.columns]
+
+
+@benchmark("ParamForm.__init__")
+def bench_param_form_init(ctx: BenchContext) -> Callable[[], object]:
+    """Build the parameter form for the project."""
+    return lambda: ParamForm(project=ctx.fresh_project())
+
+
+@benchmark("ParamForm.clean")
+def bench_param_form_clean(ctx: BenchContext) -> Callable[[], object]:
+    """Validate submitted parameters on an already built form."""
+    form = ParamForm(data=ctx.param_data(), project=ctx.fresh_project())
+
+    def run():
+        form.full_clean()
+        if form.errors:
+            raise CommandError(f"ParamForm did not validate: {form.errors.as_json()}")
+    return run
+
+
+@benchmark("get_date_values")
+def bench_get_date_values(ctx: BenchContext) -> Callable[[], object]:
+    """Call the AJAX view that lists the dates of a column."""
+    def run():
+        request = ctx.get("/projects/get-date-values/", column="observation_date",
+                          project_name=ctx.project.name)
+        return get_date_values(request)
+    return run
+
+
+@benchmark("download_csv")
+def bench_download_csv(ctx: BenchContext) -> Callable[[], object]:
+    """Call the CSV download view and consume the whole body."""
+    def run():
+        response = download_csv(ctx.get("/projects/download_csv/", project_name=ctx.project.name))
+        return b"".join(response) if response.streaming else response.content
+    return run
+
+
+@benchmark("generate_sweetviz_report.df_compat")
+def bench_sweetviz_frame(ctx: BenchContext) -> Callable[[], object]:
+    """Rebuild the DataFrame the way the report task does before Sweetviz."""
+    df = ctx.df
+    return lambda: sweetviz_compatible_frame(df)
+
+
+@benchmark("profile_csv")
+def bench_profile_csv(ctx: BenchContext) -> Callable[[], object]:
+    """Profile the file in one chunked pass with the built-in report engine."""
+    return lambda: profile_csv(ctx.path)
+
+
+@benchmark("profile_csv_parallel")
+def bench_profile_csv_parallel(ctx: BenchContext) -> Callable[[], object]:
+    """Profile the file column by column on a pool of ``REPORT_WORKERS`` processes."""
+    return lambda: profile_csv_parallel(ctx.path, settings.REPORT_WORKERS)
+
+
+@benchmark("bin_columns")
+def bench_bin_columns(ctx: BenchContext) -> Callable[[], object]:
+    """Bin every feature column against the criterion on ``BINNING_WORKERS`` processes."""
+    features = [name for name in pd.read_csv(ctx.path, nrows=0).columns if name.startswith("feature_")]
+    return lambda: bin_columns(ctx.path, features, "default_flag", settings.BINNING_WORKERS)
+
+
+def measure(run: Callable[[], object], repeats: int) -> Dict[str, float]:
+    """Time a callable and trace its peak memory.
+
+    Timing and tracing happen in separate runs because tracemalloc slows
+    allocation-heavy code down considerably.
+
+    :param run: The callable to measure
+    :param repeats: Number of timed runs, the best one is kept
+    :return: Dictionary with ``seconds`` and ``peak_mb``
+    """
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": peak / 2 ** 20}
+
+
+def machine() -> Dict[str, object]:
+    """Describe what the timings depend on besides the code."""
+    return {
+        "architecture": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+    }
+
+
+class Command(BaseCommand):
+    """Benchmark the pandas hot paths and compare them with a stored baseline."""
+
+    help = "Benchmark the pandas hot paths on synthetic data and fail on regressions against a baseline."
+
+    def add_arguments(self, parser) -> None:
+        """Add command line arguments."""
+        parser.add_argument("--rows", default="10000,100000", help="Comma separated row counts")
+        parser.add_argument("--columns", default="10,100", help="Comma separated column counts")
+        parser.add_argument("--full", action="store_true",
+                            help=f"Use the full grid: rows {FULL_ROWS}, columns {FULL_COLUMNS}")
+        parser.add_argument("--max-cells", type=int, default=200_000_000,
+                            help="Skip datasets with more rows x columns than this")
+        parser.add_argument("--only", action="append", default=[],
+                            help="Run only benchmarks whose name contains this text (repeatable)")
+        parser.add_argument("--repeats", type=int, default=3, help="Timed runs per benchmark")
+        parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "datanalytics-bench"),
+                            help="Where the generated datasets are cached between runs")
+        parser.add_argument("--baseline", default=os.path.join(settings.BASE_DIR, "benchmarks", "baseline.json"),
+                            help="Baseline file of this machine to compare with and to write with --save-baseline")
+        parser.add_argument("--save-baseline", action="store_true",
+                            help="Write the results as the new baseline instead of comparing")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed relative slowdown before a benchmark counts as a regression")
+        parser.add_argument("--memory-tolerance", type=float, default=0.10,
+                            help="Allowed relative growth of peak memory")
+        parser.add_argument("--output", help="Also write the results to this JSON file")
+        parser.add_argument("--allow-missing-baseline", action="store_true",
+                            help="Only print the results when there is no baseline instead of failing")
+
+    def handle(self, *args, **options) -> None:
+        """Run the benchmarks."""
+        rows_list = self._parse_ints(FULL_ROWS if options["full"] else options["rows"], "--rows")
+        columns_list = self._parse_ints(FULL_COLUMNS if options["full"] else options["columns"], "--columns")
+        selected = {
+            name: setup for name, setup in BENCHMARKS.items()
+            if not options["only"] or any(text in name for text in options["only"])
+        }
+        if not selected:
+            raise CommandError("No benchmark matches --only")
+        baseline_missing = not options["save_baseline"] and not os.path.exists(options["baseline"])
+        if baseline_missing and not options["allow_missing_baseline"]:
+            raise CommandError(
+                f"No baseline at {options['baseline']}: record one with --save-baseline, "
+                "or pass --allow-missing-baseline to only print the results"
+            )
+        baseline = None
+        if not baseline_missing and not options["save_baseline"]:
+            baseline = self._load_baseline(options["baseline"])
+
+        os.makedirs(options["data_dir"], exist_ok=True)
+        results: Dict[str, Dict[str, float]] = {}
+
+        with ExitStack() as stack:
+            media_root = stack.enter_context(tempfile.TemporaryDirectory(prefix="bench_media_"))
+            stack.enter_context(override_settings(
+                MEDIA_ROOT=media_root,
+                CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+            ))
+            old_config = setup_databases(verbosity=0, interactive=False)
+            stack.callback(teardown_databases, old_config, verbosity=0)
+            user = get_user_model().objects.create_user(
+                username="bench", email=f"bench@{settings.CORPORATE_EMAIL_DOMAIN}", password="bench-pass-123"
+            )
+
+            for rows in rows_list:
+                for columns in columns_list:
+                    if rows * columns > options["max_cells"]:
+                        self.stdout.write(f"Skipping {rows}x{columns}: above --max-cells")
+                        continue
+                    ctx = self._prepare(user, media_root, options["data_dir"], rows, columns)
+                    for name, setup in selected.items():
+                        key = f"{name}[{rows}x{columns}]"
+                        results[key] = measure(setup(ctx), options["repeats"])
+                        self.stdout.write(
+                            f"{key:<60}{results[key]['seconds'] * 1000:>12.1f} ms"
+                            f"{results[key]['peak_mb']:>12.1f} MB"
+                        )
+
+        if options["output"]:
+            self._write_json(options["output"], results)
+
+        if options["save_baseline"]:
+            self._write_json(options["baseline"], {"machine": machine(), "results": results})
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}"))
+            return
+
+        if baseline_missing:
+            self.stdout.write(self.style.WARNING(f"No baseline at {options['baseline']}, nothing compared"))
+            return
+
+        regressions = self._compare(results, baseline, options["tolerance"], options["memory_tolerance"])
+        if regressions:
+            raise CommandError("Benchmark regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def _prepare(self, user, media_root: str, data_dir: str, rows: int, columns: int) -> BenchContext:
+        """Generate (or reuse) a dataset and register it as a project."""
+        path = os.path.join(data_dir, f"synthetic_{rows}x{columns}.csv")
+        if not os.path.exists(path):
+            self.stdout.write(f"Generating {path}")
+            write_dataset(path + ".tmp", rows, columns)
+            os.replace(path + ".tmp", path)
+
+        name = f"bench_{rows}x{columns}"
+        relative = os.path.join("input_data", f"{user.get_username()}_{name}", "input.csv")
+        os.makedirs(os.path.dirname(os.path.join(media_root, relative)), exist_ok=True)
+        os.symlink(path, os.path.join(media_root, relative))
+        project = Project.objects.create(name=name, description="Benchmark", user=user, input_dataframe=relative)
+        return BenchContext(path=path, rows=rows, columns=columns, user=user, project=project)
+
+    def _load_baseline(self, path: str) -> dict:
+        """Read the baseline results, refusing those measured on another machine."""
+        with open(path) as f:
+            baseline = json.load(f)
+        recorded, here = baseline.get("machine"), machine()
+        if recorded != here:
+            raise CommandError(
+                f"The baseline at {path} was recorded on {recorded or 'an unknown machine'}, this is {here}: "
+                "record one here with --save-baseline"
+            )
+        return baseline["results"]
+
+    def _compare(self, results: dict, baseline: dict, tolerance: float, memory_tolerance: float) -> List[str]:
+        """List every measurement that regressed beyond its tolerance or is missing from the baseline."""
+        regressions = []
+        for key, current in results.items():
+            previous = baseline.get(key)
+            if not previous:
+                regressions.append(f"{key}: not in the baseline, record it with --save-baseline")
+                continue
+            if current["seconds"] > previous["seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{key}: {current['seconds'] * 1000:.1f} ms vs baseline {previous['seconds'] * 1000:.1f} ms"
+                )
+            if current["peak_mb"] > previous["peak_mb"] * (1 + memory_tolerance):
+                regressions.append(
+                    f"{key}: {current['peak_mb']:.1f} MB vs baseline {previous['peak_mb']:.1f} MB"
+                )
+        return regressions
+
+    @staticmethod
+    def _parse_ints(value: str, option: str) -> List[int]:
+        """Parse a comma separated list of integers."""
+        try:
+            return [int(item) for item in value.split(",")]
+        except ValueError:
+            raise CommandError(f"{option} must be a comma separated list of integers")
+
+    @staticmethod
+    def _write_json(path: str, results: dict) -> None:
+        """Write results as pretty-printed JSON, creating the directory if needed."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
@@ -0,0 +1,397 @@
+"""Run scripted analyst sessions against the web + Celery stack and report latencies.
+
+Each virtual analyst registers, logs in through ``users.backends.EmailBackend``,
+uploads a synthetic dataset, configures parameters, runs the prep, train/eval and
+report tasks and polls ``task_status`` until they finish. The sessions are run at
+increasing concurrency levels and the command prints p50/p95/p99 latency per
+endpoint and the task throughput reached at each level.
+
+Every session uploads a dataset of its own seed, so uploads, reports and
+binning do the full work instead of hitting the content-addressed stores.
+``--shared-dataset`` uploads one dataset everywhere to measure those stores
+instead. Reports answered from the cache and uploads of content already stored
+are counted apart from the timed tasks.
+
+By default everything is hermetic: a throwaway test database is created from the
+configured ``DATABASES`` (sqlite or a local Postgres), Celery uses an in-memory
+broker with an embedded worker and gizmo runs with the current interpreter.
+Every level waits for the tasks its sessions started, the background cube and
+binning tasks included, so none runs into the next level or the teardown.
+
+sqlite's default in-memory test database fails concurrent writes at once with
+"database table is locked", so with sqlite the test database is a file in WAL
+mode where writers wait for each other. Writes are still serialised: figures
+above concurrency 1 only mean something on Postgres.
+
+Example::
+
+    python manage.py loadtest --concurrency 1,4,8 --rows 2000 --gizmo-timeout 0
+"""
+
+import os
+import sys
+import tempfile
+import hashlib
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from celery.signals import after_task_publish
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from datanalytics.celery_app import app as celery_app
+from projects.models import DatasetBlob
+from projects.synthetic import build_dataset
+
+TASK_ENDPOINTS = {
+    "prep": "/projects/prep/",
+    "train_and_eval": "/projects/trainandeval/",
+    "analyze_sweetviz": "/projects/analyze_sweetviz/",
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the nearest-rank percentile of a list of values.
+
+    :param values: Observed values
+    :param pct: Percentile between 0 and 100
+    :return: The percentile, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(np.ceil(pct / 100 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+class LoadStats:
+    """Thread-safe collector of endpoint latencies and task durations."""
+
+    def __init__(self) -> None:
+        """Initialize empty collections."""
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.task_durations: Dict[str, List[float]] = defaultdict(list)
+        self.task_failures: Dict[str, int] = defaultdict(int)
+        self.cache_hits: Dict[str, int] = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool) -> None:
+        """Record one request."""
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def record_task(self, task: str, seconds: float, ok: bool) -> None:
+        """Record one finished task, measured from submission to completion."""
+        with self._lock:
+            self.task_durations[task].append(seconds)
+            if not ok:
+                self.task_failures[task] += 1
+
+    def record_cache_hit(self, name: str) -> None:
+        """Record a task or upload answered from stored results, kept out of the timings."""
+        with self._lock:
+            self.cache_hits[name] += 1
+
+
+class AnalystSession:
+    """One scripted analyst going through the whole project workflow."""
+
+    def __init__(self, stats: LoadStats, dataset: bytes, dates: List[str], options: dict) -> None:
+        """Initialize the session with its own client and credentials."""
+        self.stats = stats
+        self.dataset = dataset
+        self.dates = dates
+        self.options = options
+        self.client = Client()
+        suffix = uuid.uuid4().hex[:10]
+        self.username = f"lt{suffix}"
+        self.email = f"lt{suffix}@{settings.CORPORATE_EMAIL_DOMAIN}"
+        self.password = f"Lt-{uuid.uuid4().hex}"
+        self.project_name = f"loadtest_{suffix}"
+
+    def _request(self, endpoint: str, method: str, path: str, data: Optional[dict] = None):
+        """Issue a request and record its latency under the endpoint name."""
+        start = time.perf_counter()
+        response = getattr(self.client, method)(path, data or {})
+        elapsed = time.perf_counter() - start
+        self.stats.record(endpoint, elapsed, response.status_code < 400)
+        return response
+
+    def run(self) -> None:
+        """Run the full workflow, closing this thread's DB connections at the end."""
+        try:
+            self._register_and_login()
+            self._create_project()
+            self._configure_params()
+            self._request("projects", "get", "/projects/", {"project_name": self.project_name})
+            for task in ("prep", "train_and_eval", "analyze_sweetviz"):
+                self._run_task(task)
+            self._request("projects", "get", "/projects/", {"project_name": self.project_name})
+        finally:
+            connections.close_all()
+
+    def _register_and_login(self) -> None:
+        """Register through django-registration, activate and log in by email."""
+        self._request("register", "post", "/accounts/register/", {
+            "username": self.username,
+            "email": self.email,
+            "password1": self.password,
+            "password2": self.password,
+        })
+        # Skip the emailed activation link, the account is activated directly
+        get_user_model().objects.filter(username=self.username).update(is_active=True)
+        self._request("login", "post", "/accounts/login/", {
+            "username": self.email,
+            "password": self.password,
+        })
+
+    def _create_project(self) -> None:
+        """Open the creation page and upload the dataset."""
+        self._request("project_creation", "get", "/projects/newproject/")
+        digest = hashlib.sha256(self.dataset).hexdigest()
+        stored = DatasetBlob.objects.filter(digest=digest).exists()
+        self._request("project_creation", "post", "/projects/newproject/", {
+            "name": self.project_name,
+            "description": "Load test project",
+            "input_dataframe": SimpleUploadedFile("input.csv", self.dataset, content_type="text/csv"),
+        })
+        if stored:
+            self.stats.record_cache_hit("upload")
+
+    def _configure_params(self) -> None:
+        """Open the parameter page, fetch date values and save parameters."""
+        query = f"?project_name={self.project_name}"
+        self._request("project_params", "get", f"/projects/project/params/{query}")
+        self._request("get_date_values", "get", "/projects/get-date-values/", {
+            "column": "observation_date",
+            "project_name": self.project_name,
+        })
+        self._request("project_params", "post", f"/projects/project/params/{query}", {
+            "criterion_column": "default_flag",
+            "observation_date_column": "observation_date",
+            "secondary_criterion_columns": "early_default_flag",
+            "missing_treatment": "Missing",
+            "t1df": self.dates[0],
+            "t2df": self.dates[len(self.dates) // 2],
+            "t3df": self.dates[-1],
+            "under_sampling": 1,
+            "xgb_cutoffs": "0.2, 0.4, 0.6, 0.8",
+            "lr_cutoffs": "0.2, 0.4, 0.6, 0.8",
+            "dt_cutoffs": "0.2, 0.4, 0.6, 0.8",
+            "rf_cutoffs": "0.2, 0.4, 0.6, 0.8",
+        })
+
+    def _run_task(self, task: str) -> None:
+        """Trigger a task and poll ``task_status`` until it finishes or times out."""
+        submitted = time.perf_counter()
+        response = self._request(task, "post", TASK_ENDPOINTS[task], {"project_name": self.project_name})
+        body = response.json() if response.status_code < 400 else {}
+        if body.get("report_ready"):
+            # Served from the report cache without a task
+            self.stats.record_cache_hit(task)
+            return
+        task_id = body.get("task_id")
+        if not task_id:
+            self.stats.record_task(task, time.perf_counter() - submitted, False)
+            return
+
+        deadline = submitted + self.options["task_timeout"]
+        status = "running"
+        while status == "running" and time.perf_counter() < deadline:
+            time.sleep(self.options["poll_interval"])
+            status = self._request("task_status", "get", f"/projects/task-status/{task_id}/").json().get("status")
+
+        self.stats.record_task(task, time.perf_counter() - submitted, status == "done")
+
+
+class Command(BaseCommand):
+    """Load-test the web + Celery stack with concurrent analyst sessions."""
+
+    help = "Run concurrent scripted analyst sessions and report latency percentiles and task throughput."
+
+    def add_arguments(self, parser) -> None:
+        """Add command line arguments."""
+        parser.add_argument("--concurrency", default="1,2,4,8",
+                            help="Comma separated concurrency levels to run, in order")
+        parser.add_argument("--sessions", type=int, default=None,
+                            help="Sessions per level (default: twice the concurrency)")
+        parser.add_argument("--rows", type=int, default=2000, help="Rows in the synthetic dataset")
+        parser.add_argument("--features", type=int, default=10, help="Numeric columns in the synthetic dataset")
+        parser.add_argument("--seed", type=int, default=42, help="Seed of the first session's dataset")
+        parser.add_argument("--shared-dataset", action="store_true",
+                            help="Upload the same dataset in every session instead of one per session, "
+                                 "which measures the report cache and upload deduplication")
+        parser.add_argument("--workers", type=int, default=4, help="Embedded Celery worker threads")
+        parser.add_argument("--broker", choices=["memory", "configured"], default="memory",
+                            help="'memory' runs an embedded worker, 'configured' uses CELERY_BROKER_URL "
+                                 "and a separately started worker")
+        parser.add_argument("--use-existing-db", action="store_true",
+                            help="Use the configured database instead of a throwaway test database "
+                                 "(needed when an external worker must see the data)")
+        parser.add_argument("--gizmo-timeout", type=int, default=0, help="Seconds each gizmo stage sleeps")
+        parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between status polls")
+        parser.add_argument("--task-timeout", type=float, default=600, help="Seconds to wait for one task")
+
+    def handle(self, *args, **options) -> None:
+        """Run the load test."""
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma separated list of integers")
+
+        self.next_seed = options["seed"]
+        self.published: List[str] = []
+
+        with ExitStack() as stack:
+            self._set_environ(stack, "GIZMO_TIMEOUT", str(options["gizmo_timeout"]))
+            after_task_publish.connect(self._task_published)
+            stack.callback(after_task_publish.disconnect, self._task_published)
+            media_root = stack.enter_context(tempfile.TemporaryDirectory(prefix="loadtest_media_"))
+            overrides = {"MEDIA_ROOT": media_root, "GIZMO_PYTHON": sys.executable, "ALLOWED_HOSTS": ["*"]}
+            if options["broker"] == "memory":
+                # Hermetic runs need no Redis: cache, metrics and email outbox stay in this process
+                overrides.update({
+                    "METRICS_BACKEND": "memory",
+                    "EMAIL_OUTBOX_BACKEND": "memory",
+                    "CACHES": {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                })
+            stack.enter_context(override_settings(**overrides))
+            setup_test_environment()
+            stack.callback(teardown_test_environment)
+
+            if not options["use_existing_db"]:
+                self._sqlite_test_files(stack, media_root)
+                if max(levels) > 1 and any(connections[alias].vendor == "sqlite" for alias in connections):
+                    self.stderr.write(self.style.WARNING(
+                        "sqlite serialises writes, latencies above concurrency 1 include waiting for them"
+                    ))
+                old_config = setup_databases(verbosity=0, interactive=False)
+                stack.callback(teardown_databases, old_config, verbosity=0)
+
+            if options["broker"] == "memory":
+                from celery.contrib.testing.worker import start_worker
+
+                # Celery gives these environment variables precedence over the Django settings
+                self._set_environ(stack, "CELERY_BROKER_URL", "memory://")
+                self._set_environ(stack, "CELERY_RESULT_BACKEND", "cache+memory://")
+                stack.enter_context(start_worker(
+                    celery_app,
+                    concurrency=options["workers"],
+                    pool="threads",
+                    perform_ping_check=False,
+                    loglevel="WARNING",
+                ))
+
+            for level in levels:
+                sessions = options["sessions"] or level * 2
+                self._run_level(level, sessions, options)
+
+    @staticmethod
+    def _set_environ(stack: ExitStack, name: str, value: str) -> None:
+        """Set an environment variable until the stack closes."""
+        previous = os.environ.get(name)
+        os.environ[name] = value
+        if previous is None:
+            stack.callback(os.environ.pop, name, None)
+        else:
+            stack.callback(os.environ.__setitem__, name, previous)
+
+    @staticmethod
+    def _sqlite_test_files(stack: ExitStack, directory: str) -> None:
+        """Put sqlite test databases in WAL files whose writers wait for the lock instead of failing."""
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if connections[alias].vendor != "sqlite":
+                continue
+            saved = {key: settings_dict[key] for key in ("TEST", "OPTIONS")}
+            stack.callback(settings_dict.update, saved)
+            settings_dict["TEST"] = {**saved["TEST"], "NAME": os.path.join(directory, f"{alias}.sqlite3")}
+            settings_dict["OPTIONS"] = {
+                **saved["OPTIONS"],
+                "timeout": 60,
+                "transaction_mode": "IMMEDIATE",
+                "init_command": "PRAGMA journal_mode=WAL;",
+            }
+
+    def _task_published(self, sender=None, headers=None, **kwargs) -> None:
+        """Remember every task sent, including those started by signals rather than sessions."""
+        self.published.append(headers["id"])
+
+    def _wait_for_tasks(self, timeout: float, poll_interval: float) -> None:
+        """Wait until every task sent so far has finished, warning about those that do not in time."""
+        pending, self.published = self.published, []
+        deadline = time.perf_counter() + timeout
+        while pending and time.perf_counter() < deadline:
+            pending = [task_id for task_id in pending if not celery_app.AsyncResult(task_id).ready()]
+            if pending:
+                time.sleep(poll_interval)
+        if pending:
+            self.stderr.write(self.style.WARNING(f"{len(pending)} tasks still running after {timeout:.0f}s"))
+
+    def _dataset(self, options: dict) -> Tuple[bytes, List[str]]:
+        """Build the next session's dataset, from a new seed unless the dataset is shared."""
+        seed = self.next_seed
+        if not options["shared_dataset"]:
+            self.next_seed += 1
+        return build_dataset(options["rows"], options["features"], seed=seed)
+
+    def _run_level(self, level: int, sessions: int, options: dict) -> None:
+        """Run one concurrency level and print its report."""
+        stats = LoadStats()
+        # Built before the clock starts, generating data is not part of the load
+        analysts = [AnalystSession(stats, *self._dataset(options), options) for _ in range(sessions)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as executor:
+            futures = [executor.submit(analyst.run) for analyst in analysts]
+            for future in futures:
+                exc = future.exception()
+                if exc:
+                    self.stderr.write(f"Session failed: {exc!r}")
+        wall = time.perf_counter() - start
+        self._wait_for_tasks(options["task_timeout"], options["poll_interval"])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\nConcurrency {level}: {sessions} sessions in {wall:.1f}s"
+        ))
+        self.stdout.write(f"{'endpoint':<20}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for endpoint, values in sorted(stats.latencies.items()):
+            self.stdout.write(
+                f"{endpoint:<20}{len(values):>8}{stats.errors[endpoint]:>8}"
+                f"{percentile(values, 50) * 1000:>10.1f}"
+                f"{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}"
+            )
+
+        completed = sum(len(values) for values in stats.task_durations.values())
+        self.stdout.write(
+            f"{'task':<20}{'count':>8}{'failed':>8}{'cached':>8}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}"
+        )
+        for task in sorted(set(stats.task_durations) | set(stats.cache_hits) - {"upload"}):
+            values = stats.task_durations[task]
+            self.stdout.write(
+                f"{task:<20}{len(values):>8}{stats.task_failures[task]:>8}{stats.cache_hits[task]:>8}"
+                f"{percentile(values, 50):>10.2f}"
+                f"{percentile(values, 95):>10.2f}"
+                f"{percentile(values, 99):>10.2f}"
+            )
+        self.stdout.write(f"Uploads of already stored content: {stats.cache_hits['upload']} of {sessions}")
+        self.stdout.write(f"Task throughput: {completed / wall if wall else 0:.2f} tasks/s")
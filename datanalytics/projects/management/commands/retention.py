@@ -0,0 +1,52 @@
+"""Archive old gizmo sessions and the files of deleted projects, or report what would be archived."""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.retention import apply_retention, plan_retention, retention_lock
+
+
+def human_size(size: int) -> str:
+    """Return a byte count in the largest unit that keeps it at or above 1."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class Command(BaseCommand):
+    """Apply the retention policies of ``projects.retention``."""
+
+    help = "Archive sessions beyond each project's retention policy and the files of deleted projects."
+
+    def add_arguments(self, parser) -> None:
+        """Add command line arguments."""
+        parser.add_argument("--dry-run", action="store_true", help="List what would be archived and change nothing")
+        parser.add_argument("--limit", type=int, default=None,
+                            help="Most entries archived in this run, oldest first; default is all of them")
+
+    def handle(self, *args, **options) -> None:
+        """Report or apply the retention policies."""
+        if options["dry_run"]:
+            actions = plan_retention()
+            for action in actions:
+                self.stdout.write(f"{action.kind:<8}{human_size(action.size_bytes):>10}  "
+                                  f"{os.path.relpath(action.path, settings.MEDIA_ROOT)}  ({action.reason})")
+            total = sum(action.size_bytes for action in actions)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{len(actions)} entries, {human_size(total)}, would be archived to {settings.RETENTION_ARCHIVE_DIR}"
+            ))
+            return
+
+        with retention_lock() as acquired:
+            if not acquired:
+                raise CommandError("Another retention run is in progress")
+            result = apply_retention(options["limit"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result['archived']} entries ({human_size(result['archived_bytes'])}), "
+            f"{result['remaining']} left, removed {result['blobs_removed']} unused input blobs "
+            f"({human_size(result['blob_bytes_freed'])})"
+        ))
@@ -52,6 +52,13 @@ def get_train_eval_output_path(instance, filename: str) -> str:
 class Project(models.Model):
     """Model representing a project."""
 
+    REPORT_SWEETVIZ = "sweetviz"
+    REPORT_NATIVE = "native"
+    REPORT_BACKEND_CHOICES = [
+        (REPORT_SWEETVIZ, "Sweetviz"),
+        (REPORT_NATIVE, "Built-in profiler"),
+    ]
+
     name = models.CharField(max_length=150)
     description = models.TextField(help_text="Provide a detailed description of your project")
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -61,13 +68,25 @@ class Project(models.Model):
     )
     param_file = models.FileField(
         upload_to=get_param_file_name, 
-        validators=[FileExtensionValidator(["json"])]
+        validators=[FileExtensionValidator(["json"])],
+        help_text="Parameters written for gizmo when a run starts, the versions live in ParameterSet"
     )
     sweetviz_report = models.FileField(
         upload_to="reports/", 
         null=True, 
         blank=True
     )
+    input_digest = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text="SHA-256 of the input file, taken while it is uploaded; names its DatasetBlob"
+    )
+    report_backend = models.CharField(
+        max_length=20,
+        choices=REPORT_BACKEND_CHOICES,
+        default=REPORT_SWEETVIZ,
+        help_text="Engine used to generate the data analysis report"
+    )
     prep_output = models.CharField(
         max_length=255,
         null=True,
@@ -85,4 +104,162 @@ class Project(models.Model):
         """Meta class for the Project model."""
         constraints = [
             models.UniqueConstraint(fields=["name", "user"], name="unique_project")
+        ]
+
+class DatasetBlob(models.Model):
+    """One uploaded input file, stored once under its SHA-256 however many projects use it."""
+
+    digest = models.CharField(max_length=64, unique=True)
+    size_bytes = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(
+        default=0,
+        help_text="Projects whose input file is this blob, kept up to date by projects.signals"
+    )
+    schema = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Columns and date column found when the file was first validated"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class ResourceUsage(models.Model):
+    """Wall time, CPU time and peak memory of one task run or one of its gizmo stages."""
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="resource_usage")
+    task_name = models.CharField(max_length=255)
+    task_id = models.CharField(max_length=255)
+    stage = models.CharField(
+        max_length=50,
+        blank=True,
+        help_text="Gizmo stage measured, empty for the task itself"
+    )
+    wall_seconds = models.FloatField()
+    cpu_user_seconds = models.FloatField()
+    cpu_system_seconds = models.FloatField()
+    peak_rss_bytes = models.BigIntegerField()
+    top_allocations = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Largest tracemalloc allocations when TASK_TRACEMALLOC_TOP is set"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """Meta class for the ResourceUsage model."""
+        ordering = ["-created_at"]
+
+class ParameterSet(models.Model):
+    """One saved version of a project's parameters, never changed once written."""
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="parameter_sets")
+    version = models.PositiveIntegerField()
+    params = models.JSONField()
+    digest = models.CharField(
+        max_length=64,
+        help_text="SHA-256 of the parameters as canonical JSON"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """Meta class for the ParameterSet model."""
+        ordering = ["-version"]
+        constraints = [
+            models.UniqueConstraint(fields=["project", "version"], name="unique_parameter_version")
+        ]
+
+class ProjectRun(models.Model):
+    """One Celery task run on a project, kept up to date by the handlers in ``projects.signals``."""
+
+    STAGE_PREP = "prep"
+    STAGE_TRAIN_EVAL = "train_eval"
+    STAGE_REPORT = "sweetviz"
+    STAGE_CUBE = "cube"
+    STAGE_BINNING = "binning"
+    STAGE_CHOICES = [
+        (STAGE_PREP, "Data preparation"),
+        (STAGE_TRAIN_EVAL, "Training and evaluation"),
+        (STAGE_REPORT, "Analysis report"),
+        (STAGE_CUBE, "Period cube"),
+        (STAGE_BINNING, "Optimal binning"),
+    ]
+
+    STATUS_QUEUED = "queued"
+    STATUS_STARTED = "started"
+    STATUS_RETRYING = "retrying"
+    STATUS_SUCCESS = "success"
+    STATUS_FAILURE = "failure"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_STARTED, "Started"),
+        (STATUS_RETRYING, "Retrying"),
+        (STATUS_SUCCESS, "Succeeded"),
+        (STATUS_FAILURE, "Failed"),
+    ]
+    RUNNING_STATUSES = (STATUS_QUEUED, STATUS_STARTED, STATUS_RETRYING)
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="runs")
+    stage = models.CharField(max_length=20, choices=STAGE_CHOICES)
+    parameter_set = models.ForeignKey(
+        ParameterSet,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="runs",
+        help_text="Parameters the run was queued with"
+    )
+    task_id = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Time from start to finish of the last attempt"
+    )
+    return_code = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Exit status of the gizmo command, the first non-zero one when there are several"
+    )
+    output_path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """Meta class for the ProjectRun model."""
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["project", "stage", "-created_at"], name="run_project_stage_idx"),
+            models.Index(fields=["project", "status"], name="run_project_status_idx"),
+            models.Index(fields=["status", "created_at"], name="run_status_created_idx"),
+        ]
+
+    @property
+    def running(self) -> bool:
+        """Whether the run is queued or in progress."""
+        return self.status in self.RUNNING_STATUSES
+
+class RetentionPolicy(models.Model):
+    """How many gizmo sessions ``projects.retention`` keeps for one project or for every project of one user."""
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, null=True, blank=True,
+                             related_name="retention_policies")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name="retention_policies")
+    keep_sessions = models.PositiveIntegerField(
+        help_text="Training runs whose sessions are kept, newest first; older ones are archived"
+    )
+
+    class Meta:
+        """Meta class for the RetentionPolicy model."""
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(user__isnull=False, project__isnull=True)
+                | models.Q(user__isnull=True, project__isnull=False),
+                name="retention_policy_scope",
+            ),
+            models.UniqueConstraint(fields=["user"], name="unique_user_retention_policy"),
+            models.UniqueConstraint(fields=["project"], name="unique_project_retention_policy"),
         ]
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""Shared cache of the data behind the project pages.
+
+The project list and the project detail page are rebuilt from the same few
+rows on every view, although those rows only change when a project is saved or
+one of its tasks moves on. Their render data is therefore kept in the shared
+cache under keys that embed a version: one per project for the detail page and
+one per user for the list. The handlers at the bottom of this module replace a
+version whenever a project, one of its runs or one of its resource usage rows is
+saved or deleted, so stale entries are never read again and simply expire.
+Entries and versions both expire after ``PAGE_CACHE_TIMEOUT``, which is also the
+longest a page stays stale when an invalidation could not reach the cache.
+
+Versions are nanosecond timestamps rather than counters, so a version evicted
+from the cache is never recreated with a value an old entry was stored under.
+
+The cache is an optimization, not a dependency: when it cannot be reached the
+error is logged, the lookup counted as a miss and the page built from the
+database.
+"""
+
+import logging
+import time
+from typing import Any, Callable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from monitoring.metrics import PAGE_CACHE_LOOKUPS
+
+from .models import Project, ProjectRun, ResourceUsage
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(scope: str) -> str:
+    """Return the cache key holding the version of a scope."""
+    return f"projects:version:{scope}"
+
+
+def project_scope(user_id: int, project_name: str) -> str:
+    """Return the version scope of one project's detail page."""
+    return f"project:{user_id}:{project_name}"
+
+
+def user_scope(user_id: int) -> str:
+    """Return the version scope of a user's project list."""
+    return f"user:{user_id}"
+
+
+def get_version(scope: str) -> int:
+    """Return the current version of a scope, starting one if there is none."""
+    version = cache.get(_version_key(scope))
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(_version_key(scope), version, settings.PAGE_CACHE_TIMEOUT):
+            version = cache.get(_version_key(scope), version)
+    return version
+
+
+def bump_version(scope: str) -> None:
+    """Give a scope a new version, orphaning every entry stored under the old one."""
+    try:
+        cache.set(_version_key(scope), time.time_ns(), settings.PAGE_CACHE_TIMEOUT)
+    except Exception as exc:
+        logger.warning(f"Could not invalidate cached pages of {scope}: {exc}")
+
+
+def cached(page: str, scope: str, key: str, compute: Callable[[], Any]) -> Any:
+    """Return page data from the cache, computing and storing it on a miss.
+
+    :param page: Name of the page, used as a metric label
+    :param scope: Version scope the data depends on
+    :param key: Key of the data within the scope
+    :param compute: Builds the data on a miss or when the cache is down; exceptions propagate and nothing is stored
+    :return: The data
+    """
+    try:
+        full_key = f"projects:page:{page}:{scope}:{get_version(scope)}:{key}"
+        value = cache.get(full_key)
+    except Exception as exc:
+        logger.warning(f"Page cache unavailable, building {page} from the database: {exc}")
+        PAGE_CACHE_LOOKUPS.inc(page=page, result="miss")
+        return compute()
+    if value is not None:
+        PAGE_CACHE_LOOKUPS.inc(page=page, result="hit")
+        return value
+    PAGE_CACHE_LOOKUPS.inc(page=page, result="miss")
+    value = compute()
+    try:
+        cache.set(full_key, value, settings.PAGE_CACHE_TIMEOUT)
+    except Exception as exc:
+        logger.warning(f"Could not store {page} in the page cache: {exc}")
+    return value
+
+
+def invalidate_project(user_id: int, project_name: str) -> None:
+    """Drop the cached pages that show a project."""
+    bump_version(project_scope(user_id, project_name))
+    bump_version(user_scope(user_id))
+
+
+@receiver([post_save, post_delete], sender=Project)
+def project_changed(sender, instance: Project, **kwargs) -> None:
+    """Invalidate the pages of a saved or deleted project."""
+    invalidate_project(instance.user_id, instance.name)
+
+
+@receiver([post_save, post_delete], sender=ProjectRun)
+@receiver([post_save, post_delete], sender=ResourceUsage)
+def project_task_changed(sender, instance, **kwargs) -> None:
+    """Invalidate the pages of a project whose task was queued, moved on or measured."""
+    project = Project.objects.filter(id=instance.project_id).values_list("user_id", "name").first()
+    if project:
+        invalidate_project(*project)
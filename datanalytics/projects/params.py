@@ -0,0 +1,159 @@
+"""Versioned project parameters.
+
+Every save of the parameter form adds a ``ParameterSet`` row holding the
+parameters as JSON, numbered from 1 per project. Saving parameters identical to
+the latest version adds nothing. The digest of the canonical JSON identifies a
+version's content, so two versions, or a stage's inputs, can be compared
+without reading them.
+
+Gizmo reads its parameters from ``params/params_<user>_<project>.json`` under
+``MEDIA_ROOT``. That file is written by ``materialize`` when a run starts, from
+the version the run was queued with, and nowhere else.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import ParameterSet, Project, ProjectRun, get_param_file_name
+
+# Gizmo options the form does not edit yet
+FIXED_PARAMS = {
+    "lr_features": [],
+    "lr_features_to_include": [],
+    "trees_features_to_include": [],
+    "trees_features_to_exclude": [],
+    "main_table": "input.csv",
+    "columns_to_include": [],
+    "custom_calculations": [],
+    "additional_tables": [],
+}
+
+
+def build_params(cleaned_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return gizmo's parameters from the cleaned data of ``ParamForm``.
+
+    :param cleaned_data: Cleaned data of a valid form
+    :return: The parameters
+    """
+    return {
+        "criterion_column": cleaned_data["criterion_column"],
+        "missing_treatment": cleaned_data["missing_treatment"],
+        "observation_date_column": cleaned_data["observation_date_column"],
+        "secondary_criterion_columns": cleaned_data["secondary_criterion_columns"],
+        "t1df": cleaned_data["t1df"],
+        "t2df": cleaned_data["t2df"],
+        "t3df": cleaned_data["t3df"],
+        "periods_to_exclude": list(cleaned_data.get("periods_to_exclude", [])),
+        "columns_to_exclude": list(cleaned_data.get("columns_to_exclude", [])),
+        "cut_offs": {
+            "xgb": cleaned_data["xgb_cutoffs"],
+            "lr": cleaned_data["lr_cutoffs"],
+            "dt": cleaned_data["dt_cutoffs"],
+            "rf": cleaned_data["rf_cutoffs"],
+        },
+        "under_sampling": cleaned_data["under_sampling"],
+        "optimal_binning_columns": list(cleaned_data.get("optimal_binning_columns", [])),
+        **FIXED_PARAMS,
+    }
+
+
+def params_digest(params: Dict[str, Any]) -> str:
+    """Return the SHA-256 of parameters as canonical JSON."""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def latest_parameter_set(project: Project) -> Optional[ParameterSet]:
+    """Return the latest version of a project's parameters, None if they were never saved."""
+    return project.parameter_sets.order_by("-version").first()
+
+
+def current_params(project: Project) -> Optional[Dict[str, Any]]:
+    """Return the latest parameters of a project, None if they were never saved."""
+    parameter_set = latest_parameter_set(project)
+    return parameter_set.params if parameter_set else None
+
+
+def run_parameter_set(project: Project, task_id: Optional[str]) -> Optional[ParameterSet]:
+    """Return the version a task was queued with, the latest one if it was not recorded.
+
+    :param project: The project
+    :param task_id: Id of the task
+    :return: The version, None if the parameters were never saved
+    """
+    run = ProjectRun.objects.filter(task_id=task_id).select_related("parameter_set").first() if task_id else None
+    if run is not None and run.parameter_set is not None:
+        return run.parameter_set
+    return latest_parameter_set(project)
+
+
+def save_parameter_set(project: Project, params: Dict[str, Any]) -> ParameterSet:
+    """Store parameters as the project's next version.
+
+    :param project: The project
+    :param params: The parameters
+    :return: The new version, or the latest one when it holds the same parameters
+    """
+    digest = params_digest(params)
+    for attempt in range(2):
+        latest = latest_parameter_set(project)
+        if latest is not None and latest.digest == digest:
+            return latest
+        try:
+            with transaction.atomic():
+                return ParameterSet.objects.create(
+                    project=project, version=latest.version + 1 if latest else 1, params=params, digest=digest,
+                )
+        except IntegrityError:
+            # Another save took the version number, number after it
+            if attempt:
+                raise
+
+
+def diff_params(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+    """Return the parameters that differ between two versions.
+
+    :param old: Parameters of the earlier version
+    :param new: Parameters of the later version
+    :return: ``(old value, new value)`` by parameter name, None for a parameter missing from a side
+    """
+    return {
+        name: (old.get(name), new.get(name))
+        for name in sorted(set(old) | set(new))
+        if old.get(name) != new.get(name)
+    }
+
+
+def materialize(project: Project, parameter_set: ParameterSet) -> str:
+    """Write a version's parameters where gizmo reads them.
+
+    The file is replaced in one step and left alone when it already holds the
+    same parameters.
+
+    :param project: The project
+    :param parameter_set: Version to write
+    :return: Absolute path of the parameter file
+    """
+    name = get_param_file_name(project, "")
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    content = json.dumps(parameter_set.params, indent=4)
+    try:
+        with open(path, encoding="utf-8") as f:
+            unchanged = f.read() == content
+    except OSError:
+        unchanged = False
+    if not unchanged:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    if project.param_file.name != name:
+        project.param_file.name = name
+        Project.objects.filter(pk=project.pk).update(param_file=name)
+    return path
@@ -0,0 +1,190 @@
+"""Streaming stages of data preparation: under-sampling and missing value treatment.
+
+The ``under_sampling`` parameter is the share of majority class rows to keep.
+``undersample_csv`` applies it per observation period: it counts the rows of
+every (period, criterion) stratum reading only those two columns, draws the
+exact number of majority rows to keep in each period with a seeded generator,
+then streams the file once more and writes the kept rows, minority rows always
+included. Every period therefore keeps the same share of its majority rows, and
+the same seed selects the same rows.
+
+The result is written next to a ``prep_manifest.json`` holding the counts per
+stratum and the weight that restores the population figures, so later stages
+can undo the sampling where they need to. Missing value treatment (see
+``projects.imputation``) runs on the sampled rows and records its fill values in
+the same manifest.
+"""
+
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .imputation import FILL_TREATMENTS, Treatment, apply_treatment, input_fill_statistics
+from .models import Project
+from .params import current_params
+from .report_cache import input_digest
+from .sampling import count_strata, select_rows
+
+SAMPLED_NAME = "sampled.csv"
+TREATED_NAME = "treated.csv"
+MANIFEST_NAME = "prep_manifest.json"
+
+
+@dataclass
+class UnderSample:
+    """What an under-sampling run kept."""
+
+    ratio: float
+    seed: int
+    criterion_column: str
+    observation_date_column: str
+    majority_class: Optional[str] = None
+    majority_weight: float = 1.0
+    population_rows: int = 0
+    rows: int = 0
+    strata: List[Dict[str, object]] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+
+def keep_counts(counts: Dict[Tuple, int], ratio: float) -> Tuple[Optional[str], Dict[Tuple, int]]:
+    """Return the majority class and the number of rows to keep from each stratum.
+
+    :param counts: Row count per (period, criterion) stratum
+    :param ratio: Share of majority class rows to keep, between 0 and 1
+    :return: Tuple of (majority class, rows to keep per stratum)
+    """
+    classes: Dict[str, int] = {}
+    for (_, label), count in counts.items():
+        if label != "nan":
+            classes[label] = classes.get(label, 0) + count
+    if not classes:
+        return None, dict(counts)
+    majority = max(sorted(classes), key=classes.get)
+    return majority, {
+        key: int(round(count * ratio)) if key[1] == majority else count
+        for key, count in counts.items()
+    }
+
+
+def undersample_csv(path: str, out_path: str, criterion_column: str, date_column: str, ratio: float,
+                    seed: int = 0, chunk_cells: int = 2_000_000) -> UnderSample:
+    """Write the rows of a file kept by under-sampling its majority class per period.
+
+    :param path: Path of the CSV file
+    :param out_path: Path of the sampled CSV file
+    :param criterion_column: Criterion column whose most frequent value is under-sampled
+    :param date_column: Observation date column, each period is sampled on its own
+    :param ratio: Share of majority class rows to keep, between 0 and 1
+    :param seed: Seed of the row selection, the same seed gives the same rows
+    :param chunk_cells: Approximate number of cells read per chunk, bounds memory use
+    :return: Summary of the run
+    """
+    strata_columns = [date_column, criterion_column]
+    counts = count_strata(path, strata_columns, chunk_cells)
+    majority, keep = keep_counts(counts, ratio)
+
+    rng = np.random.default_rng(seed)
+    selected = {
+        key: np.arange(counts[key]) if keep[key] == counts[key]
+        else np.sort(rng.choice(counts[key], size=keep[key], replace=False))
+        for key in sorted(counts, key=str)
+    }
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    rows = 0
+    with open(tmp_path, "w", newline="") as f:
+        for chunk in select_rows(path, selected, strata_columns, chunk_cells):
+            chunk.to_csv(f, index=False, header=rows == 0)
+            rows += len(chunk)
+        if not rows:
+            pd.read_csv(path, nrows=0).to_csv(f, index=False)
+    os.replace(tmp_path, out_path)
+
+    return UnderSample(
+        ratio=ratio,
+        seed=seed,
+        criterion_column=criterion_column,
+        observation_date_column=date_column,
+        majority_class=majority,
+        majority_weight=1 / ratio if ratio else 0.0,
+        population_rows=sum(counts.values()),
+        rows=rows,
+        strata=[
+            {"period": period, "class": label, "rows": counts[(period, label)], "kept": keep[(period, label)]}
+            for period, label in sorted(counts, key=str)
+        ],
+    )
+
+
+def write_manifest(directory: str, sample: Optional[UnderSample], extra: Optional[Dict[str, object]] = None) -> str:
+    """Write the prep manifest of a run.
+
+    :param directory: Output directory of the preparation
+    :param sample: Summary of the under-sampling run, None if it did not run
+    :param extra: Further entries to record
+    :return: Path of the manifest
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"under_sampling": asdict(sample) if sample else None, **(extra or {})}, f, indent=4)
+    return path
+
+
+@dataclass
+class Preparation:
+    """Outputs of the streaming preparation stages."""
+
+    path: str
+    sample: Optional[UnderSample] = None
+    treatment: Optional[Treatment] = None
+
+
+def prepare_project(project: Project, directory: str, params: Optional[Dict] = None) -> Preparation:
+    """Run the streaming preparation stages of a project into its output directory.
+
+    Under-sampling only runs when the saved ``under_sampling`` parameter is below
+    1, and missing value treatment only when ``missing_treatment`` is not
+    ``Missing``. Outputs of an earlier run that no longer apply are removed so
+    no stale file is left.
+
+    :param project: The project
+    :param directory: Output directory of the preparation
+    :param params: Parameters of the run, the latest saved version by default
+    :return: Outputs of the run, with the path of the prepared file
+    """
+    if params is None:
+        params = current_params(project) or {}
+    ratio = float(params.get("under_sampling", 1))
+    method = params.get("missing_treatment", "Missing")
+    criterion, date_column = params.get("criterion_column"), params.get("observation_date_column")
+
+    os.makedirs(directory, exist_ok=True)
+    for name in (SAMPLED_NAME, TREATED_NAME, MANIFEST_NAME):
+        if os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+    source = project.input_dataframe.path
+    preparation = Preparation(source)
+
+    if ratio < 1 and criterion and date_column:
+        # Seeding from the content makes the sample a function of the input
+        preparation.path = os.path.join(directory, SAMPLED_NAME)
+        preparation.sample = undersample_csv(source, preparation.path, criterion, date_column, ratio,
+                                             seed=int(input_digest(project)[:8], 16))
+
+    if method != "Missing":
+        # Fill values describe the population, not the under-sampled rows
+        statistics = input_fill_statistics(source) if method in FILL_TREATMENTS else {}
+        treated_path = os.path.join(directory, TREATED_NAME)
+        preparation.treatment = apply_treatment(preparation.path, treated_path, method, statistics)
+        preparation.path = treated_path
+
+    if preparation.sample or preparation.treatment:
+        write_manifest(directory, preparation.sample, {
+            "missing_treatment": preparation.treatment.as_dict() if preparation.treatment else None,
+        })
+    return preparation
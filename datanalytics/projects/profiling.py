@@ -0,0 +1,280 @@
+"""Built-in profiling engine for project input files.
+
+``profile_csv`` reads the file once in chunks and feeds each column of each
+chunk to a ``ColumnProfile``. Exact figures (counts, missing values, moments,
+ranges) are accumulated directly; quantiles, histograms, distinct counts and top
+values come from the fixed-size sketches in ``projects.sketches``. Memory use
+is therefore bounded by the chunk size, not by the number of rows.
+
+``render_profile`` turns the result into a self-contained HTML page.
+"""
+
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.template.loader import render_to_string
+
+from .forms import is_date_column
+from .sketches import DistinctSketch, FrequentItems, QuantileSketch
+
+ENGINE_VERSION = "1"
+
+DATE_FORMAT = "%m/%d/%Y"
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+HISTOGRAM_BINS = 20
+TOP_VALUES = 10
+
+
+def infer_kind(series: pd.Series) -> str:
+    """Return how a column is profiled, judged from the values of a first chunk.
+
+    :param series: The column's values
+    :return: One of ``numeric``, ``date`` or ``text``
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return "numeric"
+    present = series.dropna()
+    if len(present) and is_date_column(present):
+        return "date"
+    return "text"
+
+
+class ColumnProfile:
+    """Running statistics of one column.
+
+    The kind of the column (numeric, date or text) is decided on the first chunk.
+    Values of later chunks that do not parse as that kind are counted as invalid.
+    """
+
+    def __init__(self, name: str, kind: str) -> None:
+        """Initialize an empty profile.
+
+        :param name: Column name
+        :param kind: One of ``numeric``, ``date`` or ``text``
+        """
+        self.name = name
+        self.kind = kind
+        self.count = 0
+        self.missing = 0
+        self.invalid = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.zeros = 0
+        self.minimum = None
+        self.maximum = None
+        self.quantiles = QuantileSketch()
+        self.distinct = DistinctSketch()
+        self.frequent = FrequentItems()
+
+    @classmethod
+    def infer(cls, name: str, series: pd.Series) -> "ColumnProfile":
+        """Create a profile whose kind suits the values of a first chunk.
+
+        :param name: Column name
+        :param series: The column's values in the first chunk
+        :return: Empty profile of the inferred kind
+        """
+        return cls(name, infer_kind(series))
+
+    def _update_range(self, low, high) -> None:
+        """Widen the exact minimum and maximum."""
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def update(self, series: pd.Series) -> None:
+        """Add the values of one chunk."""
+        present = series.notna()
+        self.missing += int(len(series) - present.sum())
+        series = series[present]
+
+        if self.kind == "numeric":
+            values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64)
+            valid = values[~np.isnan(values)]
+            self.update_numeric(valid, invalid=len(values) - len(valid))
+        elif self.kind == "date":
+            dates = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce").dropna()
+            self.update_dates(dates.to_numpy(dtype="datetime64[ns]").view(np.int64), invalid=len(series) - len(dates))
+        else:
+            self.update_text(series.astype(str).value_counts(sort=False))
+
+    def update_numeric(self, valid: np.ndarray, invalid: int = 0) -> None:
+        """Add parsed numeric values.
+
+        :param valid: Float values without NaN
+        :param invalid: Number of present values that did not parse as numbers
+        """
+        self.invalid += invalid
+        if not len(valid):
+            return
+        # Chan et al. parallel update of the mean and sum of squared deviations
+        chunk_mean = valid.mean()
+        delta = chunk_mean - self.mean
+        total = self.count + len(valid)
+        self.m2 += ((valid - chunk_mean) ** 2).sum() + delta ** 2 * self.count * len(valid) / total
+        self.mean += delta * len(valid) / total
+        self.count = total
+        self.zeros += int((valid == 0).sum())
+        self._update_range(float(valid.min()), float(valid.max()))
+        self.quantiles.update(valid)
+        self.distinct.update(valid)
+        self.frequent.update(pd.Series(valid).value_counts(sort=False))
+
+    def update_dates(self, valid: np.ndarray, invalid: int = 0) -> None:
+        """Add parsed dates.
+
+        :param valid: Dates as int64 nanoseconds since the epoch, without NaT
+        :param invalid: Number of present values that did not parse as dates
+        """
+        self.invalid += invalid
+        self.count += len(valid)
+        if not len(valid):
+            return
+        dates = pd.Series(valid.view("datetime64[ns]"))
+        self._update_range(dates.min(), dates.max())
+        self.distinct.update(valid)
+        # Months are counted as yyyymm integers, formatting every date is slow
+        self.frequent.update((dates.dt.year * 100 + dates.dt.month).value_counts(sort=False))
+
+    def update_text(self, counts: pd.Series) -> None:
+        """Add text values given as the count of each distinct value.
+
+        :param counts: Number of occurrences indexed by value
+        """
+        counts = counts[counts > 0]
+        if not len(counts):
+            return
+        self.count += int(counts.sum())
+        lengths = counts.index.str.len()
+        self._update_range(int(lengths.min()), int(lengths.max()))
+        self.distinct.update(counts.index.to_numpy(dtype=object))
+        self.frequent.update(counts)
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation of a numeric column."""
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else float("nan")
+
+    def histogram(self, bins: int = HISTOGRAM_BINS) -> List[Dict[str, float]]:
+        """Return the estimated histogram of a numeric column between its exact range."""
+        if self.kind != "numeric" or not self.count:
+            return []
+        if self.minimum == self.maximum:
+            return [{"low": self.minimum, "high": self.maximum, "count": self.count, "height": 100.0}]
+        edges = np.linspace(self.minimum, self.maximum, bins + 1)
+        counts = self.quantiles.histogram(edges)
+        tallest = counts.max() or 1
+        return [
+            {"low": float(low), "high": float(high), "count": int(round(count)), "height": float(100 * count / tallest)}
+            for low, high, count in zip(edges[:-1], edges[1:], counts)
+        ]
+
+    def summary(self, rows: int) -> Dict[str, object]:
+        """Return the figures shown in the report.
+
+        :param rows: Number of rows in the file
+        :return: Dictionary of column statistics
+        """
+        frequent = self.frequent.top(TOP_VALUES)
+        if self.kind == "date":
+            frequent = [(f"{month // 100}-{month % 100:02d}", count) for month, count in sorted(frequent)]
+        summary = {
+            "name": self.name,
+            "kind": self.kind,
+            "count": self.count,
+            "missing": self.missing,
+            "missing_pct": 100 * self.missing / rows if rows else 0.0,
+            "invalid": self.invalid,
+            "distinct": self.distinct.estimate(),
+            "distinct_exact": self.distinct.exact,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "top_values": [
+                {"value": value, "count": count, "pct": 100 * count / self.count if self.count else 0.0}
+                for value, count in frequent
+            ],
+            "top_values_error": int(self.frequent.error),
+        }
+        if self.kind == "numeric":
+            summary.update({
+                "mean": self.mean if self.count else float("nan"),
+                "std": self.std,
+                "zeros": self.zeros,
+                "quantiles": [
+                    {"label": f"p{round(q * 100)}", "value": value}
+                    for q, value in zip(QUANTILES, self.quantiles.quantiles(QUANTILES))
+                ],
+                "histogram": self.histogram(),
+            })
+        return summary
+
+
+@dataclass
+class DatasetProfile:
+    """Profile of a whole file."""
+
+    source: str
+    rows: int = 0
+    columns: List[ColumnProfile] = field(default_factory=list)
+    seconds: float = 0.0
+    generated_at: datetime = field(default_factory=datetime.now)
+    note: str = ""
+
+    def summary(self) -> Dict[str, object]:
+        """Return the figures shown in the report."""
+        return {
+            "source": self.source,
+            "rows": self.rows,
+            "column_count": len(self.columns),
+            "seconds": self.seconds,
+            "generated_at": self.generated_at,
+            "engine_version": ENGINE_VERSION,
+            "note": self.note,
+            "columns": [column.summary(self.rows) for column in self.columns],
+        }
+
+
+def profile_chunks(chunks, source: str) -> DatasetProfile:
+    """Profile an iterable of DataFrame chunks with the same columns.
+
+    :param chunks: Iterable of DataFrames
+    :param source: Name of the data shown in the report
+    :return: The dataset profile
+    """
+    start = time.perf_counter()
+    profile = DatasetProfile(source=source)
+    for chunk in chunks:
+        if not profile.columns:
+            profile.columns = [ColumnProfile.infer(str(name), chunk[name]) for name in chunk.columns]
+        profile.rows += len(chunk)
+        for column, name in zip(profile.columns, chunk.columns):
+            column.update(chunk[name])
+    profile.seconds = time.perf_counter() - start
+    return profile
+
+
+def profile_csv(path: str, chunk_cells: int = 2_000_000, source: Optional[str] = None) -> DatasetProfile:
+    """Profile a CSV file in one chunked pass.
+
+    :param path: Path of the CSV file
+    :param chunk_cells: Approximate number of cells read per chunk, bounds memory use
+    :param source: Name shown in the report, defaults to the path
+    :return: The dataset profile
+    """
+    columns = len(pd.read_csv(path, nrows=0).columns) or 1
+    chunk_rows = max(chunk_cells // columns, 1_000)
+    with pd.read_csv(path, chunksize=chunk_rows) as reader:
+        return profile_chunks(reader, source or path)
+
+
+def render_profile(profile: DatasetProfile, title: str) -> str:
+    """Render a profile as a self-contained HTML page.
+
+    :param profile: The dataset profile
+    :param title: Page title
+    :return: HTML document
+    """
+    return render_to_string("projects/profile_report.html", {"title": title, "profile": profile.summary()})
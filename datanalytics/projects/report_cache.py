@@ -0,0 +1,251 @@
+"""Content-addressed cache of analysis reports.
+
+A report is stored under ``reports/cache`` in ``MEDIA_ROOT``, named by the hash
+of the input file's content, the report options and the report engine's version.
+The project's ``sweetviz_report`` field points straight at the cache entry, so
+each report exists once on disk however many projects use it, and asking again
+for a report that exists costs a file lookup.
+
+Every report is stored next to gzip and, when the ``brotli`` package is
+installed, brotli compressed copies (``<key>.html.gz`` and ``<key>.html.br``),
+which ``projects.delivery`` serves to clients that accept them. They are written
+before the report itself is published, so a report found in the cache always has
+its compressed copies.
+
+An entry's modification time is bumped whenever it is used. When the cache grows
+past ``REPORT_CACHE_QUOTA_BYTES`` the least recently used entries that no project
+points at are deleted together with their compressed copies.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from importlib.metadata import PackageNotFoundError, version
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # Optional, reports are then only stored gzip compressed
+    brotli = None
+
+from .models import Project
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "reports/cache"
+
+# Partly written reports younger than this belong to a running task
+TMP_GRACE_SECONDS = 24 * 60 * 60
+
+# Content codings of the stored copies and their file suffixes, preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def input_digest(project: Project) -> str:
+    """Return the SHA-256 of the project's input file, hashing it on first use.
+
+    Uploads are hashed as they arrive, see ``projects.blobs``; the input of a
+    project created before that is hashed here once. Input files are never
+    replaced after upload, so the digest is stored on the project.
+
+    :param project: The project
+    :return: Hex digest
+    """
+    if not project.input_digest:
+        sha = hashlib.sha256()
+        with project.input_dataframe.open("rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        project.input_digest = sha.hexdigest()
+        project.save(update_fields=["input_digest"])
+    return project.input_digest
+
+
+def engine_version(backend: str) -> str:
+    """Return the name and version of the engine that renders a backend's reports."""
+    # profiling and sampling load pandas, so they are imported on first use rather than with the URLconf
+    from .profiling import ENGINE_VERSION
+    if backend == Project.REPORT_NATIVE:
+        return f"native-{ENGINE_VERSION}"
+    try:
+        return f"sweetviz-{version('sweetviz')}"
+    except PackageNotFoundError:
+        return "sweetviz-unknown"
+
+
+def report_options(project: Project, sample_rows: int) -> Dict[str, object]:
+    """Return every setting that changes the content of a project's report.
+
+    :param project: The project
+    :param sample_rows: Row budget of the sample, 0 for the full file
+    :return: Dictionary of report options
+    """
+    from .sampling import report_strata_columns
+    return {
+        "backend": project.report_backend,
+        "sample_rows": sample_rows,
+        "strata": report_strata_columns(project) if sample_rows else [],
+    }
+
+
+def report_key(digest: str, options: Dict[str, object], engine: str) -> str:
+    """Return the cache key of a report.
+
+    :param digest: Digest of the input file
+    :param options: Report options
+    :param engine: Engine name and version
+    :return: Hex digest identifying the report
+    """
+    payload = json.dumps({"input": digest, "options": options, "engine": engine}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def project_report_key(project: Project, sample_rows: int) -> str:
+    """Return the cache key of a project's report, hashing the input if needed."""
+    return report_key(input_digest(project), report_options(project, sample_rows),
+                      engine_version(project.report_backend))
+
+
+def cache_name(key: str) -> str:
+    """Return the storage name of a cache entry, relative to ``MEDIA_ROOT``."""
+    return f"{CACHE_DIR}/{key[:2]}/{key}.html"
+
+
+def cache_path(key: str) -> str:
+    """Return the absolute path of a cache entry."""
+    return os.path.join(settings.MEDIA_ROOT, cache_name(key))
+
+
+def lookup(key: str) -> Optional[str]:
+    """Return the storage name of a cached report and mark it as used, or None on a miss."""
+    path = cache_path(key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return cache_name(key)
+
+
+def find_report(project: Project, sample_rows: int) -> Optional[str]:
+    """Return the cached report of a project without hashing its input.
+
+    :param project: The project
+    :param sample_rows: Row budget of the sample, 0 for the full file
+    :return: Storage name of the report, None if it is not cached or the input was never hashed
+    """
+    if not project.input_digest:
+        return None
+    return lookup(project_report_key(project, sample_rows))
+
+
+def compress_report(path: str) -> Dict[str, str]:
+    """Write the compressed copies of a report next to it.
+
+    Compression runs once per report at the highest level, so every later
+    download is smaller at no extra cost.
+
+    :param path: Path of the HTML report
+    :return: Path of each compressed copy by content coding
+    """
+    copies = {}
+    with open(path, "rb") as src, open(f"{path}.gz", "wb") as raw:
+        # A fixed mtime keeps the bytes, and so the ETag, a function of the report
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9, mtime=0) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    copies["gzip"] = f"{path}.gz"
+    if brotli is not None:
+        with open(path, "rb") as src:
+            data = brotli.compress(src.read(), mode=brotli.MODE_TEXT)
+        with open(f"{path}.br", "wb") as dst:
+            dst.write(data)
+        copies["br"] = f"{path}.br"
+    return copies
+
+
+def publish_report(tmp_path: str, path: str) -> None:
+    """Compress a finished report and move it and its copies to their cache path.
+
+    The report itself is moved last, so lookups never see it without its copies.
+
+    :param tmp_path: Path the report was written to
+    :param path: Cache path of the report
+    """
+    suffixes = dict(ENCODINGS)
+    for encoding, copy in compress_report(tmp_path).items():
+        os.replace(copy, f"{path}{suffixes[encoding]}")
+    os.replace(tmp_path, path)
+
+
+def discard_report(tmp_path: str) -> None:
+    """Remove a report that was not published, with any compressed copies written of it.
+
+    :param tmp_path: Path the report was written to
+    """
+    for path in [tmp_path] + [f"{tmp_path}{suffix}" for _, suffix in ENCODINGS]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _entry_path(path: str) -> str:
+    """Return the path of the report a cache file belongs to."""
+    return path[:path.rindex(".html") + len(".html")] if ".html" in path else path
+
+
+def collect_garbage(quota: int) -> List[str]:
+    """Delete least recently used reports until the cache fits in the quota.
+
+    Reports that a project points at are never deleted.
+
+    :param quota: Maximum total size of the cache in bytes
+    :return: Storage names of the deleted reports
+    """
+    root = os.path.join(settings.MEDIA_ROOT, CACHE_DIR)
+    # Group each report with its compressed copies: (last use, size, files)
+    groups: Dict[str, list] = {}
+    for directory, _, files in os.walk(root):
+        for filename in files:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if ".tmp" in filename and time.time() - stat.st_mtime < TMP_GRACE_SECONDS:
+                continue
+            group = groups.setdefault(_entry_path(path), [0.0, 0, []])
+            group[0] = max(group[0], stat.st_mtime)
+            group[1] += stat.st_size
+            group[2].append(path)
+    entries = [(mtime, size, path, files) for path, (mtime, size, files) in groups.items()]
+
+    total = sum(size for _, size, _, _ in entries)
+    if total <= quota:
+        return []
+
+    referenced = set(
+        Project.objects.filter(sweetviz_report__startswith=CACHE_DIR).values_list("sweetviz_report", flat=True)
+    )
+    removed = []
+    for _, size, path, files in sorted(entries):
+        if total <= quota:
+            break
+        name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")
+        if name in referenced:
+            continue
+        for file in files:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed.append(name)
+    if removed:
+        logger.info(f"Removed {len(removed)} reports from the cache, {total} bytes left")
+    return removed
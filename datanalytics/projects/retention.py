@@ -0,0 +1,237 @@
+"""Retention of the files gizmo and the project tasks leave under ``MEDIA_ROOT``.
+
+Training sessions accumulate in ``sessions/`` with every run, and the
+``input_data/``, ``output_data/`` and ``reports/`` entries of deleted projects
+are never removed. This module plans which of them can go and archives them:
+
+* Sessions are grouped by project and training run (``TRAIN_<project>_<stamp>``
+  and the ``EVAL_`` session made from it share the stamp). The newest
+  ``keep_sessions`` runs are kept, from the project's ``RetentionPolicy``, else
+  its owner's, else ``RETENTION_KEEP_SESSIONS``. Sessions of a deleted project
+  are all archived.
+* The input and output directories of deleted projects, and reports directly in
+  ``reports/`` that no project points at, are archived. The report cache in
+  ``reports/cache`` has its own quota, see ``projects.report_cache``.
+* Input blobs no project uses are removed after archiving, see
+  ``projects.blobs``. An archived input directory holds the file's content,
+  since the input file is a hard link to the blob.
+
+Nothing a ``Project`` row references is ever touched: the input file, the
+preparation output, the current evaluation session and the training session it
+came from, and the report. Projects with a task queued or running are skipped.
+
+Each entry is archived on its own into ``RETENTION_ARCHIVE_DIR`` as a
+``.tar.gz`` under its path relative to ``MEDIA_ROOT``. The original is removed
+only once its tarball is complete, and archiving the same entry again simply
+rewrites the tarball, so an interrupted run leaves nothing half done and the
+next run picks up where it stopped. Runs archive at most ``limit`` entries,
+oldest first, so a large backlog is worked off over several scheduled runs.
+"""
+
+import os
+import re
+import shutil
+import tarfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .blobs import collect_blobs
+from .models import Project, ProjectRun, RetentionPolicy, get_project_file_name
+
+SESSION_NAME = re.compile(r"^(TRAIN|EVAL)_(.+)_(\d{8}_\d{6})$")
+LOCK_KEY = "projects:retention:lock"
+LOCK_SECONDS = 6 * 3600
+
+
+@dataclass
+class RetentionAction:
+    """One file or directory to archive."""
+
+    kind: str
+    path: str
+    reason: str
+    size_bytes: int
+    mtime: float
+
+
+def entry_size(path: str) -> int:
+    """Return the size in bytes of a file, or of every file under a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, filename))
+            except OSError:
+                continue
+    return total
+
+
+def referenced_paths(projects: Iterable[Project]) -> Set[str]:
+    """Return the absolute paths the projects reference, which are never archived.
+
+    :param projects: Projects, with their users loaded
+    :return: Normalized absolute paths
+    """
+    paths = set()
+    for project in projects:
+        if project.input_dataframe:
+            paths.add(os.path.dirname(os.path.join(settings.MEDIA_ROOT, project.input_dataframe.name)))
+        if project.prep_output:
+            paths.add(project.prep_output)
+        if project.train_eval_output:
+            paths.add(project.train_eval_output)
+            # The evaluation session is built from the training session of the same stamp
+            head, name = os.path.split(project.train_eval_output)
+            if name.startswith("EVAL_"):
+                paths.add(os.path.join(head, "TRAIN_" + name[len("EVAL_"):]))
+        if project.sweetviz_report:
+            paths.add(os.path.join(settings.MEDIA_ROOT, project.sweetviz_report.name))
+    return {os.path.normpath(os.path.abspath(path)) for path in paths}
+
+
+def keep_sessions(projects: Iterable[Project]) -> Dict[int, int]:
+    """Return how many training runs are kept for each project.
+
+    :param projects: Projects
+    :return: Runs kept by project id
+    """
+    by_user, by_project = {}, {}
+    for policy in RetentionPolicy.objects.all():
+        if policy.project_id:
+            by_project[policy.project_id] = policy.keep_sessions
+        else:
+            by_user[policy.user_id] = policy.keep_sessions
+    return {
+        project.id: by_project.get(project.id, by_user.get(project.user_id, settings.RETENTION_KEEP_SESSIONS))
+        for project in projects
+    }
+
+
+def _entries(folder: str) -> Iterator[os.DirEntry]:
+    """Yield the entries of a folder under ``MEDIA_ROOT``, nothing if it does not exist."""
+    try:
+        with os.scandir(os.path.join(settings.MEDIA_ROOT, folder)) as entries:
+            yield from list(entries)
+    except FileNotFoundError:
+        return
+
+
+def _action(kind: str, entry: os.DirEntry, reason: str) -> RetentionAction:
+    """Describe the archiving of one entry."""
+    path = os.path.normpath(os.path.abspath(entry.path))
+    return RetentionAction(kind, path, reason, entry_size(path), entry.stat().st_mtime)
+
+
+def plan_retention() -> List[RetentionAction]:
+    """List the entries the retention policies would archive, oldest first.
+
+    :return: The actions, nothing referenced by a project and nothing of a busy project
+    """
+    projects = list(Project.objects.select_related("user"))
+    by_file_name = {get_project_file_name(project): project for project in projects}
+    referenced = referenced_paths(projects)
+    keep = keep_sessions(projects)
+    busy = set(
+        ProjectRun.objects.filter(status__in=ProjectRun.RUNNING_STATUSES).values_list("project_id", flat=True)
+    )
+    actions = []
+
+    runs: Dict[str, Dict[str, List[os.DirEntry]]] = {}
+    for entry in _entries("sessions"):
+        match = SESSION_NAME.match(entry.name)
+        if match and entry.is_dir():
+            runs.setdefault(match.group(2), {}).setdefault(match.group(3), []).append(entry)
+    for file_name, stamps in runs.items():
+        project = by_file_name.get(file_name)
+        if project is not None and project.id in busy:
+            continue
+        kept = set(sorted(stamps, reverse=True)[:keep[project.id]]) if project else set()
+        reason = f"older than the last {keep[project.id]} training runs" if project else "project deleted"
+        for stamp, entries in stamps.items():
+            if stamp not in kept:
+                actions.extend(_action("session", entry, reason) for entry in entries)
+
+    for kind, folder in (("input", "input_data"), ("output", "output_data")):
+        for entry in _entries(folder):
+            if entry.is_dir() and entry.name not in by_file_name:
+                actions.append(_action(kind, entry, "project deleted"))
+
+    for entry in _entries("reports"):
+        if entry.is_file():
+            actions.append(_action("report", entry, "no project shows it"))
+
+    actions = [action for action in actions if action.path not in referenced]
+    return sorted(actions, key=lambda action: action.mtime)
+
+
+def archive_path(path: str) -> str:
+    """Return where the tarball of an entry is stored."""
+    relative = os.path.relpath(path, os.path.abspath(settings.MEDIA_ROOT))
+    return os.path.join(settings.RETENTION_ARCHIVE_DIR, f"{relative}.tar.gz")
+
+
+def archive(action: RetentionAction) -> str:
+    """Store an entry in a tarball and remove it.
+
+    :param action: The entry
+    :return: Path of the tarball
+    """
+    target = archive_path(action.path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    with tarfile.open(tmp_path, "w:gz") as tar:
+        tar.add(action.path, arcname=os.path.basename(action.path))
+    os.replace(tmp_path, target)
+    if os.path.isdir(action.path):
+        shutil.rmtree(action.path)
+    else:
+        os.remove(action.path)
+    return target
+
+
+@contextmanager
+def retention_lock() -> Iterator[bool]:
+    """Hold the lock that keeps two retention runs from working at once.
+
+    :return: Context manager yielding whether the lock was acquired
+    """
+    acquired = cache.add(LOCK_KEY, os.getpid(), LOCK_SECONDS)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(LOCK_KEY)
+
+
+def apply_retention(limit: Optional[int] = None) -> Dict[str, object]:
+    """Archive the oldest entries the retention policies allow.
+
+    References are read again just before archiving, so an entry a project
+    started to reference after planning is kept.
+
+    :param limit: Most entries archived in this run, None for all of them
+    :return: Entries archived, bytes they took, entries left for later runs, archive paths
+        and unused blobs removed
+    """
+    actions = plan_retention()
+    batch = actions if limit is None else actions[:limit]
+    remaining = actions[len(batch):]
+    referenced = referenced_paths(Project.objects.select_related("user"))
+    archived = []
+    for action in batch:
+        if action.path in referenced or not os.path.exists(action.path):
+            continue
+        archived.append((action, archive(action)))
+    return {
+        "archived": len(archived),
+        "archived_bytes": sum(action.size_bytes for action, _ in archived),
+        "remaining": len(remaining),
+        "archives": [path for _, path in archived],
+        **collect_blobs(),
+    }
@@ -0,0 +1,218 @@
+"""Stratified row samples of large CSV files for the analysis report.
+
+``sample_csv`` makes two passes over the file. The first reads only the strata
+columns (usually the observation date and the criterion) and counts the rows of
+every stratum. The row budget is then split over the strata in proportion to
+their size and, per stratum, the ordinals of the rows to keep are drawn with a
+seeded generator. The second pass keeps exactly those rows.
+
+Proportional allocation keeps the sample self-weighting: every row has the same
+chance of being selected, so the report's figures need no reweighting, while the
+mix of periods and criterion values matches the full file exactly. Without strata
+columns the result is a simple random sample.
+"""
+
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .models import Project
+from .params import current_params
+
+Z_95 = 1.96
+
+
+@dataclass
+class Sample:
+    """Rows drawn from a file and what they represent."""
+
+    frame: pd.DataFrame
+    population_rows: int
+    strata_columns: List[str] = field(default_factory=list)
+    strata: int = 1
+
+    @property
+    def rows(self) -> int:
+        """Number of rows in the sample."""
+        return len(self.frame)
+
+    @property
+    def margin_of_error(self) -> float:
+        """Worst-case half width of a 95% confidence interval for a proportion.
+
+        Includes the finite population correction, so it is 0 when the whole file
+        was taken.
+        """
+        n, population = self.rows, self.population_rows
+        if not n or population <= 1:
+            return 0.0
+        return Z_95 * math.sqrt(0.25 / n) * math.sqrt(max(population - n, 0) / (population - 1))
+
+    def description(self) -> str:
+        """One line describing the sample, shown in the report."""
+        text = (
+            f"Sample of {self.rows:,} of {self.population_rows:,} rows; "
+            f"proportions within ±{100 * self.margin_of_error:.2f} pp at 95% confidence"
+        )
+        if self.strata_columns:
+            text += f", stratified by {', '.join(self.strata_columns)} ({self.strata} strata)"
+        return text
+
+    def as_dict(self) -> Dict[str, object]:
+        """Return the sample figures as a JSON serializable dictionary for the task result."""
+        return {
+            "rows": self.rows,
+            "population_rows": self.population_rows,
+            "strata_columns": self.strata_columns,
+            "strata": self.strata,
+            "margin_of_error": self.margin_of_error,
+        }
+
+
+def _chunk_rows(path: str, chunk_cells: int) -> int:
+    """Return how many rows of the file fit in the cell budget of one chunk."""
+    columns = len(pd.read_csv(path, nrows=0).columns) or 1
+    return max(chunk_cells // columns, 1_000)
+
+
+def _strata(chunk: pd.DataFrame, columns: Sequence[str]) -> Dict[Tuple, np.ndarray]:
+    """Return the row positions of each stratum in a chunk.
+
+    Stratum values are compared as strings so missing values form a stratum too.
+    """
+    if not columns:
+        return {(): np.arange(len(chunk))}
+    keys = chunk[list(columns)].astype(str)
+    return {
+        key if isinstance(key, tuple) else (key,): positions
+        for key, positions in keys.groupby(list(columns), sort=False).indices.items()
+    }
+
+
+def count_strata(path: str, columns: Sequence[str], chunk_cells: int = 2_000_000) -> Dict[Tuple, int]:
+    """Count the rows of every stratum, reading only the strata columns.
+
+    :param path: Path of the CSV file
+    :param columns: Strata columns, empty for a single stratum
+    :param chunk_cells: Approximate number of cells read per chunk
+    :return: Row count per stratum key
+    """
+    usecols = list(columns) or [0]
+    counts: Dict[Tuple, int] = {}
+    with pd.read_csv(path, usecols=usecols, dtype=str, chunksize=max(chunk_cells // len(usecols), 1_000)) as reader:
+        for chunk in reader:
+            for key, positions in _strata(chunk, columns).items():
+                counts[key] = counts.get(key, 0) + len(positions)
+    return counts
+
+
+def allocate(counts: Dict[Tuple, int], budget: int) -> Dict[Tuple, int]:
+    """Split a row budget over strata in proportion to their size.
+
+    Uses the largest remainder method, so the allocations add up to the budget
+    (or to the population when it is smaller than the budget).
+
+    :param counts: Row count per stratum
+    :param budget: Total number of rows to sample
+    :return: Number of rows to take from each stratum
+    """
+    population = sum(counts.values())
+    if population <= budget:
+        return dict(counts)
+    quotas = {key: budget * count / population for key, count in counts.items()}
+    allocation = {key: int(quota) for key, quota in quotas.items()}
+    remaining = budget - sum(allocation.values())
+    for key in sorted(quotas, key=lambda key: quotas[key] - allocation[key], reverse=True)[:remaining]:
+        allocation[key] += 1
+    return allocation
+
+
+def select_rows(path: str, selected: Dict[Tuple, np.ndarray], strata_columns: Sequence[str],
+                chunk_cells: int = 2_000_000) -> Iterator[pd.DataFrame]:
+    """Read a file in chunks and yield the selected rows of each chunk.
+
+    Strata columns are read as text, as in ``count_strata``, so their keys match.
+
+    :param path: Path of the CSV file
+    :param selected: Sorted ordinals, within its stratum, of the rows to keep from each stratum
+    :param strata_columns: Columns whose value combinations form the strata
+    :param chunk_cells: Approximate number of cells read per chunk, bounds memory use
+    :return: Iterator over the kept rows of every chunk that has any
+    """
+    seen: Dict[Tuple, int] = {}
+    dtype = {column: str for column in strata_columns}
+    with pd.read_csv(path, chunksize=_chunk_rows(path, chunk_cells), dtype=dtype) as reader:
+        for chunk in reader:
+            keep = []
+            for key, positions in _strata(chunk, strata_columns).items():
+                ordinals = seen.get(key, 0) + np.arange(len(positions))
+                seen[key] = seen.get(key, 0) + len(positions)
+                chosen = selected.get(key)
+                if chosen is None or not len(chosen):
+                    continue
+                hits = np.searchsorted(chosen, ordinals)
+                mask = (hits < len(chosen)) & (chosen[np.minimum(hits, len(chosen) - 1)] == ordinals)
+                keep.append(positions[mask])
+            rows = np.sort(np.concatenate(keep)) if keep else np.empty(0, dtype=np.int64)
+            if len(rows):
+                yield chunk.iloc[rows]
+
+
+def sample_csv(path: str, budget: int, strata_columns: Sequence[str] = (), seed: int = 0,
+               chunk_cells: int = 2_000_000) -> Sample:
+    """Draw a proportionally stratified random sample of at most ``budget`` rows.
+
+    :param path: Path of the CSV file
+    :param budget: Maximum number of rows in the sample
+    :param strata_columns: Columns whose value combinations form the strata
+    :param seed: Seed of the row selection, the same seed gives the same sample
+    :param chunk_cells: Approximate number of cells read per chunk, bounds memory use
+    :return: The sample
+    """
+    strata_columns = list(strata_columns)
+    counts = count_strata(path, strata_columns, chunk_cells)
+    allocation = allocate(counts, budget)
+
+    rng = np.random.default_rng(seed)
+    selected = {
+        key: np.sort(rng.choice(counts[key], size=allocation[key], replace=False))
+        for key in sorted(counts, key=str)
+    }
+    parts = list(select_rows(path, selected, strata_columns, chunk_cells))
+
+    frame = pd.concat(parts, ignore_index=True) if parts else pd.read_csv(path, nrows=0)
+    # The strata columns were read as text to match the counting pass
+    for column in strata_columns:
+        try:
+            frame[column] = pd.to_numeric(frame[column])
+        except (ValueError, TypeError):
+            pass
+    return Sample(
+        frame=frame,
+        population_rows=sum(counts.values()),
+        strata_columns=strata_columns,
+        strata=len(counts),
+    )
+
+
+def report_strata_columns(project: Project) -> List[str]:
+    """Return the columns a sampled report is stratified by.
+
+    These are the observation date and criterion columns from the project's
+    parameters, when they have been saved and exist in the input file.
+
+    :param project: The project
+    :return: Column names, empty if the parameters are not set
+    """
+    params = current_params(project)
+    if not params:
+        return []
+    try:
+        header = pd.read_csv(project.input_dataframe.path, nrows=0).columns
+    except (OSError, ValueError):
+        return []
+    columns = [params.get("observation_date_column"), params.get("criterion_column")]
+    return [column for column in dict.fromkeys(columns) if column and column in header]
@@ -0,0 +1,148 @@
+"""Celery signal handlers keeping ``ProjectRun`` rows up to date.
+
+A run is created when its task is published, pinned to the latest version of
+the project's parameters, marked started when a worker picks it up and finished
+with its outcome when the task returns. Pages read run
+state from these rows, never from the broker or the result backend.
+
+Saving or deleting a project also counts again the references to its input
+blob, see ``projects.blobs``.
+"""
+
+import logging
+from datetime import datetime, timezone as dt_timezone
+from typing import Any, Optional, Sequence
+
+from celery import states
+from celery.signals import after_task_publish, task_postrun, task_prerun
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .blobs import update_refcount
+from .models import Project, ProjectRun
+from .params import latest_parameter_set
+
+logger = logging.getLogger(__name__)
+
+TASK_STAGES = {
+    "projects.tasks.data_preparation": ProjectRun.STAGE_PREP,
+    "projects.tasks.train_and_evaluate": ProjectRun.STAGE_TRAIN_EVAL,
+    "projects.tasks.generate_sweetviz_report": ProjectRun.STAGE_REPORT,
+    "projects.tasks.update_period_cube": ProjectRun.STAGE_CUBE,
+    "projects.tasks.compute_optimal_bins": ProjectRun.STAGE_BINNING,
+}
+
+
+def project_for(args: Sequence[Any]) -> Optional[Project]:
+    """Find the project a task runs on from its positional arguments.
+
+    Tasks take either ``(username, project_name, ...)`` or one
+    ``"<username>_<project_name>"`` argument.
+
+    :param args: Positional arguments of the task
+    :return: The project, None if it does not exist
+    """
+    if len(args) >= 2 and isinstance(args[1], str):
+        username, name = args[0], args[1]
+    elif args and isinstance(args[0], str) and "_" in args[0]:
+        username, name = args[0].split("_", 1)
+    else:
+        return None
+    return Project.objects.filter(user__username=username, name=name).first()
+
+
+def start_run(task_name: str, task_id: str, args: Sequence[Any], **fields) -> Optional[ProjectRun]:
+    """Return the run of a task, creating it when it is not recorded yet.
+
+    :param task_name: Registered name of the task
+    :param task_id: Task id
+    :param args: Positional arguments of the task
+    :param fields: Fields of a new run
+    :return: The run, None for tasks not run on a project
+    """
+    stage = TASK_STAGES.get(task_name)
+    if stage is None or not task_id:
+        return None
+    run = ProjectRun.objects.filter(task_id=task_id).first()
+    if run is None:
+        project = project_for(args)
+        if project is None:
+            return None
+        run, _ = ProjectRun.objects.get_or_create(task_id=task_id, defaults={
+            "project": project, "stage": stage, "parameter_set": latest_parameter_set(project), **fields,
+        })
+    return run
+
+
+@after_task_publish.connect
+def record_run_queued(sender: str = None, headers: dict = None, body=None, **kwargs) -> None:
+    """Record a run when its task is sent to the broker."""
+    headers = headers or {}
+    args = body[0] if isinstance(body, (list, tuple)) and body else ()
+    enqueued_at = headers.get("enqueued_at")
+    queued_at = datetime.fromtimestamp(enqueued_at, dt_timezone.utc) if enqueued_at else timezone.now()
+    try:
+        start_run(sender, headers.get("id"), args, status=ProjectRun.STATUS_QUEUED, queued_at=queued_at)
+    except Exception:
+        # Never fail the request that sent the task
+        logger.exception(f"Could not record queued run of {sender}")
+
+
+@task_prerun.connect
+def record_run_started(task_id: str = None, task=None, args=None, **kwargs) -> None:
+    """Mark a run as started."""
+    run = start_run(task.name, task_id, args or ())
+    if run is None:
+        return
+    run.status = ProjectRun.STATUS_STARTED
+    run.started_at = timezone.now()
+    run.save(update_fields=["status", "started_at"])
+
+
+@task_postrun.connect
+def record_run_finished(task_id: str = None, task=None, retval=None, state: str = None, **kwargs) -> None:
+    """Record the outcome of a run.
+
+    Tasks catch their own errors and, once out of retries, return a result whose
+    ``status`` is ``failure``, so the returned value decides as well as the state.
+    Tasks report gizmo's exit status without judging it, so a non-zero return
+    code also makes the run a failure.
+    """
+    if task.name not in TASK_STAGES:
+        return
+    run = ProjectRun.objects.filter(task_id=task_id).first()
+    if run is None:
+        return
+    if state == states.RETRY:
+        run.status = ProjectRun.STATUS_RETRYING
+        run.save(update_fields=["status"])
+        return
+
+    result = retval if isinstance(retval, dict) else {}
+    codes = [value for key, value in result.items() if key.endswith("return_code") and isinstance(value, int)]
+    # A stage killed by a signal has a negative code, so the largest one could be a success
+    run.return_code = next((code for code in codes if code != 0), 0) if codes else None
+    failed = state != states.SUCCESS or result.get("status") == "failure" or bool(run.return_code)
+    run.status = ProjectRun.STATUS_FAILURE if failed else ProjectRun.STATUS_SUCCESS
+    run.finished_at = timezone.now()
+    if run.started_at:
+        run.duration_seconds = (run.finished_at - run.started_at).total_seconds()
+    run.output_path = str(result.get("output_path") or result.get("report_path") or "")[:255]
+    if isinstance(retval, BaseException):
+        run.error = str(retval)
+    elif result.get("error"):
+        run.error = str(result["error"])
+    elif run.return_code:
+        run.error = f"gizmo exited with code {run.return_code}"
+    run.save(update_fields=[
+        "status", "finished_at", "duration_seconds", "return_code", "output_path", "error",
+    ])
+
+
+@receiver([post_save, post_delete], sender=Project)
+def count_input_references(sender, instance: Project, update_fields=None, **kwargs) -> None:
+    """Count again the references to the input blob of a saved or deleted project."""
+    if not instance.input_digest or (update_fields is not None and "input_digest" not in update_fields):
+        return
+    update_refcount(instance.input_digest)
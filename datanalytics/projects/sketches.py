@@ -0,0 +1,158 @@
+"""Fixed-size summaries of a column that are updated one chunk at a time.
+
+Each sketch keeps a bounded amount of state no matter how many rows it sees, so
+a file is profiled in memory proportional to the chunk size rather than the
+file size. Updates take whole numpy arrays or value counts of a chunk and stay
+vectorized.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    """KLL quantile sketch over floats.
+
+    Items live in levels of compactors; an item on level h stands for 2**h
+    original values. When a level grows past its capacity it is sorted and every
+    other item, starting at a random offset, is promoted to the next level. The
+    rank error is about ``1.7 / k`` of the number of values seen.
+    """
+
+    def __init__(self, k: int = 400, seed: Optional[int] = None) -> None:
+        """Initialize an empty sketch.
+
+        :param k: Capacity of the top level, larger values are more accurate
+        :param seed: Seed for the compaction offsets
+        """
+        self.k = k
+        self.count = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        """Return the capacity of a level, shrinking geometrically below the top."""
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 8)
+
+    def update(self, values: np.ndarray) -> None:
+        """Add an array of values; NaN values are ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                even = len(items) - len(items) % 2
+                promoted = items[self._rng.integers(2):even:2]
+                self.levels[level] = items[even:]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def _weighted(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return all retained items sorted, with the number of values each stands for."""
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        return items[order], weights[order]
+
+    def quantiles(self, probabilities: Sequence[float]) -> List[float]:
+        """Return the estimated value at each probability.
+
+        :param probabilities: Probabilities between 0 and 1
+        :return: One estimate per probability, NaN if the sketch is empty
+        """
+        if not self.count:
+            return [float("nan")] * len(probabilities)
+        items, weights = self._weighted()
+        cumulative = np.cumsum(weights)
+        ranks = np.asarray(probabilities, dtype=np.float64) * cumulative[-1]
+        positions = np.clip(np.searchsorted(cumulative, ranks, side="left"), 0, len(items) - 1)
+        return [float(items[position]) for position in positions]
+
+    def histogram(self, edges: np.ndarray) -> np.ndarray:
+        """Return the estimated number of values between consecutive edges."""
+        if not self.count:
+            return np.zeros(len(edges) - 1)
+        items, weights = self._weighted()
+        counts, _ = np.histogram(items, bins=edges, weights=weights)
+        return counts
+
+
+class DistinctSketch:
+    """K-minimum-values estimate of the number of distinct values.
+
+    Values are hashed to 64 bits and the ``k`` smallest distinct hashes are kept.
+    The count is exact below ``k`` distinct values; above it the relative error is
+    about ``1 / sqrt(k)``.
+    """
+
+    def __init__(self, k: int = 4096) -> None:
+        """Initialize an empty sketch.
+
+        :param k: Number of hashes kept
+        """
+        self.k = k
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def update(self, values: np.ndarray) -> None:
+        """Add an array of non-missing values."""
+        if not len(values):
+            return
+        hashes = pd.util.hash_array(np.asarray(values))
+        self.hashes = np.unique(np.concatenate([self.hashes, hashes]))[:self.k]
+
+    @property
+    def exact(self) -> bool:
+        """Whether the estimate is an exact count."""
+        return len(self.hashes) < self.k
+
+    def estimate(self) -> int:
+        """Return the estimated number of distinct values."""
+        if self.exact:
+            return len(self.hashes)
+        return int(round((self.k - 1) / (float(self.hashes[-1]) / 2.0 ** 64)))
+
+
+class FrequentItems:
+    """Misra-Gries summary of the most frequent values.
+
+    At most ``capacity`` counters are kept. When a merge overflows them, the
+    smallest surviving count is subtracted from all counters, so reported counts
+    are lower bounds that are at most ``error`` below the true count.
+    """
+
+    def __init__(self, capacity: int = 256) -> None:
+        """Initialize an empty summary.
+
+        :param capacity: Number of counters kept
+        """
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.float64)
+        self.error = 0.0
+
+    def update(self, counts: pd.Series) -> None:
+        """Merge the value counts of a chunk."""
+        if not len(counts):
+            return
+        merged = pd.concat([self.counts, counts.astype(np.float64)]) if len(self.counts) else counts.astype(np.float64)
+        if merged.index.has_duplicates:
+            merged = merged.groupby(level=0, sort=False).sum()
+        if len(merged) > self.capacity:
+            threshold = merged.nlargest(self.capacity + 1).iloc[-1]
+            merged = merged[merged > threshold] - threshold
+            self.error += threshold
+        self.counts = merged
+
+    def top(self, n: int) -> List[Tuple[object, int]]:
+        """Return up to n (value, count) pairs, most frequent first."""
+        return [(value, int(count)) for value, count in self.counts.nlargest(n).items()]
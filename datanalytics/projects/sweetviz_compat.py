@@ -0,0 +1,56 @@
+"""Loading Sweetviz, with the numpy and pandas shims it needs.
+
+Sweetviz pulls in matplotlib and scipy and takes about a second to import, and
+the Sweetviz release in use still calls numpy and pandas APIs that have since
+been removed. Both costs are paid on the first report only: ``load_sweetviz``
+puts the removed names back and imports Sweetviz, and nothing else in the
+projects app imports it. Web processes and workers that never build a Sweetviz
+report never load it.
+"""
+
+import logging
+import warnings
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def apply_compatibility_fixes() -> None:
+    """Restore the numpy and pandas names Sweetviz still uses."""
+    if not hasattr(pd.DataFrame, "iteritems"):
+        pd.DataFrame.iteritems = pd.DataFrame.items
+    if not hasattr(np, "warnings"):
+        np.warnings = warnings
+    for name, value in (("bool", bool), ("int", int), ("float", float), ("complex", complex)):
+        if not hasattr(np, name):
+            setattr(np, name, value)
+
+    # Suppress warnings that cause issues
+    warnings.filterwarnings("ignore", category=np.VisibleDeprecationWarning)
+    warnings.filterwarnings("ignore", category=FutureWarning, module="sweetviz")
+
+
+@lru_cache(maxsize=None)
+def load_sweetviz():
+    """Apply the compatibility fixes and import Sweetviz, once per process.
+
+    :return: The ``sweetviz`` module
+    """
+    apply_compatibility_fixes()
+    import sweetviz
+
+    logger.info("Applied numpy/pandas compatibility fixes for Sweetviz")
+    return sweetviz
+
+
+def sweetviz_compatible_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Rebuild a DataFrame column by column so older Sweetviz versions accept it.
+
+    :param df: DataFrame read from the project's input CSV
+    :return: Equivalent DataFrame built from a dict of its columns
+    """
+    df_dict = {col: df[col] for col in df.columns}
+    return pd.DataFrame(df_dict)
@@ -0,0 +1,67 @@
+"""Synthetic datasets shaped like the analysts' monthly extracts.
+
+Used by the load test and benchmark management commands. The data is fully
+determined by the seed, so runs on different machines see the same input.
+"""
+
+import io
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+PERIODS = list(pd.date_range("2023-01-01", periods=12, freq="MS").strftime("%m/%d/%Y"))
+FIXED_COLUMNS = ["customer_id", "observation_date", "default_flag", "early_default_flag", "segment"]
+
+
+def generate_chunk(rng: np.random.Generator, start: int, rows: int, features: int) -> pd.DataFrame:
+    """Generate one block of synthetic rows.
+
+    :param rng: Random generator to draw from
+    :param start: Identifier of the first row in the block
+    :param rows: Number of rows in the block
+    :param features: Number of numeric feature columns
+    :return: DataFrame with the fixed columns followed by the feature columns
+    """
+    data = {
+        "customer_id": np.arange(start, start + rows),
+        "observation_date": rng.choice(PERIODS, rows),
+        "default_flag": rng.binomial(1, 0.08, rows),
+        "early_default_flag": rng.binomial(1, 0.03, rows),
+        "segment": rng.choice(["retail", "sme", "corporate"], rows),
+    }
+    for i in range(features):
+        column = rng.normal(100, 25, rows)
+        column[rng.random(rows) < 0.05] = np.nan
+        data[f"feature_{i}"] = column
+    return pd.DataFrame(data)
+
+
+def write_dataset(path: str, rows: int, columns: int, seed: int = 42, chunk_rows: int = 100_000) -> None:
+    """Write a synthetic CSV to disk block by block.
+
+    :param path: Destination file
+    :param rows: Number of rows
+    :param columns: Total number of columns, at least the fixed ones
+    :param seed: Random seed
+    :param chunk_rows: Rows generated and written per block
+    """
+    rng = np.random.default_rng(seed)
+    features = max(columns - len(FIXED_COLUMNS), 0)
+    with open(path, "w", newline="") as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = generate_chunk(rng, start, min(chunk_rows, rows - start), features)
+            chunk.to_csv(f, index=False, header=start == 0)
+
+
+def build_dataset(rows: int, features: int, seed: int) -> Tuple[bytes, List[str]]:
+    """Build a small synthetic CSV in memory.
+
+    :param rows: Number of rows
+    :param features: Number of numeric feature columns
+    :param seed: Random seed
+    :return: Tuple of (CSV bytes, sorted observation dates in MM/DD/YYYY format)
+    """
+    buffer = io.StringIO()
+    generate_chunk(np.random.default_rng(seed), 0, rows, features).to_csv(buffer, index=False)
+    return buffer.getvalue().encode("utf-8"), list(PERIODS)
@@ -3,63 +3,55 @@
 from celery import shared_task
 import os
 import subprocess
+import time
+from dataclasses import asdict
 from datetime import datetime
 from celery.utils.log import get_task_logger
 from typing import Dict, Any, Tuple
-import pandas as pd
 from django.conf import settings
-from .models import Project
-import sweetviz
-from django.core.files import File
-import numpy as np
-import warnings
-
-# Fix pandas compatibility with Sweetviz
-if not hasattr(pd.DataFrame, 'iteritems'):
-    pd.DataFrame.iteritems = pd.DataFrame.items
-
-# Fix numpy compatibility with Sweetviz  
-if not hasattr(np, 'warnings'):
-    np.warnings = warnings
-
-# Additional numpy compatibility fixes
-if not hasattr(np, 'bool'):
-    np.bool = bool
-if not hasattr(np, 'int'):
-    np.int = int
-if not hasattr(np, 'float'):
-    np.float = float
-if not hasattr(np, 'complex'):
-    np.complex = complex
-
-# Suppress warnings that cause issues
-warnings.filterwarnings('ignore', category=np.VisibleDeprecationWarning)
-warnings.filterwarnings('ignore', category=FutureWarning, module='sweetviz')
-
-print("Applied numpy/pandas compatibility fixes for Sweetviz")
+from .models import Project, ResourceUsage
+from .params import materialize, run_parameter_set
+from .report_cache import (
+    cache_name, cache_path, collect_garbage, discard_report, input_digest, lookup, project_report_key, publish_report
+)
+from .retention import apply_retention, retention_lock
+from monitoring.metrics import GIZMO_STAGE_DURATION
+from monitoring.resources import RusagePopen, TaskResources, child_usage, record_stage, track
+from monitoring.tracing import span, subprocess_env
 
 logger = get_task_logger(__name__)
 
-def run_command(command: str, working_dir: str) -> Tuple[str, str, int]:
+def run_command(command: str, working_dir: str, stage: str) -> Tuple[str, str, int]:
     """Execute a shell command and return stdout, stderr, and return code.
     
     :param command: Shell command to execute
     :param working_dir: Working directory for the command
+    :param stage: Gizmo stage the command runs, used to label its duration metric
     :return: Tuple of (stdout, stderr, return_code)
     """
     logger.info(f"Executing command: {command} in directory: {working_dir}")
+    start = time.monotonic()
     
-    process = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        shell=True,
-        universal_newlines=True,
-        env=os.environ.copy(),
-        cwd=working_dir
+    with span(f"gizmo.{stage}", stage=stage) as context:
+        process = RusagePopen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            universal_newlines=True,
+            env={**os.environ, **subprocess_env(context)},
+            cwd=working_dir
+        )
+        
+        stdout, stderr = process.communicate()
+    elapsed = time.monotonic() - start
+    GIZMO_STAGE_DURATION.observe(
+        elapsed,
+        stage=stage,
+        outcome="success" if process.returncode == 0 else "error",
     )
-    
-    stdout, stderr = process.communicate()
+    if process.rusage is not None:
+        record_stage(stage, child_usage(process.rusage, elapsed))
     
     if process.returncode != 0:
         logger.error(f"Command failed with return code {process.returncode}")
@@ -67,6 +59,39 @@ def run_command(command: str, working_dir: str) -> Tuple[str, str, int]:
     
     return stdout, stderr, process.returncode
 
+def save_resource_usage(project: Project, task, resources: TaskResources) -> None:
+    """Store the resource usage of a task run and its gizmo stages in the project's run history.
+
+    :param project: Project the task ran for
+    :param task: The bound Celery task
+    :param resources: Measurements collected by ``monitoring.resources.track``
+    """
+    rows = [
+        ResourceUsage(stage=stage, **asdict(usage))
+        for stage, usage in resources.stages
+    ]
+    if resources.usage is not None:
+        rows.append(ResourceUsage(top_allocations=resources.top_allocations or None, **asdict(resources.usage)))
+    for row in rows:
+        row.project = project
+        row.task_name = task.name
+        row.task_id = task.request.id or ""
+    with span("db_save"):
+        ResourceUsage.objects.bulk_create(rows)
+
+def gizmo_executable() -> str:
+    """Return the command prefix that starts gizmo's main script.
+
+    Gizmo normally runs inside its own conda environment. Setting ``GIZMO_PYTHON``
+    runs it with that interpreter instead, which is what the load tests use.
+
+    :return: Command prefix ready to be followed by gizmo arguments
+    """
+    main_script = os.path.join(settings.GIZMO_DIR, "main.py")
+    if settings.GIZMO_PYTHON:
+        return f"{settings.GIZMO_PYTHON} {main_script}"
+    return f"conda run -n {settings.GIZMO_CONDA_ENV} python {main_script}"
+
 def get_latest_session_id(train_or_eval: str, project_name: str, working_dir: str) -> str:
     """Get the latest session ID for a given project and task type.
     
@@ -100,40 +125,63 @@ def data_preparation(self, project_name: str) -> Dict[str, Any]:
     :param project_name: Name of the project
     :return: Dictionary with task result details
     """
+    # Modules built on pandas are imported by the tasks using them, the views import this one to start tasks
+    from .prep import prepare_project
     try:
         # Get the project by parsing the project name
         username, proj_name = project_name.split("_", 1)
         project = Project.objects.get(name=proj_name, user__username=username)
         
-        env = "gizmo"
-        working_dir = os.path.join(os.getcwd(), "gizmo")
+        working_dir = settings.MEDIA_ROOT
         
         logger.info(f"Starting data preparation for project: {project_name}")
         
-        command = f"conda run -n {env} python main.py --project {project_name} --data_prep_module standard"
-        stdout, stderr, return_code = run_command(command, working_dir)
-        
-        logger.info(f"Data prep command completed with return code: {return_code}")
-        
-        # Construct and save output path
         output_path = os.path.abspath(os.path.join(
             settings.MEDIA_ROOT, 
             "output_data", 
             project_name
         ))
         
+        parameter_set = run_parameter_set(project, self.request.id)
+        if parameter_set is not None:
+            materialize(project, parameter_set)
+        
+        command = f"{gizmo_executable()} --project {project_name} --data_prep_module standard"
+        with track() as resources:
+            # Streaming stages run first so gizmo and later stages read the prepared rows
+            with span("prep.stream"):
+                preparation = prepare_project(project, output_path, parameter_set.params if parameter_set else None)
+            sample, treatment = preparation.sample, preparation.treatment
+            if sample is not None:
+                logger.info(f"Under-sampled {sample.population_rows} rows to {sample.rows}")
+            if treatment is not None:
+                logger.info(f"Treated missing values with {treatment.method}, {treatment.rows} rows written")
+            stdout, stderr, return_code = run_command(command, working_dir, "data_prep")
+        
+        logger.info(f"Data prep command completed with return code: {return_code}")
+        
         # Update project with prep output path
         project.prep_output = output_path
-        project.save()
+        with span("db_save"):
+            project.save()
+        save_resource_usage(project, self, resources)
         
         return {
             "status": "success",
             "project_name": project_name,
             "data_prep_module": "standard",
+            "under_sampling": {
+                "ratio": sample.ratio,
+                "population_rows": sample.population_rows,
+                "rows": sample.rows,
+            } if sample is not None else None,
+            "missing_treatment": treatment.as_dict() if treatment is not None else None,
+            "parameters_version": parameter_set.version if parameter_set else None,
             "return_code": return_code,
             "stdout": stdout,
             "stderr": stderr,
             "output_path": output_path,
+            "resources": resources.as_dict(),
             "timestamp": datetime.now().isoformat()
         }
         
@@ -160,21 +208,25 @@ def train_and_evaluate(self, project_name: str) -> Dict[str, Any]:
         username, proj_name = project_name.split("_", 1)
         project = Project.objects.get(name=proj_name, user__username=username)
         
-        env = "gizmo"
-        working_dir = os.path.join(os.getcwd(), "gizmo")
+        working_dir = settings.MEDIA_ROOT
         
         logger.info(f"Starting train and evaluate for project: {project_name}")
         
-        # Run training
-        train_command = f"conda run -n {env} python main.py --project {project_name} --train_module standard"
-        train_stdout, train_stderr, train_return_code = run_command(train_command, working_dir)
+        parameter_set = run_parameter_set(project, self.request.id)
+        if parameter_set is not None:
+            materialize(project, parameter_set)
         
-        logger.info(f"Train command completed with return code: {train_return_code}")
-        
-        # Get training session and run evaluation
-        session_id = get_latest_session_id("TRAIN", project_name, working_dir)
-        eval_command = f'conda run -n {env} python main.py --project {project_name} --eval_module standard --session "{session_id}"'
-        eval_stdout, eval_stderr, eval_return_code = run_command(eval_command, working_dir)
+        with track() as resources:
+            # Run training
+            train_command = f"{gizmo_executable()} --project {project_name} --train_module standard"
+            train_stdout, train_stderr, train_return_code = run_command(train_command, working_dir, "train")
+            
+            logger.info(f"Train command completed with return code: {train_return_code}")
+            
+            # Get training session and run evaluation
+            session_id = get_latest_session_id("TRAIN", project_name, working_dir)
+            eval_command = f'{gizmo_executable()} --project {project_name} --eval_module standard --session "{session_id}"'
+            eval_stdout, eval_stderr, eval_return_code = run_command(eval_command, working_dir, "eval")
         
         logger.info(f"Eval command completed with return code: {eval_return_code}")
         
@@ -184,11 +236,14 @@ def train_and_evaluate(self, project_name: str) -> Dict[str, Any]:
         
         # Update project with train/eval output path
         project.train_eval_output = output_path
-        project.save()
+        with span("db_save"):
+            project.save()
+        save_resource_usage(project, self, resources)
         
         return {
             "status": "success",
             "project_name": project_name,
+            "parameters_version": parameter_set.version if parameter_set else None,
             "train_return_code": train_return_code,
             "train_stdout": train_stdout,
             "train_stderr": train_stderr,
@@ -196,6 +251,7 @@ def train_and_evaluate(self, project_name: str) -> Dict[str, Any]:
             "eval_stdout": eval_stdout,
             "eval_stderr": eval_stderr,
             "output_path": output_path,
+            "resources": resources.as_dict(),
             "timestamp": datetime.now().isoformat()
         }
         
@@ -211,57 +267,222 @@ def train_and_evaluate(self, project_name: str) -> Dict[str, Any]:
         }
 
 @shared_task(bind=True, max_retries=3)
-def generate_sweetviz_report(self, username: str, project_name: str) -> Dict[str, Any]:
-    """
-    Generate Sweetviz report for data analysis.
-    
+def update_period_cube(self, username: str, project_name: str) -> Dict[str, Any]:
+    """Build the per-period aggregate cube of a project, or extend it with appended rows.
+
     :param username: Username of the user
     :param project_name: Name of the project
     :return: Dictionary with task result details
     """
+    from .cube import update_project_cube
     try:
-        # Get the project
-        project = Project.objects.get(name=project_name)
+        project = Project.objects.get(name=project_name, user__username=username)
         
-        # Read the CSV
-        logger.info(f"Reading CSV from {project.input_dataframe}")
-        df = pd.read_csv(project.input_dataframe)
+        with track() as resources:
+            with span("cube.update"):
+                summary = update_project_cube(project)
+        logger.info(f"Cube of {project_name}: {summary['rows']} rows in {summary['periods']} periods"
+                    f"{' (incremental)' if summary['incremental'] else ''}")
+        save_resource_usage(project, self, resources)
         
-        # Convert DataFrame items to make compatible with older Sweetviz
-        df_dict = {col: df[col] for col in df.columns}
-        df_compat = pd.DataFrame(df_dict)
+        return {
+            "status": "success",
+            "project_name": project_name,
+            "cube": summary,
+            "resources": resources.as_dict(),
+            "timestamp": datetime.now().isoformat()
+        }
         
-        # Generate Sweetviz report
-        logger.info("Generating Sweetviz report...")
-        my_report = sweetviz.analyze(
-            source=df_compat,
-            pairwise_analysis="off"
-        )
+    except Project.DoesNotExist:
+        logger.error(f"Project not found: {project_name}")
+        return {
+            "status": "failure",
+            "error": f"Project not found: {project_name}",
+            "project_name": project_name,
+            "timestamp": datetime.now().isoformat()
+        }
+    except ValueError as e:
+        # Missing parameters will not appear by retrying
+        logger.error(f"Cannot build the cube of {project_name}: {e}")
+        return {
+            "status": "failure",
+            "error": str(e),
+            "project_name": project_name,
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.exception(f"Error building the cube for project {project_name}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=5)
+        return {
+            "status": "failure",
+            "error": str(e),
+            "project_name": project_name,
+            "timestamp": datetime.now().isoformat()
+        }
+
+@shared_task(bind=True, max_retries=3)
+def compute_optimal_bins(self, username: str, project_name: str) -> Dict[str, Any]:
+    """Bin the project's optimal binning columns that are not cached yet.
+
+    :param username: Username of the user
+    :param project_name: Name of the project
+    :return: Dictionary with task result details
+    """
+    from .binning import bin_columns, binning_params, cached_bins, store_bins
+    try:
+        project = Project.objects.get(name=project_name, user__username=username)
+        criterion, columns = binning_params(project)
+        if not criterion:
+            raise ValueError("The project parameters must be saved before binning")
         
-        # Create reports directory
-        report_dir = os.path.join(settings.MEDIA_ROOT, "reports", username)
-        os.makedirs(report_dir, exist_ok=True)
+        with track() as resources:
+            digest = input_digest(project)
+            missing = [column for column in columns if column not in cached_bins(digest, columns, criterion)]
+            logger.info(f"Binning {len(missing)} of {len(columns)} columns of {project_name}")
+            with span("binning.compute", columns=len(missing)):
+                results = bin_columns(project.input_dataframe.path, missing, criterion,
+                                      settings.BINNING_WORKERS, settings.REPORT_SCRATCH_DIR)
+            store_bins(digest, criterion, results)
+        save_resource_usage(project, self, resources)
         
-        # Save report
-        report_filename = f"{username}_{project_name}.html"
-        report_path = os.path.join(report_dir, report_filename)
-        logger.info(f"Saving report to {report_path}")
+        return {
+            "status": "success",
+            "project_name": project_name,
+            "computed": len(missing),
+            "cached": len(columns) - len(missing),
+            "resources": resources.as_dict(),
+            "timestamp": datetime.now().isoformat()
+        }
         
-        my_report.show_html(
-            filepath=report_path,
-            open_browser=False
-        )
+    except Project.DoesNotExist:
+        logger.error(f"Project not found: {project_name}")
+        return {
+            "status": "failure",
+            "error": f"Project not found: {project_name}",
+            "project_name": project_name,
+            "timestamp": datetime.now().isoformat()
+        }
+    except ValueError as e:
+        # Bad parameters will not be fixed by retrying
+        logger.error(f"Cannot bin the columns of {project_name}: {e}")
+        return {
+            "status": "failure",
+            "error": str(e),
+            "project_name": project_name,
+            "timestamp": datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.exception(f"Error binning columns for project {project_name}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=5)
+        return {
+            "status": "failure",
+            "error": str(e),
+            "project_name": project_name,
+            "timestamp": datetime.now().isoformat()
+        }
+
+@shared_task(bind=True, max_retries=3)
+def generate_sweetviz_report(self, username: str, project_name: str, sample_rows: int = 0) -> Dict[str, Any]:
+    """
+    Generate the data analysis report with the project's report backend.
+    
+    :param username: Username of the user
+    :param project_name: Name of the project
+    :param sample_rows: Row budget of a stratified sample to report on, 0 reports on the full file
+    :return: Dictionary with task result details
+    """
+    try:
+        # Get the project
+        project = Project.objects.get(name=project_name, user__username=username)
         
-        # Update project with report
-        with open(report_path, "rb") as f:
-            django_file = File(f, name=report_filename)
-            project.sweetviz_report = django_file
-            project.save()
+        with track(top_allocations=settings.TASK_TRACEMALLOC_TOP) as resources:
+            # Look the report up by input content, options and engine version
+            with span("report.cache_lookup"):
+                key = project_report_key(project, sample_rows)
+                cached_name = lookup(key)
+            report_path = cache_path(key)
+            
+            sample = None
+            if cached_name:
+                logger.info(f"Reusing cached report {cached_name}")
+            else:
+                import pandas as pd
+                from .columnar import profile_input
+                from .profiling import profile_chunks, render_profile
+                from .sampling import report_strata_columns, sample_csv
+                from .sweetviz_compat import load_sweetviz, sweetviz_compatible_frame
+                os.makedirs(os.path.dirname(report_path), exist_ok=True)
+                tmp_path = f"{report_path[:-len('.html')]}.{self.request.id or os.getpid()}.tmp.html"
+                
+                try:
+                    if sample_rows:
+                        strata_columns = report_strata_columns(project)
+                        logger.info(f"Sampling {sample_rows} rows stratified by {strata_columns or 'nothing'}")
+                        with span("report.sample", budget=sample_rows):
+                            # Seeding from the content makes the sample, like the report, a function of the input
+                            sample = sample_csv(project.input_dataframe.path, sample_rows, strata_columns,
+                                                seed=int(project.input_digest[:8], 16))
+                        logger.info(sample.description())
+                
+                    if project.report_backend == Project.REPORT_NATIVE:
+                        # Profile the file with the built-in engine, wide files column by column on a pool
+                        logger.info(f"Profiling {project.input_dataframe} with the built-in engine...")
+                        with span("report.profile"):
+                            if sample is not None:
+                                profile = profile_chunks([sample.frame], source=f"{project_name} input data")
+                                profile.note = sample.description()
+                            else:
+                                profile = profile_input(project.input_dataframe.path, source=f"{project_name} input data")
+                        with open(tmp_path, "w", encoding="utf-8") as f:
+                            f.write(render_profile(profile, title=f"{project_name} data profile"))
+                    else:
+                        # Read the CSV
+                        if sample is not None:
+                            df = sample.frame
+                        else:
+                            logger.info(f"Reading CSV from {project.input_dataframe}")
+                            df = pd.read_csv(project.input_dataframe)
+                    
+                        # Convert DataFrame items to make compatible with older Sweetviz
+                        df_compat = sweetviz_compatible_frame(df)
+                    
+                        # Generate Sweetviz report
+                        logger.info("Generating Sweetviz report...")
+                        with span("report.analyze", rows=len(df_compat), columns=len(df_compat.columns)):
+                            my_report = load_sweetviz().analyze(
+                                source=(df_compat, sample.description()) if sample is not None else df_compat,
+                                pairwise_analysis="off"
+                            )
+                        my_report.show_html(
+                            filepath=tmp_path,
+                            open_browser=False
+                        )
+                
+                    # Compress the finished report and publish it under its key
+                    logger.info(f"Saving report to {report_path}")
+                    with span("report.compress"):
+                        publish_report(tmp_path, report_path)
+                finally:
+                    # Whatever a failed attempt wrote is removed, published files have been moved away
+                    discard_report(tmp_path)
+        
+        # Point the project at the single stored copy
+        project.sweetviz_report.name = cache_name(key)
+        with span("db_save"):
+            project.save(update_fields=["sweetviz_report"])
+        if not cached_name:
+            collect_garbage(settings.REPORT_CACHE_QUOTA_BYTES)
+        save_resource_usage(project, self, resources)
         
         return {
             "status": "success",
             "project_name": project_name,
             "report_path": report_path,
+            "cached": bool(cached_name),
+            "sample": sample.as_dict() if sample is not None else None,
+            "resources": resources.as_dict(),
             "timestamp": datetime.now().isoformat()
         }
         
@@ -288,3 +509,21 @@ def generate_sweetviz_report(self, username: str, project_name: str) -> Dict[str
             "project_name": project_name,
             "timestamp": datetime.now().isoformat()
         }
+
+@shared_task
+def enforce_retention() -> Dict[str, Any]:
+    """Archive old sessions and the files of deleted projects, a batch per run, and remove unused input blobs.
+
+    Scheduled by ``CELERY_BEAT_SCHEDULE``; see ``projects.retention``.
+
+    :return: Dictionary with what was archived and what is left for later runs
+    """
+    with retention_lock() as acquired:
+        if not acquired:
+            logger.info("Retention is already running, skipping this run")
+            return {"status": "skipped", "timestamp": datetime.now().isoformat()}
+        with span("retention"):
+            result = apply_retention(settings.RETENTION_BATCH_SIZE)
+    logger.info(f"Archived {result['archived']} entries ({result['archived_bytes']} bytes), "
+                f"{result['remaining']} left for later runs, removed {result['blobs_removed']} unused input blobs")
+    return {"status": "success", **result, "timestamp": datetime.now().isoformat()}
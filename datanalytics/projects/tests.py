@@ -1,3 +1,887 @@
-from django.test import TestCase
+"""Tests for the projects app."""
 
-# Create your tests here.
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest.mock import Mock, patch
+import numpy as np
+import pandas as pd
+from celery.signals import after_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from monitoring.metrics import render as render_metrics, reset_store
+from users.models import CustomUser
+from .management.commands.benchmark import Command as BenchmarkCommand, machine as benchmark_machine
+from .management.commands.loadtest import Command as LoadTestCommand, percentile
+from .models import DatasetBlob, Project, ProjectRun, RetentionPolicy
+from .params import diff_params, materialize, save_parameter_set
+from .report_cache import CACHE_DIR, collect_garbage, compress_report
+from .retention import apply_retention, plan_retention
+from .binning import bin_columns, optimal_bins
+from .blobs import blob_path, collect_blobs
+from .columnar import profile_csv_parallel
+from .cube import build_cube, save_cube
+from .imputation import apply_treatment, fill_statistics, numeric_columns
+from .prep import SAMPLED_NAME, undersample_csv, write_manifest
+from .profiling import profile_chunks, profile_csv, render_profile
+from .sampling import allocate, sample_csv
+from .sketches import DistinctSketch, FrequentItems, QuantileSketch
+from .synthetic import build_dataset
+from .tasks import compute_optimal_bins, data_preparation, generate_sweetviz_report, update_period_cube
+
+
+class LoadTestHelperTests(TestCase):
+    """Tests for the load test helpers."""
+    def test_percentile_nearest_rank(self) -> None:
+        """Test nearest-rank percentiles on a small sample."""
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 95), 95.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_build_dataset_dates(self) -> None:
+        """Test that the synthetic dataset carries the advertised dates."""
+        data, dates = build_dataset(rows=50, features=2, seed=1)
+        header = data.decode("utf-8").splitlines()[0].split(",")
+        self.assertIn("observation_date", header)
+        self.assertEqual(len(dates), 12)
+        self.assertEqual(dates[0], "01/01/2023")
+
+    @patch.dict(os.environ, {"GIZMO_TIMEOUT": "5"})
+    def test_environment_restored(self) -> None:
+        """Test that the variables set for a run are restored or removed when it ends."""
+        os.environ.pop("CELERY_BROKER_URL", None)
+        with ExitStack() as stack:
+            LoadTestCommand._set_environ(stack, "GIZMO_TIMEOUT", "0")
+            LoadTestCommand._set_environ(stack, "CELERY_BROKER_URL", "memory://")
+            self.assertEqual((os.environ["GIZMO_TIMEOUT"], os.environ["CELERY_BROKER_URL"]), ("0", "memory://"))
+        self.assertEqual(os.environ["GIZMO_TIMEOUT"], "5")
+        self.assertNotIn("CELERY_BROKER_URL", os.environ)
+
+
+class BenchmarkCompareTests(TestCase):
+    """Tests for the benchmark baseline comparison."""
+    def test_regressions_reported(self) -> None:
+        """Test that slowdowns and memory growth beyond tolerance are reported."""
+        baseline = {
+            "a[1x1]": {"seconds": 1.0, "peak_mb": 10.0},
+            "b[1x1]": {"seconds": 1.0, "peak_mb": 10.0},
+        }
+        results = {
+            "a[1x1]": {"seconds": 1.1, "peak_mb": 10.5},
+            "b[1x1]": {"seconds": 2.0, "peak_mb": 20.0},
+            "c[1x1]": {"seconds": 9.0, "peak_mb": 90.0},
+        }
+        regressions = BenchmarkCommand()._compare(results, baseline, tolerance=0.25, memory_tolerance=0.1)
+        self.assertEqual([line.split(":")[0] for line in regressions], ["b[1x1]", "b[1x1]", "c[1x1]"])
+        self.assertIn("not in the baseline", regressions[2])
+
+    def test_missing_baseline_fails(self) -> None:
+        """Test that the command refuses to run without a baseline unless told to."""
+        with self.assertRaisesMessage(CommandError, "--allow-missing-baseline"):
+            call_command("benchmark", baseline=os.path.join(tempfile.gettempdir(), "missing-baseline.json"))
+
+    def test_baseline_of_another_machine_refused(self) -> None:
+        """Test that timings are not compared with a baseline measured elsewhere."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "baseline.json")
+        with open(path, "w") as f:
+            json.dump({"machine": {**benchmark_machine(), "cpus": 1024}, "results": {}}, f)
+        with self.assertRaisesMessage(CommandError, "record one here with --save-baseline"):
+            call_command("benchmark", baseline=path)
+
+
+class ProfilingTests(TestCase):
+    """Tests for the built-in profiling engine and its sketches."""
+    def test_sketches_within_error_bounds(self) -> None:
+        """Test quantile, distinct and frequent value estimates against exact figures."""
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=200_000)
+        quantiles = QuantileSketch(seed=0)
+        distinct = DistinctSketch(k=1024)
+        for chunk in np.array_split(values, 20):
+            quantiles.update(chunk)
+            distinct.update(np.round(chunk, 3))
+        estimates = quantiles.quantiles([0.1, 0.5, 0.9])
+        ranks = [np.mean(values <= estimate) for estimate in estimates]
+        np.testing.assert_allclose(ranks, [0.1, 0.5, 0.9], atol=0.01)
+        true_distinct = len(np.unique(np.round(values, 3)))
+        self.assertLess(abs(distinct.estimate() - true_distinct) / true_distinct, 0.1)
+
+        frequent = FrequentItems(capacity=4)
+        for _ in range(3):
+            frequent.update(pd.Series(["a"] * 50 + ["b"] * 30 + list("cdefgh")).value_counts())
+        self.assertEqual([value for value, _ in frequent.top(2)], ["a", "b"])
+        self.assertGreaterEqual(frequent.top(1)[0][1], 150 - frequent.error)
+
+    def test_profile_kinds_and_report(self) -> None:
+        """Test that chunks are profiled per column kind and rendered to HTML."""
+        first = pd.DataFrame({
+            "observation_date": ["01/31/2023", "02/28/2023"],
+            "amount": [1.0, None],
+            "segment": ["retail", "sme"],
+        })
+        # A later chunk with a stray string, as read_csv would give it
+        second = pd.DataFrame({
+            "observation_date": ["02/28/2023", None],
+            "amount": ["3.0", "x"],
+            "segment": ["retail", "retail"],
+        })
+        profile = profile_chunks([first, second], source="test")
+        columns = {column.name: column.summary(profile.rows) for column in profile.columns}
+        self.assertEqual(profile.rows, 4)
+        self.assertEqual(columns["observation_date"]["kind"], "date")
+        self.assertEqual(columns["observation_date"]["top_values"][1], {"value": "2023-02", "count": 2, "pct": 100 * 2 / 3})
+        self.assertEqual(columns["amount"]["kind"], "numeric")
+        self.assertEqual((columns["amount"]["count"], columns["amount"]["missing"], columns["amount"]["invalid"]), (2, 1, 1))
+        self.assertEqual(columns["amount"]["mean"], 2.0)
+        self.assertEqual(columns["segment"]["top_values"][0]["value"], "retail")
+        html = render_profile(profile, title="Profile")
+        self.assertIn("observation_date", html)
+        self.assertNotIn("<link", html)
+
+    def test_parallel_profile_matches_serial(self) -> None:
+        """Test that the column-parallel profile has the exact figures of the serial one."""
+        rng = np.random.default_rng(5)
+        rows = 5_000
+        df = pd.DataFrame({
+            "observation_date": rng.choice(["01/31/2023", "02/28/2023", None], rows),
+            "amount": np.where(rng.random(rows) < 0.1, np.nan, rng.normal(size=rows).round(2)),
+            "segment": rng.choice(["retail", "sme", "corporate", None], rows),
+        })
+        df.loc[10, "amount"] = "n/a"
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            df.to_csv(path, index=False)
+            serial = profile_csv(path, chunk_cells=3_000)
+            with patch("projects.columnar.BLOCK_BYTES", 16 * 1024):
+                parallel = profile_csv_parallel(path, workers=2)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(parallel.rows, rows)
+        fields = ["name", "kind", "count", "missing", "invalid", "distinct", "minimum", "maximum", "zeros"]
+        for expected, actual in zip(serial.columns, parallel.columns):
+            expected, actual = expected.summary(rows), actual.summary(rows)
+            self.assertEqual({key: actual.get(key) for key in fields}, {key: expected.get(key) for key in fields})
+            if expected["kind"] == "numeric":
+                self.assertAlmostEqual(actual["mean"], expected["mean"])
+                self.assertAlmostEqual(actual["std"], expected["std"])
+            else:
+                self.assertEqual(actual["top_values"], expected["top_values"])
+
+
+class SamplingTests(TestCase):
+    """Tests for the stratified report samples."""
+    def setUp(self) -> None:
+        """Write a file with unevenly sized strata."""
+        rng = np.random.default_rng(3)
+        rows = 20_000
+        self.df = pd.DataFrame({
+            "observation_date": rng.choice(["01/31/2023", "02/28/2023", "03/31/2023"], rows, p=[0.5, 0.3, 0.2]),
+            "default_flag": (rng.random(rows) < 0.05).astype(int),
+            "feature": rng.normal(size=rows),
+        })
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.df.to_csv(self.path, index=False)
+
+    def tearDown(self) -> None:
+        """Remove the file."""
+        os.remove(self.path)
+
+    def test_allocation_is_proportional(self) -> None:
+        """Test that the budget is split by stratum size and adds up exactly."""
+        allocation = allocate({("a",): 500, ("b",): 300, ("c",): 199, ("d",): 1}, budget=100)
+        self.assertEqual(sum(allocation.values()), 100)
+        self.assertEqual(allocation[("a",)], 50)
+        self.assertEqual(allocate({("a",): 5}, budget=100), {("a",): 5})
+
+    def test_sample_matches_strata(self) -> None:
+        """Test that the sample keeps each stratum's share and is reproducible."""
+        columns = ["observation_date", "default_flag"]
+        sample = sample_csv(self.path, 2_000, columns, seed=7, chunk_cells=3_000)
+        self.assertEqual(sample.rows, 2_000)
+        self.assertEqual(sample.population_rows, 20_000)
+        self.assertEqual(sample.strata, 6)
+        self.assertEqual(sample.frame["default_flag"].dtype, self.df["default_flag"].dtype)
+        expected = self.df.groupby(columns).size() / 10
+        actual = sample.frame.groupby(columns).size()
+        self.assertTrue(((actual - expected).abs() <= 1).all())
+        again = sample_csv(self.path, 2_000, columns, seed=7)
+        pd.testing.assert_frame_equal(sample.frame, again.frame)
+        self.assertAlmostEqual(sample.margin_of_error, 1.96 * np.sqrt(0.25 / 2_000) * np.sqrt(18_000 / 19_999))
+        self.assertIn("2,000 of 20,000", sample.description())
+
+    def test_undersampling_keeps_minority(self) -> None:
+        """Test that each period keeps its share of majority rows and every minority row."""
+        out_dir = tempfile.mkdtemp()
+        out_path = os.path.join(out_dir, SAMPLED_NAME)
+        sample = undersample_csv(self.path, out_path, "default_flag", "observation_date", 0.25, seed=5,
+                                 chunk_cells=3_000)
+        kept = pd.read_csv(out_path)
+        self.assertEqual(sample.majority_class, "0")
+        self.assertEqual(sample.rows, len(kept))
+        self.assertEqual(list(kept.columns), list(self.df.columns))
+        expected = self.df.groupby(["observation_date", "default_flag"]).size()
+        actual = kept.groupby(["observation_date", "default_flag"]).size()
+        for (period, flag), count in expected.items():
+            self.assertEqual(actual[(period, flag)], count if flag else int(round(count * 0.25)))
+        again = undersample_csv(self.path, out_path, "default_flag", "observation_date", 0.25, seed=5)
+        self.assertEqual(again.rows, sample.rows)
+        pd.testing.assert_frame_equal(pd.read_csv(out_path), kept)
+        with open(write_manifest(out_dir, sample)) as f:
+            self.assertEqual(json.load(f)["under_sampling"]["majority_weight"], 4.0)
+        shutil.rmtree(out_dir)
+
+
+class ReportCacheTests(TestCase):
+    """Tests for the content-addressed report cache."""
+    def setUp(self) -> None:
+        """Create two projects with the same input in a temporary media root."""
+        self.media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media_root, METRICS_BACKEND="memory")
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+        data, _ = build_dataset(rows=300, features=3, seed=1)
+        for name in ("first", "second"):
+            project = Project(name=name, description="", user=self.user, report_backend=Project.REPORT_NATIVE)
+            project.input_dataframe.save("input.csv", ContentFile(data), save=False)
+            project.save()
+
+    def cached_reports(self) -> list:
+        """Return the report files in the cache, without their compressed copies."""
+        root = os.path.join(self.media_root, CACHE_DIR)
+        return [name for _, _, files in os.walk(root) for name in files if name.endswith(".html")]
+
+    def test_same_input_shares_one_report(self) -> None:
+        """Test that repeated and identical requests reuse a single stored report."""
+        first = generate_sweetviz_report.apply(args=("analyst", "first")).get()
+        again = generate_sweetviz_report.apply(args=("analyst", "first")).get()
+        other = generate_sweetviz_report.apply(args=("analyst", "second")).get()
+        self.assertEqual((first["cached"], again["cached"], other["cached"]), (False, True, True))
+        self.assertEqual(len(self.cached_reports()), 1)
+        names = set(Project.objects.values_list("sweetviz_report", flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names.pop().startswith(CACHE_DIR))
+
+        sampled = generate_sweetviz_report.apply(args=("analyst", "first"), kwargs={"sample_rows": 100}).get()
+        self.assertFalse(sampled["cached"])
+        self.assertEqual(len(self.cached_reports()), 2)
+
+    def test_failed_publish_leaves_no_partial_files(self) -> None:
+        """Test that attempts failing after the report was written remove it and its copies."""
+        def fail_after_compressing(tmp_path, path):
+            compress_report(tmp_path)
+            raise OSError("disk full")
+
+        with patch("projects.tasks.publish_report", side_effect=fail_after_compressing):
+            result = generate_sweetviz_report.apply(args=("analyst", "first")).get()
+        self.assertEqual(result["status"], "failure")
+        root = os.path.join(self.media_root, CACHE_DIR)
+        self.assertEqual([name for _, _, files in os.walk(root) for name in files], [])
+
+    def test_garbage_collection_skips_referenced(self) -> None:
+        """Test that least recently used, unreferenced reports are removed first."""
+        generate_sweetviz_report.apply(args=("analyst", "first")).get()
+        referenced = Project.objects.get(name="first").sweetviz_report.name
+        directory = os.path.join(self.media_root, CACHE_DIR, "00")
+        os.makedirs(directory)
+        for age, name in enumerate(["new", "old"]):
+            path = os.path.join(directory, f"{name}.html")
+            with open(path, "w") as f:
+                f.write("x" * 1000)
+            os.utime(path, (time.time() - 100 * (age + 1),) * 2)
+        with open(os.path.join(directory, "old.html.gz"), "w") as f:
+            f.write("x" * 100)
+        os.utime(os.path.join(directory, "old.html.gz"), (time.time() - 200,) * 2)
+        os.utime(os.path.join(self.media_root, referenced), (0, 0))
+
+        referenced_bytes = sum(
+            os.path.getsize(os.path.join(self.media_root, referenced + suffix))
+            for suffix in ("", ".gz", ".br") if os.path.exists(os.path.join(self.media_root, referenced + suffix))
+        )
+        removed = collect_garbage(quota=referenced_bytes + 1000)
+        self.assertEqual(removed, [f"{CACHE_DIR}/00/old.html"])
+        self.assertFalse(os.path.exists(os.path.join(directory, "old.html.gz")))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, referenced + ".gz")))
+
+    def test_report_delivery_negotiates_and_revalidates(self) -> None:
+        """Test that reports are sent precompressed with validators and revalidated with 304."""
+        generate_sweetviz_report.apply(args=("analyst", "first")).get()
+        self.client.force_login(self.user)
+        url = reverse("show_report") + "?project_name=first"
+        html = self.client.get(url)
+        self.assertEqual(html.status_code, 200)
+        self.assertNotIn("Content-Encoding", html)
+        body = b"".join(html.streaming_content)
+        self.assertIn(b"first data profile", body)
+
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=1.0, br;q=0")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(compressed.streaming_content)), body)
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertNotEqual(compressed["ETag"], html["ETag"])
+
+        revalidated = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=compressed["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated["ETag"], compressed["ETag"])
+
+        download = self.client.get(reverse("download_sweetviz") + "?project_name=first")
+        self.assertIn('attachment; filename="first.html"', download["Content-Disposition"])
+
+
+class CubeTests(TestCase):
+    """Tests for the per-period aggregate cube."""
+    def setUp(self) -> None:
+        """Write the first half of a synthetic file and keep the rest for appending."""
+        data, self.periods = build_dataset(rows=4_000, features=2, seed=4)
+        self.df = pd.read_csv(io.BytesIO(data))
+        lines = data.splitlines(keepends=True)
+        self.head, self.tail = b"".join(lines[:2_001]), b"".join(lines[2_001:])
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        with open(self.path, "wb") as f:
+            f.write(self.head + self.tail)
+
+    def test_aggregates_match_pandas(self) -> None:
+        """Test that bad rates and bin counts equal a direct computation."""
+        cube, incremental = build_cube(self.path, "observation_date", "default_flag", chunk_cells=5_000)
+        self.assertFalse(incremental)
+        self.assertEqual(cube.periods, self.periods)
+        expected = self.df.groupby("observation_date")["default_flag"].agg(["size", "sum"])
+        rates = cube.bad_rates("segment")
+        self.assertEqual([row["rows"] for row in rates["periods"]], expected.loc[self.periods, "size"].tolist())
+        self.assertEqual([row["bads"] for row in rates["periods"]], expected.loc[self.periods, "sum"].tolist())
+        segments = self.df[self.df["observation_date"] == self.periods[0]]["segment"].value_counts()
+        counts = dict(zip(rates["bins"], rates["counts"][0]))
+        self.assertEqual({name: counts[name] for name in segments.index}, segments.to_dict())
+        self.assertEqual(counts["Missing"], 0)
+
+        missing = self.df["feature_0"].isna().groupby(self.df["observation_date"]).sum()
+        index = cube.columns.index("feature_0")
+        self.assertEqual(cube.counts[:, index, -1].tolist(), missing.loc[self.periods].tolist())
+        psi = cube.psi(self.periods[:6], self.periods[6:])
+        self.assertEqual(cube.psi(self.periods, self.periods)["feature_0"], 0.0)
+        self.assertLess(psi["feature_0"], 0.1)
+
+    def test_appended_rows_update_incrementally(self) -> None:
+        """Test that extending a cube with appended rows equals building it from scratch."""
+        full, _ = build_cube(self.path, "observation_date", "default_flag", chunk_cells=5_000)
+        with open(self.path, "wb") as f:
+            f.write(self.head)
+        cube, _ = build_cube(self.path, "observation_date", "default_flag", chunk_cells=5_000)
+        with open(self.path, "ab") as f:
+            f.write(self.tail)
+        updated, incremental = build_cube(self.path, "observation_date", "default_flag", cube, chunk_cells=5_000)
+        self.assertTrue(incremental)
+        self.assertEqual(updated.rows, 4_000)
+        np.testing.assert_array_equal(updated.period_bads, full.period_bads)
+        # Bins are fitted on the first chunk, so compare columns whose bins do not depend on it
+        index = updated.columns.index("segment")
+        np.testing.assert_array_equal(updated.counts[:, index], full.counts[:, index])
+
+    def test_endpoints_answer_from_cube(self) -> None:
+        """Test the PSI and bad rate endpoints against a stored cube."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root, METRICS_BACKEND="memory"):
+            user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+            project = Project(name="cube", description="", user=user)
+            with open(self.path, "rb") as f:
+                project.input_dataframe.save("input.csv", ContentFile(f.read()), save=False)
+            params = {"observation_date_column": "observation_date", "criterion_column": "default_flag",
+                      "t1df": self.periods[0], "t2df": self.periods[6], "t3df": self.periods[-1],
+                      "periods_to_exclude": [self.periods[1]]}
+            project.save()
+            save_parameter_set(project, params)
+            self.client.force_login(user)
+
+            missing = self.client.get(reverse("cube_psi"), {"project_name": "cube"})
+            self.assertEqual(missing.status_code, 409)
+
+            cube, _ = build_cube(project.input_dataframe.path, "observation_date", "default_flag")
+            save_cube(cube, os.path.join(media_root, "cubes", "analyst_cube.npz"))
+            psi = self.client.get(reverse("cube_psi"), {"project_name": "cube", "column": "feature_1"}).json()
+            self.assertEqual(psi["base"], [self.periods[0]] + self.periods[2:6])
+            self.assertEqual(psi["target"], self.periods[6:])
+            self.assertEqual(list(psi["psi"]), ["feature_1"])
+            rates = self.client.get(reverse("cube_bad_rate"), {"project_name": "cube"}).json()
+            self.assertEqual(sum(row["rows"] for row in rates["periods"]), 4_000)
+
+
+class BinningTests(TestCase):
+    """Tests for the monotonic optimal binning engine."""
+    def setUp(self) -> None:
+        """Write a file where the bad rate rises with the score and differs by segment."""
+        rng = np.random.default_rng(11)
+        rows = 20_000
+        score = rng.normal(size=rows)
+        segment = rng.choice(["retail", "sme", "corporate", "public"], rows, p=[0.5, 0.3, 0.15, 0.05])
+        logit = -3 + 1.2 * score + np.select([segment == "sme", segment == "corporate"], [0.8, -0.5], 0.0)
+        self.df = pd.DataFrame({
+            "score": np.where(rng.random(rows) < 0.05, np.nan, score),
+            "segment": segment,
+            "default_flag": (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype(int),
+        })
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.path = os.path.join(self.media_root, "input.csv")
+        self.df.to_csv(self.path, index=False)
+
+    def test_bins_are_monotonic_and_bounded(self) -> None:
+        """Test that merged bins keep a monotonic bad rate, the size floor and the bin limit."""
+        rng = np.random.default_rng(2)
+        goods = rng.integers(50, 150, 60).astype(float)
+        bads = np.linspace(1, 40, 60) + rng.integers(0, 15, 60)
+        result = optimal_bins(goods, bads, max_bins=6, min_share=0.05)
+        self.assertEqual(result["direction"], "increasing")
+        self.assertLessEqual(len(result["starts"]), 6)
+        bin_goods, bin_bads = np.add.reduceat(goods, result["starts"]), np.add.reduceat(bads, result["starts"])
+        self.assertTrue(np.all(np.diff(bin_bads / (bin_goods + bin_bads)) >= 0))
+        self.assertTrue(np.all(bin_goods + bin_bads >= 0.05 * (goods.sum() + bads.sum())))
+
+    def test_columns_binned_in_parallel(self) -> None:
+        """Test numeric and text bins computed on a pool against the data."""
+        with patch("projects.columnar.BLOCK_BYTES", 64 * 1024):
+            score, segment = bin_columns(self.path, ["score", "segment"], "default_flag", workers=2)
+        self.assertEqual(score["direction"], "increasing")
+        rates = [item["bad_rate"] for item in score["bins"] if not item.get("missing")]
+        self.assertEqual(rates, sorted(rates))
+        self.assertTrue(score["bins"][-1]["missing"])
+        self.assertEqual(score["bins"][-1]["count"], int(self.df["score"].isna().sum()))
+        self.assertEqual(sum(item["count"] for item in score["bins"]), len(self.df))
+        self.assertGreater(score["iv"], 0.3)
+
+        self.assertEqual(segment["bins"][0]["values"], ["corporate"])
+        self.assertEqual(segment["bins"][-1]["values"], ["sme"])
+        expected = self.df[self.df["segment"] == "sme"]["default_flag"].agg(["size", "sum"])
+        self.assertEqual((segment["bins"][-1]["count"], segment["bins"][-1]["bads"]), tuple(expected))
+
+    def test_preview_uses_cache(self) -> None:
+        """Test that the preview answers from the bins the task cached."""
+        with override_settings(MEDIA_ROOT=self.media_root, METRICS_BACKEND="memory", BINNING_WORKERS=2):
+            user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+            project = Project(name="bins", description="", user=user)
+            with open(self.path, "rb") as f:
+                project.input_dataframe.save("input.csv", ContentFile(f.read()), save=False)
+            params = {"criterion_column": "default_flag", "optimal_binning_columns": ["segment", "score"]}
+            project.save()
+            save_parameter_set(project, params)
+
+            first = compute_optimal_bins.apply(args=("analyst", "bins")).get()
+            again = compute_optimal_bins.apply(args=("analyst", "bins")).get()
+            self.assertEqual((first["computed"], again["computed"], again["cached"]), (2, 0, 2))
+
+            self.client.force_login(user)
+            preview = self.client.get(reverse("binning_preview"), {"project_name": "bins"})
+            self.assertEqual(preview.status_code, 200)
+            columns = preview.json()["columns"]
+            self.assertEqual([column["column"] for column in columns], ["score", "segment"])
+
+    def test_preview_is_strict_json(self) -> None:
+        """Test that the preview parses without the NaN and Infinity extensions and leaves the ends open."""
+        def reject(constant: str) -> None:
+            raise ValueError(f"{constant} is not JSON")
+
+        with override_settings(MEDIA_ROOT=self.media_root, METRICS_BACKEND="memory", BINNING_WORKERS=2):
+            user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+            project = Project(name="bins", description="", user=user)
+            with open(self.path, "rb") as f:
+                project.input_dataframe.save("input.csv", ContentFile(f.read()), save=False)
+            project.save()
+            save_parameter_set(project, {"criterion_column": "default_flag", "optimal_binning_columns": ["score"]})
+            compute_optimal_bins.apply(args=("analyst", "bins")).get()
+
+            self.client.force_login(user)
+            preview = self.client.get(reverse("binning_preview"), {"project_name": "bins"})
+        score = json.loads(preview.content, parse_constant=reject)["columns"][0]
+        bounded = [item for item in score["bins"] if not item.get("missing")]
+        self.assertIsNone(bounded[0]["low"])
+        self.assertIsNone(bounded[-1]["high"])
+        self.assertEqual([item["high"] for item in bounded[:-1]], [item["low"] for item in bounded[1:]])
+
+    def test_preview_enqueues_one_task(self) -> None:
+        """Test that polling the preview while columns are missing starts a single binning task."""
+        user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+        project = Project.objects.create(name="bins", description="", user=user, input_digest="0" * 64)
+        save_parameter_set(project, {"criterion_column": "default_flag", "optimal_binning_columns": ["score"]})
+
+        def publish(*args):
+            after_task_publish.send(sender=compute_optimal_bins.name, headers={"id": "bin-1"},
+                                    body=(args, {}, {}))
+            return Mock(id="bin-1")
+
+        self.client.force_login(user)
+        with override_settings(MEDIA_ROOT=self.media_root, METRICS_BACKEND="memory"), \
+                patch("projects.views.compute_optimal_bins.delay", side_effect=publish) as delay:
+            responses = [self.client.get(reverse("binning_preview"), {"project_name": "bins"}) for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [202, 202])
+        self.assertEqual([response.json()["task_id"] for response in responses], ["bin-1", "bin-1"])
+        delay.assert_called_once_with("analyst", "bins")
+
+
+class ImputationTests(TestCase):
+    """Tests for the streaming missing value treatment."""
+    def setUp(self) -> None:
+        """Write a synthetic file with missing values."""
+        data, _ = build_dataset(rows=6_000, features=3, seed=9)
+        self.df = pd.read_csv(io.BytesIO(data))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "input.csv")
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_fill_values_match_pandas(self) -> None:
+        """Test exact means, sketched medians and equal results on a pool."""
+        columns = numeric_columns(self.path)
+        self.assertIn("feature_0", columns)
+        serial = fill_statistics(self.path, columns, chunk_cells=5_000)
+        with patch("projects.columnar.BLOCK_BYTES", 64 * 1024):
+            parallel = fill_statistics(self.path, columns, workers=2)
+        values = self.df["feature_0"]
+        self.assertAlmostEqual(serial["feature_0"].fill_value("column_mean"), values.mean())
+        self.assertAlmostEqual(parallel["feature_0"].fill_value("column_mean"), values.mean())
+        self.assertEqual(serial["feature_0"].missing, int(values.isna().sum()))
+        rank = (values < serial["feature_0"].fill_value("median")).mean() / values.notna().mean()
+        self.assertAlmostEqual(rank, 0.5, delta=0.01)
+
+    def test_treatments_stream_to_file(self) -> None:
+        """Test that fills replace only missing values and delete drops incomplete rows."""
+        statistics = fill_statistics(self.path, numeric_columns(self.path))
+        out_path = os.path.join(self.directory, "treated.csv")
+        treatment = apply_treatment(self.path, out_path, "median", statistics, chunk_cells=5_000)
+        treated = pd.read_csv(out_path)
+        median = treatment.fill_values["feature_0"]
+        missing = self.df["feature_0"].isna()
+        self.assertEqual(treatment.missing["feature_0"], int(missing.sum()))
+        self.assertTrue((treated.loc[missing, "feature_0"] == median).all())
+        pd.testing.assert_series_equal(treated.loc[~missing, "feature_0"], self.df.loc[~missing, "feature_0"])
+
+        treatment = apply_treatment(self.path, out_path, "delete", {}, chunk_cells=5_000)
+        self.assertEqual(treatment.rows, len(self.df.dropna()))
+        self.assertEqual(treatment.deleted_rows, len(self.df) - treatment.rows)
+        with self.assertRaises(ValueError):
+            apply_treatment(self.path, out_path, "mode", {})
+
+
+@override_settings(
+    METRICS_BACKEND="memory",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ProjectListTests(TestCase):
+    """Tests for the paginated project list and the runs it reads task state from."""
+    def setUp(self) -> None:
+        """Create a user with more projects than fit on a page."""
+        self.user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+        Project.objects.bulk_create([
+            Project(name=f"project-{i:02d}", description="", user=self.user) for i in range(30)
+        ])
+        cache.clear()
+        reset_store(setting="METRICS_BACKEND")
+
+    def test_signals_record_runs(self) -> None:
+        """Test that a run is queued on publish, started before and finished after the task."""
+        after_task_publish.send(sender=data_preparation.name, headers={"id": "t1", "enqueued_at": time.time()},
+                                body=(("analyst_project-01",), {}, {}))
+        run = ProjectRun.objects.get(task_id="t1")
+        self.assertEqual((run.project.name, run.stage, run.status), ("project-01", "prep", "queued"))
+
+        task_prerun.send(sender=data_preparation, task_id="t1", task=data_preparation, args=("analyst_project-01",))
+        self.assertEqual(ProjectRun.objects.get(task_id="t1").status, "started")
+        task_postrun.send(sender=data_preparation, task_id="t1", task=data_preparation, state="SUCCESS",
+                          retval={"status": "success", "return_code": 0, "output_path": "/out"})
+        run = ProjectRun.objects.get(task_id="t1")
+        self.assertEqual((run.status, run.return_code, run.output_path), ("success", 0, "/out"))
+        self.assertGreaterEqual(run.duration_seconds, 0)
+
+        task_prerun.send(sender=update_period_cube, task_id="t2", task=update_period_cube,
+                         args=("analyst", "project-02"))
+        task_postrun.send(sender=update_period_cube, task_id="t2", task=update_period_cube, state="SUCCESS",
+                          retval={"status": "failure", "error": "no params"})
+        run = ProjectRun.objects.get(task_id="t2")
+        self.assertEqual((run.stage, run.status, run.error), ("cube", "failure", "no params"))
+
+        task_prerun.send(sender=data_preparation, task_id="t3", task=data_preparation, args=("analyst_project-03",))
+        task_postrun.send(sender=data_preparation, task_id="t3", task=data_preparation, state="SUCCESS",
+                          retval={"status": "success", "train_return_code": 0, "eval_return_code": -9})
+        run = ProjectRun.objects.get(task_id="t3")
+        self.assertEqual((run.status, run.return_code, run.error), ("failure", -9, "gizmo exited with code -9"))
+
+    @override_settings(PROJECTS_PER_PAGE=24)
+    def test_list_is_paginated_with_run_states(self) -> None:
+        """Test that a page holds only its projects and marks those with running tasks from the database."""
+        projects = {project.name: project for project in Project.objects.all()}
+        ProjectRun.objects.create(project=projects["project-01"], stage="prep", task_id="a", status="started")
+        ProjectRun.objects.create(project=projects["project-02"], stage="sweetviz", task_id="b", status="success")
+        self.client.force_login(self.user)
+        with patch("projects.views.AsyncResult", side_effect=AssertionError("result backend called")):
+            first = self.client.get(reverse("projects"))
+            second = self.client.get(reverse("projects"), {"page": 2})
+            detail = self.client.get(reverse("projects"), {"project_name": "project-01"})
+        page = first.context["projects"]
+        self.assertEqual(len(page), 24)
+        self.assertEqual([project["running"] for project in page][:3], [False, True, False])
+        self.assertEqual(second.context["projects"][0]["name"], "project-24")
+        self.assertEqual(len(second.context["projects"]), 6)
+        self.assertEqual((detail.context["prep_status"], detail.context["prep_task_id"]), ("running", "a"))
+
+    def test_pages_cached_until_project_changes(self) -> None:
+        """Test that repeated views skip the project queries until a run or the project is saved."""
+        project = Project.objects.get(name="project-03")
+        self.client.force_login(self.user)
+        url = reverse("projects")
+        self.client.get(url, {"project_name": "project-03"})
+        self.client.get(url)
+        # Only the session and the user are loaded
+        with self.assertNumQueries(2):
+            self.client.get(url, {"project_name": "project-03"})
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+        ProjectRun.objects.create(project=project, stage="prep", task_id="c", status="queued")
+        detail = self.client.get(url, {"project_name": "project-03"})
+        listing = self.client.get(url)
+        self.assertEqual(detail.context["prep_task_id"], "c")
+        self.assertTrue(listing.context["projects"][3]["running"])
+        project.description = "changed"
+        project.save()
+        self.assertEqual(self.client.get(url, {"project_name": "project-03"}).context["project"].description, "changed")
+        self.assertEqual(self.client.get(url, {"project_name": "missing"}).status_code, 404)
+        self.assertIn('datanalytics_page_cache_lookups_total{page="project_detail",result="hit"} 1', render_metrics())
+
+    def test_pages_served_when_cache_is_down(self) -> None:
+        """Test that project pages and project saves work while the cache cannot be reached."""
+        self.client.force_login(self.user)
+        project = Project.objects.get(name="project-04")
+        with patch("projects.page_cache.cache.get", side_effect=ConnectionError("cache down")), \
+                patch("projects.page_cache.cache.set", side_effect=ConnectionError("cache down")):
+            detail = self.client.get(reverse("projects"), {"project_name": "project-04"})
+            listing = self.client.get(reverse("projects"))
+            project.description = "changed"
+            project.save()
+        self.assertEqual(detail.context["project"].name, "project-04")
+        self.assertEqual(len(listing.context["projects"]), 24)
+
+    def test_missed_invalidation_expires(self) -> None:
+        """Test that a page whose invalidation could not reach the cache is rebuilt once the entries expire."""
+        self.client.force_login(self.user)
+        url = reverse("projects")
+        self.client.get(url, {"project_name": "project-05"})
+        project = Project.objects.get(name="project-05")
+        with patch("projects.page_cache.cache.set", side_effect=ConnectionError("cache down")):
+            project.description = "changed"
+            project.save()
+        self.assertNotEqual(self.client.get(url, {"project_name": "project-05"}).context["project"].description,
+                            "changed")
+        later = time.time() + settings.PAGE_CACHE_TIMEOUT + 1
+        with patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            detail = self.client.get(url, {"project_name": "project-05"})
+        self.assertEqual(detail.context["project"].description, "changed")
+
+
+
+class ParameterSetTests(TestCase):
+    """Tests for versioned project parameters."""
+    def setUp(self) -> None:
+        """Create a project."""
+        user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+        self.project = Project.objects.create(name="scoring", description="", user=user)
+        self.params = {"criterion_column": "default_flag", "under_sampling": 1, "cut_offs": {"xgb": [0.5]}}
+
+    def test_versions_and_diff(self) -> None:
+        """Test that changed parameters add a version and identical ones do not."""
+        first = save_parameter_set(self.project, self.params)
+        same = save_parameter_set(self.project, dict(reversed(list(self.params.items()))))
+        second = save_parameter_set(self.project, {**self.params, "under_sampling": 0.5})
+        self.assertEqual((first.version, same.pk, second.version), (1, first.pk, 2))
+        self.assertNotEqual(first.digest, second.digest)
+        self.assertEqual(diff_params(first.params, second.params), {"under_sampling": (1, 0.5)})
+
+    def test_run_uses_version_it_was_queued_with(self) -> None:
+        """Test that a run pins the latest version on publish and materializes it for gizmo."""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        queued = save_parameter_set(self.project, self.params)
+        after_task_publish.send(sender=data_preparation.name, headers={"id": "t1"}, body=(("analyst_scoring",), {}, {}))
+        save_parameter_set(self.project, {**self.params, "under_sampling": 0.5})
+
+        run = ProjectRun.objects.get(task_id="t1")
+        self.assertEqual(run.parameter_set, queued)
+        with override_settings(MEDIA_ROOT=media_root):
+            path = materialize(self.project, run.parameter_set)
+        with open(path) as f:
+            self.assertEqual(json.load(f), self.params)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.param_file.name, "params/params_analyst_scoring.json")
+
+
+class StartupImportTests(TestCase):
+    """Tests for the modules the web app loads at startup."""
+    # Django, Celery and the apps take about 0.45 s; pandas added 0.3 s more and Sweetviz over 1 s
+    IMPORT_TIME_BUDGET_SECONDS = 0.8
+    LAZY_MODULES = ("sweetviz", "matplotlib", "scipy", "pandas", "numpy")
+
+    def test_url_conf_import_budget(self) -> None:
+        """Test that loading every view stays under the budget and leaves pandas and Sweetviz unloaded."""
+        code = "import django; django.setup(); from django.urls import get_resolver; get_resolver().url_patterns"
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                capture_output=True, text=True, cwd=settings.BASE_DIR, check=True)
+        top_level, loaded = 0, set()
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            loaded.add(name.strip().split(".")[0])
+            if not name[1:].startswith(" "):
+                top_level += int(cumulative)
+        self.assertEqual(loaded & set(self.LAZY_MODULES), set())
+        self.assertNotIn("Applied numpy/pandas compatibility fixes", result.stdout)
+        self.assertLess(top_level / 1e6, self.IMPORT_TIME_BUDGET_SECONDS)
+
+
+class RetentionTests(TestCase):
+    """Tests for the retention of sessions and of the files of deleted projects."""
+    STAMPS = ("20240101_090000", "20240201_090000", "20240301_090000", "20240401_090000")
+
+    def setUp(self) -> None:
+        """Lay out the sessions of a project and the leftovers of a deleted one."""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root,
+                                              RETENTION_ARCHIVE_DIR=os.path.join(self.media_root, "archive"))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        for stamp in self.STAMPS:
+            for kind in ("TRAIN", "EVAL"):
+                self.write(f"sessions/{kind}_analyst_scoring_{stamp}/model.txt", stamp)
+        for name in ("input_data/analyst_gone/input.csv", "output_data/analyst_gone/prepared.csv",
+                     "reports/old.html", "reports/current.html"):
+            self.write(name, "x" * 100)
+
+        user = CustomUser.objects.create_user(username="analyst", email="analyst@example.com", password="pw")
+        self.project = Project(name="scoring", description="", user=user, sweetviz_report="reports/current.html",
+                               prep_output=os.path.join(self.media_root, "output_data", "analyst_scoring"),
+                               train_eval_output=self.path(f"sessions/EVAL_analyst_scoring_{self.STAMPS[0]}"))
+        self.project.input_dataframe.save("input.csv", ContentFile(b"a,b\n1,2\n"), save=False)
+        self.project.save()
+        os.makedirs(self.project.prep_output)
+        RetentionPolicy.objects.create(project=self.project, keep_sessions=1)
+
+    def path(self, name: str) -> str:
+        """Return the absolute path of a media file."""
+        return os.path.join(self.media_root, *name.split("/"))
+
+    def write(self, name: str, content: str) -> None:
+        """Write a media file, creating its directories."""
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), "w") as f:
+            f.write(content)
+
+    def test_plan_keeps_referenced_and_recent(self) -> None:
+        """Test that only unreferenced leftovers and sessions beyond the policy are planned."""
+        planned = {os.path.relpath(action.path, self.media_root).replace(os.sep, "/") for action in plan_retention()}
+        self.assertEqual(planned, {
+            f"sessions/{kind}_analyst_scoring_{stamp}" for kind in ("TRAIN", "EVAL") for stamp in self.STAMPS[1:3]
+        } | {"input_data/analyst_gone", "output_data/analyst_gone", "reports/old.html"})
+
+        out = io.StringIO()
+        call_command("retention", "--dry-run", stdout=out)
+        self.assertIn("7 entries", out.getvalue())
+        self.assertTrue(os.path.exists(self.path("reports/old.html")))
+
+        ProjectRun.objects.create(project=self.project, stage="train_eval", task_id="t1", status="started")
+        self.assertFalse(any(action.kind == "session" for action in plan_retention()))
+
+    def test_archive_in_batches(self) -> None:
+        """Test that runs archive a batch each into tarballs and leave referenced files alone."""
+        first = apply_retention(limit=3)
+        self.assertEqual((first["archived"], first["remaining"]), (3, 4))
+        rest = apply_retention()
+        self.assertEqual((rest["archived"], rest["remaining"]), (4, 0))
+        self.assertEqual(plan_retention(), [])
+
+        archived = self.path(f"archive/sessions/TRAIN_analyst_scoring_{self.STAMPS[1]}.tar.gz")
+        with tarfile.open(archived) as tar:
+            member = tar.extractfile(f"TRAIN_analyst_scoring_{self.STAMPS[1]}/model.txt")
+            self.assertEqual(member.read(), self.STAMPS[1].encode())
+        self.assertFalse(os.path.exists(self.path(f"sessions/TRAIN_analyst_scoring_{self.STAMPS[1]}")))
+        for name in (f"sessions/EVAL_analyst_scoring_{self.STAMPS[0]}", f"sessions/TRAIN_analyst_scoring_{self.STAMPS[0]}",
+                     f"sessions/EVAL_analyst_scoring_{self.STAMPS[3]}", "reports/current.html",
+                     "input_data/analyst_scoring/input.csv", "output_data/analyst_scoring"):
+            self.assertTrue(os.path.exists(self.path(name)), name)
+
+
+@override_settings(METRICS_BACKEND="memory")
+class DatasetBlobTests(TestCase):
+    """Tests for the content-addressed storage of uploaded input files."""
+    CONTENT = b"date,target,amount\n01/31/2024,0,1.5\n02/29/2024,1,2.5\n"
+
+    def setUp(self) -> None:
+        """Use a temporary media root and create two analysts."""
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.users = [
+            CustomUser.objects.create_user(username=name, email=f"{name}@example.com", password="pw")
+            for name in ("ann", "bob")
+        ]
+
+    def upload(self, user: CustomUser, name: str) -> Project:
+        """Create a project through the form, uploading the same content each time."""
+        self.client.force_login(user)
+        self.client.post(reverse("project_creation"), {
+            "name": name, "description": "Monthly extract", "report_backend": "native",
+            "input_dataframe": SimpleUploadedFile("extract.csv", self.CONTENT, content_type="text/csv"),
+        })
+        return Project.objects.get(user=user, name=name)
+
+    def test_same_content_stored_once(self) -> None:
+        """Test that uploads of one file share a blob, parsed once and counted per project."""
+        first = self.upload(self.users[0], "scoring")
+        with patch("pandas.read_csv", side_effect=AssertionError("parsed again")):
+            second = self.upload(self.users[1], "scoring")
+
+        digest = hashlib.sha256(self.CONTENT).hexdigest()
+        self.assertEqual((first.input_digest, second.input_digest), (digest, digest))
+        self.assertEqual(second.input_dataframe.name, os.path.join("input_data", "bob_scoring", "input.csv"))
+        self.assertTrue(os.path.samefile(first.input_dataframe.path, blob_path(digest)))
+        self.assertTrue(os.path.samefile(second.input_dataframe.path, blob_path(digest)))
+        self.assertFalse(os.stat(blob_path(digest)).st_mode & 0o222)
+        blob = DatasetBlob.objects.get()
+        self.assertEqual((blob.refcount, blob.size_bytes), (2, len(self.CONTENT)))
+        self.assertEqual(blob.schema, {"columns": ["date", "target", "amount"], "date_column": "date"})
+
+        first.delete()
+        self.assertEqual(DatasetBlob.objects.get().refcount, 1)
+        self.assertEqual(collect_blobs(grace_seconds=0)["blobs_removed"], 0)
+        second.delete()
+        self.assertEqual(collect_blobs(grace_seconds=0), {"blobs_removed": 1, "blob_bytes_freed": len(self.CONTENT)})
+        self.assertFalse(os.path.exists(blob_path(digest)))
+        # The deleted project's link keeps the content until retention archives it
+        with open(os.path.join(self.media_root, "input_data", "bob_scoring", "input.csv"), "rb") as f:
+            self.assertEqual(f.read(), self.CONTENT)
@@ -17,9 +17,13 @@ urlpatterns = [
     path("download_csv/", views.download_csv, name="download_csv"),
     path("analyze_sweetviz/", views.analyze_sweetviz, name="analyze_sweetviz"),
     path("download_sweetviz/", views.download_sweetviz, name="download_sweetviz"),
+    path("cube/build/", views.build_cube, name="build_cube"),
     
     # AJAX endpoints
     path("get-date-values/", views.get_date_values, name="get_date_values"),
     path("task-status/<str:task_id>/", views.task_status, name="task_status"),
     path("reports/show/", views.show_report, name="show_report"),
+    path("cube/psi/", views.cube_psi, name="cube_psi"),
+    path("cube/bad-rate/", views.cube_bad_rate, name="cube_bad_rate"),
+    path("binning/preview/", views.binning_preview, name="binning_preview"),
 ]
\ No newline at end of file
@@ -8,28 +8,23 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db.models import Max
 from django.views.decorators.http import require_http_methods
 from .forms import ParamForm, ProjectForm
-from .models import Project
-from .tasks import data_preparation, train_and_evaluate, get_latest_session_id, generate_sweetviz_report
-import pandas as pd
+from .delivery import report_response
+from .models import Project, ProjectRun
+from .page_cache import cached, project_scope, user_scope
+from .params import latest_parameter_set
+from .report_cache import find_report, input_digest
+from .tasks import data_preparation, train_and_evaluate, get_latest_session_id, generate_sweetviz_report, update_period_cube, compute_optimal_bins
 from celery.result import AsyncResult
 import logging
+import math
 import os
-import sys
-from typing import Dict, Any
-import json
+from typing import Dict, Any, Optional
 from django.contrib import messages
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),  # Log to console
-    ]
-)
-
 logger = logging.getLogger(__name__)
 
 
@@ -86,7 +81,7 @@ def handle_task_response(task_result: AsyncResult) -> Dict[str, Any]:
                 
                 # Construct output path based on task type
                 if is_train_task:
-                    working_dir = os.path.join(os.getcwd(), "gizmo")
+                    working_dir = settings.MEDIA_ROOT
                     eval_session = get_latest_session_id("EVAL", project_name, working_dir)
                     output_path = os.path.join(working_dir, "sessions", eval_session)
                     task_type = "train_and_eval"
@@ -134,90 +129,18 @@ def handle_task_response(task_result: AsyncResult) -> Dict[str, Any]:
             "error": f"Error processing task result: {str(e)}"
         }
 
-@login_required
-@require_http_methods(["GET", "POST"])
-def param(request):
-    """Handle the parameter form for configuring project parameters.
-    
-    This view displays and processes the form for configuring project parameters.
-    On GET requests, it displays the form. On POST requests, it validates the form data,
-    creates a JSON parameter file, and redirects to the projects page.
-    
-    :param request: The HTTP request
-    :type request: HttpRequest
-    :return: Rendered form page on GET or form errors, redirect on successful POST
-    :rtype: HttpResponse
-    """
-    if request.method == "GET":
-        return render(request, "param/param.html", {
-            "form": ParamForm(request=request)
-        })
-    else:
-        form = ParamForm(request.POST, request=request)
-        if form.is_valid():
-            project_name = request.POST.get("project_name")
-            if not project_name:
-                return redirect("param")
-
-            # Create the params dictionary from form data
-            params = {
-                "criterion_column": form.cleaned_data["criterion_column"],
-                "missing_treatment": {"Info": "Missing"},
-                "observation_date_column": form.cleaned_data["observation_date_column"],
-                "secondary_criterion_columns": form.cleaned_data["secondary_criterion_columns"],
-                "t1df": form.cleaned_data["t1df"],
-                "t2df": form.cleaned_data["t2df"],
-                "t3df": form.cleaned_data["t3df"],
-                "periods_to_exclude": form.cleaned_data["periods_to_exclude"],
-                "columns_to_exclude": form.cleaned_data["columns_to_exclude"],
-                "lr_features": [],
-                "lr_features_to_include": [],
-                "trees_features_to_include": [],
-                "trees_features_to_exclude": [],
-                "cut_offs": {
-                    "xgb": [],
-                    "lr": [],
-                    "dt": [],
-                    "rf": []
-                },
-                "under_sampling": 1,
-                "optimal_binning_columns": form.cleaned_data["optimal_binning_columns"],
-                "main_table": "input.csv",
-                "columns_to_include": [],
-                "custom_calculations": [],
-                "additional_tables": []
-            }
-
-            param_file = os.path.abspath(os.path.join(
-                settings.MEDIA_ROOT, "params", f"params_{request.user.get_username()}_{project_name}.json"
-            ))
+def get_report_path(user, project_name: str) -> Optional[str]:
+    """Return the path of a project's analysis report.
 
-            # Save the params as JSON file
-            with open(param_file, "w") as f:
-                json.dump(params, f, indent=4)
-
-            return redirect("projects")
-        else:
-            return render(request, "param/param.html", {
-                "form": form
-            })
-        
-@login_required
-def observation_date_column_choice(request):
-    """Handle AJAX request for date-dependent field choices based on selected date column.
-    
-    This view is called via HTMX to update form fields that depend on the selected
-    observation date column. It renders a partial template with updated date-dependent
-    field options.
-    
-    :param request: The HTTP request
-    :type request: HttpRequest
-    :return: Rendered partial form with updated date-dependent fields
-    :rtype: HttpResponse
+    :param user: Owner of the project
+    :param project_name: Name of the project
+    :return: Absolute path of the report, None if the project has no report on disk
     """
-    return render(request, "param/dependent_fields.html", {
-        "form": ParamForm(request=request)
-    })
+    project = Project.objects.filter(user=user, name=project_name).first()
+    if not project or not project.sweetviz_report:
+        return None
+    report_path = project.sweetviz_report.path
+    return report_path if os.path.exists(report_path) else None
 
 @login_required
 def project_creation(request):
@@ -280,7 +203,10 @@ def project_params(request):
         form = ParamForm(data=request.POST, project=project)
         if form.is_valid():
             try:
-                form.save(project)
+                previous = latest_parameter_set(project)
+                # The cube's periods and criterion follow the parameters, unchanged ones leave it as it is
+                if form.save(project) != previous:
+                    update_period_cube.delay(request.user.get_username(), project.name)
                 messages.success(request, "Parameters saved successfully!")
                 return redirect("projects")
             except Exception as e:
@@ -321,6 +247,9 @@ def get_date_values(request):
             return JsonResponse({"error": "Missing parameters"}, status=400)
             
         project = get_object_or_404(Project, name=project_name, user=request.user)
+        # pandas, numpy and the modules built on them are imported by the views that use them,
+        # so that loading the URLconf does not
+        import pandas as pd
         df = pd.read_csv(project.input_dataframe)
         
         try:
@@ -372,50 +301,77 @@ def projects(request):
     project_name = request.GET.get("project_name")
     
     if not project_name:
+        per_page = settings.PROJECTS_PER_PAGE
+        try:
+            number = max(int(request.GET.get("page") or 1), 1)
+        except ValueError:
+            number = 1
+        data = cached("project_list", user_scope(request.user.id), f"{per_page}:{number}",
+                      lambda: project_list_data(request.user, number, per_page))
+        # A page over a range stands in for the queryset, whose rows are already cached
+        page = Page(data["projects"], data["number"], Paginator(range(data["count"]), per_page))
         return render(request, "projects/all_projects.html", {
-            "projects": Project.objects.filter(user=request.user)
+            "projects": page,
+            "page_obj": page,
         })
 
-    project = get_object_or_404(Project, user=request.user, name=project_name)
-    
-    # Get active task IDs from session
-    prep_task_id = request.session.get(f"prep_task_{project_name}")
-    train_eval_task_id = request.session.get(f"train_eval_task_{project_name}")
+    context = cached("project_detail", project_scope(request.user.id, project_name), "context",
+                     lambda: project_detail_data(request.user, project_name))
+    return render(request, "projects/project.html", context)
+
+def project_list_data(user, number: int, per_page: int) -> Dict[str, Any]:
+    """Build the data of one page of a user's project list.
+
+    :param user: The owner of the projects
+    :param number: Page number, out of range numbers give the nearest page
+    :param per_page: Projects per page
+    :return: Page number, total number of projects and the name and running state of the page's projects
+    """
+    # Only the fields the cards show, one page at a time
+    page = Paginator(
+        Project.objects.filter(user=user).only("id", "name").order_by("name"), per_page,
+    ).get_page(number)
+    running = set(
+        ProjectRun.objects.filter(project__in=page.object_list, status__in=ProjectRun.RUNNING_STATUSES)
+        .values_list("project_id", flat=True)
+    )
+    return {
+        "number": page.number,
+        "count": page.paginator.count,
+        "projects": [{"name": project.name, "running": project.id in running} for project in page],
+    }
+
+def project_detail_data(user, project_name: str) -> Dict[str, Any]:
+    """Build the template context of a project's detail page.
+
+    :param user: The owner of the project
+    :param project_name: Name of the project
+    :return: Template context, plain values and model instances only
+    :raises Http404: If the project doesn't exist
+    """
+    project = get_object_or_404(Project, user=user, name=project_name)
     
-    # Check task statuses
-    prep_status = None
-    train_eval_status = None
+    # Latest run of each stage, as recorded by the Celery signal handlers
+    latest = project.runs.values("stage").annotate(last_id=Max("id")).values_list("last_id", flat=True)
+    runs = {run.stage: run for run in ProjectRun.objects.filter(id__in=list(latest))}
+    running = {stage: run.task_id for stage, run in runs.items() if run.running}
+    prep_status = "running" if ProjectRun.STAGE_PREP in running else None
+    train_eval_status = "running" if ProjectRun.STAGE_TRAIN_EVAL in running else None
+    sweetviz_status = "running" if ProjectRun.STAGE_REPORT in running else None
     
-    if prep_task_id:
-        result = AsyncResult(prep_task_id)
-        if result.status in ["PENDING", "STARTED", "RETRY"]:
-            prep_status = "running"
-            
-    if train_eval_task_id:
-        result = AsyncResult(train_eval_task_id)
-        if result.status in ["PENDING", "STARTED", "RETRY"]:
-            train_eval_status = "running"
-    
-    # Get Sweetviz task status
-    sweetviz_task_id = request.session.get(f"sweetviz_task_{project_name}")
-    sweetviz_status = None
-    if sweetviz_task_id:
-        result = AsyncResult(sweetviz_task_id)
-        if result.status in ["PENDING", "STARTED", "RETRY"]:
-            sweetviz_status = "running"
-    
-    return render(request, "projects/project.html", {
+    return {
         "project": project,
         "prep_output_path": project.prep_output,
         "train_eval_output_path": project.train_eval_output,
         "prep_status": prep_status,
         "train_eval_status": train_eval_status,
-        "prep_task_id": prep_task_id if prep_status == "running" else None,
-        "train_eval_task_id": train_eval_task_id if train_eval_status == "running" else None,
+        "prep_task_id": running.get(ProjectRun.STAGE_PREP),
+        "train_eval_task_id": running.get(ProjectRun.STAGE_TRAIN_EVAL),
         "report_exists": bool(project.sweetviz_report),
         "sweetviz_status": sweetviz_status,
-        "sweetviz_task_id": sweetviz_task_id if sweetviz_status == "running" else None,
-    })
+        "sweetviz_task_id": running.get(ProjectRun.STAGE_REPORT),
+        "resource_usage": list(project.resource_usage.all()[:10]),
+    }
 
 @login_required
 @require_http_methods(["GET"])
@@ -438,6 +394,7 @@ def download_csv(request):
     project = get_object_or_404(Project, user=request.user, name=project_name)
     
     try:
+        import pandas as pd
         df = pd.read_csv(project.input_dataframe)
         response = HttpResponse(content_type="text/csv")
         response["Content-Disposition"] = f'attachment; filename="{project_name}_input.csv"'
@@ -453,7 +410,7 @@ def train_and_eval(request):
     """Start the training and evaluation task for a project.
     
     This view initiates a Celery task to train models and evaluate their performance
-    on the project data. It stores the task ID in the session for status tracking.
+    on the project data. Its state is recorded as a ``ProjectRun`` for status tracking.
     
     :param request: The HTTP request with project_name parameter
     :type request: HttpRequest
@@ -471,9 +428,6 @@ def train_and_eval(request):
         
         result = train_and_evaluate.delay(full_project_name)
         
-        # Store task ID in session
-        request.session[f"train_eval_task_{project_name}"] = result.id
-        
         logger.info(f"Started train_and_eval task with ID: {result.id}")
         
         return JsonResponse({
@@ -499,7 +453,7 @@ def prep(request):
     """Start the data preparation task for a project.
     
     This view initiates a Celery task to prepare and preprocess the project data.
-    It stores the task ID in the session for status tracking. The data preparation
+    Its state is recorded as a ``ProjectRun`` for status tracking. The data preparation
     task performs feature engineering, data cleaning, and other preprocessing steps.
     
     :param request: The HTTP request with project_name parameter
@@ -518,9 +472,6 @@ def prep(request):
         
         result = data_preparation.delay(full_project_name)
         
-        # Store task ID in session
-        request.session[f"prep_task_{project_name}"] = result.id
-        
         logger.info(f"Started prep task with ID: {result.id}")
         
         return JsonResponse({
@@ -576,7 +527,14 @@ def analyze_sweetviz(request):
     
     This view initiates a Celery task to generate a Sweetviz report for the project data.
     Sweetviz is a data exploration library that creates visual EDA (Exploratory Data Analysis)
-    reports. The task ID is stored in the session for status tracking.
+    reports. Its state is recorded as a ``ProjectRun`` for status tracking.
+    
+    If the report is already cached it is attached to the project straight away and
+    ``report_ready`` is returned instead of a task ID.
+    
+    The optional ``report_mode`` parameter is ``full``, ``sample`` or ``auto`` (the default).
+    In auto mode inputs larger than ``REPORT_SAMPLE_THRESHOLD_BYTES`` are reported on a
+    stratified sample of ``sample_rows`` rows, ``REPORT_SAMPLE_ROWS`` unless given.
     
     :param request: The HTTP request with project_name parameter
     :type request: HttpRequest
@@ -590,11 +548,29 @@ def analyze_sweetviz(request):
             return JsonResponse({"error": "Project name is required"}, status=400)
         
         project = get_object_or_404(Project, user=request.user, name=project_name)
-        result = generate_sweetviz_report.delay(request.user.get_username(), project_name)
         
-        request.session[f"sweetviz_task_{project_name}"] = result.id
+        mode = request.POST.get("report_mode", "auto")
+        if mode not in ("auto", "full", "sample"):
+            return JsonResponse({"error": f"Unknown report mode: {mode}"}, status=400)
+        try:
+            sample_rows = int(request.POST.get("sample_rows") or settings.REPORT_SAMPLE_ROWS)
+        except ValueError:
+            return JsonResponse({"error": "sample_rows must be a whole number"}, status=400)
+        if sample_rows <= 0:
+            return JsonResponse({"error": "sample_rows must be positive"}, status=400)
+        if mode == "full" or (mode == "auto" and project.input_dataframe.size <= settings.REPORT_SAMPLE_THRESHOLD_BYTES):
+            sample_rows = 0
+        
+        # A report for the same input and options is served without a task
+        cached_name = find_report(project, sample_rows)
+        if cached_name:
+            project.sweetviz_report.name = cached_name
+            project.save(update_fields=["sweetviz_report"])
+            return JsonResponse({"report_ready": True, "cached": True, "sample_rows": sample_rows})
         
-        return JsonResponse({"task_id": result.id})
+        result = generate_sweetviz_report.delay(request.user.get_username(), project_name, sample_rows=sample_rows)
+        
+        return JsonResponse({"task_id": result.id, "sample_rows": sample_rows})
         
     except Exception as e:
         logger.exception(f"Error in analyze_sweetviz view for project {project_name}")
@@ -618,20 +594,11 @@ def download_sweetviz(request):
     if not project_name:
         return JsonResponse({"error": "Project name is required"}, status=400)
         
-    report_path = os.path.join(
-        settings.MEDIA_ROOT, 
-        "reports", 
-        request.user.get_username(),
-        f"{request.user.get_username()}_{project_name}.html"
-    )
-    
-    if not os.path.exists(report_path):
+    report_path = get_report_path(request.user, project_name)
+    if not report_path:
         return JsonResponse({"error": "Report not found"}, status=404)
         
-    with open(report_path, "r", encoding="utf-8") as f:
-        response = HttpResponse(f.read(), content_type="text/html")
-        response["Content-Disposition"] = f'attachment; filename="{project_name}.html"'
-        return response
+    return report_response(request, report_path, filename=f"{project_name}.html")
     
 @login_required
 @require_http_methods(["GET"])
@@ -639,9 +606,8 @@ def show_report(request):
     """Display the Sweetviz report for a project in the browser.
     
     This view retrieves the generated Sweetviz HTML report and displays it directly
-    in the browser. Unlike the download_sweetviz view, this returns the HTML content
-    without the Content-Disposition header, so the browser renders it instead of
-    downloading it.
+    in the browser. Unlike the download_sweetviz view, the response is not marked as
+    an attachment, so the browser renders it instead of downloading it.
     
     :param request: The HTTP request with project_name parameter
     :type request: HttpRequest
@@ -653,15 +619,158 @@ def show_report(request):
     if not project_name:
         return JsonResponse({"error": "Project name is required"}, status=400)
     
-    report_path = os.path.join(
-        settings.MEDIA_ROOT, 
-        "reports", 
-        request.user.get_username(),
-        f"{request.user.get_username()}_{project_name}.html"
-    )
-    
-    if not os.path.exists(report_path):
+    report_path = get_report_path(request.user, project_name)
+    if not report_path:
         return JsonResponse({"error": "Report not found"}, status=404)
     
-    with open(report_path, "r", encoding="utf-8") as f:
-        return HttpResponse(f.read(), content_type="text/html")
\ No newline at end of file
+    return report_response(request, report_path)
+
+
+def get_project_cube(request, project_name: str):
+    """Return a project's cube and parameters, or an error response when there is none.
+
+    :param request: The HTTP request
+    :param project_name: Name of the project
+    :return: Tuple of (cube, params, None) or (None, None, error response)
+    """
+    from .cube import cube_params, cube_path, load_cube
+    project = get_object_or_404(Project, user=request.user, name=project_name)
+    params = cube_params(project)
+    if params is None:
+        return None, None, JsonResponse({"error": "Project parameters are not saved"}, status=409)
+    cube = load_cube(cube_path(project))
+    if cube is None or (cube.date_column, cube.criterion_column) != (
+            params["observation_date_column"], params["criterion_column"]):
+        return None, None, JsonResponse({"error": "The period cube is not built yet"}, status=409)
+    return cube, params, None
+
+@login_required
+@require_http_methods(["POST"])
+def build_cube(request):
+    """Start building or updating the per-period aggregate cube of a project.
+    
+    :param request: The HTTP request with project_name parameter
+    :type request: HttpRequest
+    :return: JSON response with the task ID
+    :rtype: JsonResponse
+    :raises Http404: If the project doesn't exist
+    """
+    project_name = request.POST.get("project_name")
+    if not project_name:
+        return JsonResponse({"error": "Project name is required"}, status=400)
+    
+    project = get_object_or_404(Project, user=request.user, name=project_name)
+    result = update_period_cube.delay(request.user.get_username(), project.name)
+    logger.info(f"Started cube task with ID: {result.id}")
+    
+    return JsonResponse({
+        "status": "success",
+        "task_id": result.id,
+        "message": "Cube update started"
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def cube_psi(request):
+    """Return the population stability index of every column between two sets of periods.
+    
+    The periods default to the project's time split: ``t1df`` up to ``t2df`` as the
+    base and ``t2df`` through ``t3df`` for comparison. Repeated ``base`` and
+    ``target`` parameters override them, and ``column`` limits the columns.
+    
+    :param request: The HTTP request with project_name and optional base, target and column parameters
+    :type request: HttpRequest
+    :return: JSON response with the PSI of each column
+    :rtype: JsonResponse
+    :raises Http404: If the project doesn't exist
+    """
+    project_name = request.GET.get("project_name")
+    if not project_name:
+        return JsonResponse({"error": "Project name is required"}, status=400)
+    
+    cube, params, error = get_project_cube(request, project_name)
+    if error:
+        return error
+    
+    from .cube import default_windows
+    base, target = default_windows(cube, params)
+    base = request.GET.getlist("base") or base
+    target = request.GET.getlist("target") or target
+    columns = request.GET.getlist("column") or None
+    unknown = [column for column in columns or [] if column not in cube.columns]
+    if unknown:
+        return JsonResponse({"error": f"Unknown columns: {', '.join(unknown)}"}, status=400)
+    
+    psi = cube.psi(base, target, columns)
+    return JsonResponse({
+        "base": base,
+        "target": target,
+        "psi": {column: None if math.isnan(value) else value for column, value in psi.items()},
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def cube_bad_rate(request):
+    """Return the criterion rate of every period, optionally broken down by the bins of a column.
+    
+    :param request: The HTTP request with project_name and optional column parameters
+    :type request: HttpRequest
+    :return: JSON response with rows, labelled rows, bads and bad rate per period
+    :rtype: JsonResponse
+    :raises Http404: If the project doesn't exist
+    """
+    project_name = request.GET.get("project_name")
+    if not project_name:
+        return JsonResponse({"error": "Project name is required"}, status=400)
+    
+    cube, _, error = get_project_cube(request, project_name)
+    if error:
+        return error
+    
+    column = request.GET.get("column") or None
+    if column is not None and column not in cube.columns:
+        return JsonResponse({"error": f"Unknown column: {column}"}, status=400)
+    
+    return JsonResponse({"criterion_column": cube.criterion_column, **cube.bad_rates(column)})
+
+@login_required
+@require_http_methods(["GET"])
+def binning_preview(request):
+    """Return the optimal bins and information values of the project's binning columns.
+    
+    Columns are answered from the binning cache. When some are not binned yet a
+    task is started for them, unless a binning run of the project is already
+    queued or running, and the response carries the task's ID with status 202,
+    so the page can poll ``task_status`` and ask again.
+    
+    :param request: The HTTP request with project_name parameter
+    :type request: HttpRequest
+    :return: JSON response with the bins of every column, sorted by IV
+    :rtype: JsonResponse
+    :raises Http404: If the project doesn't exist
+    """
+    project_name = request.GET.get("project_name")
+    if not project_name:
+        return JsonResponse({"error": "Project name is required"}, status=400)
+    
+    from .binning import binning_params, cached_bins
+    project = get_object_or_404(Project, user=request.user, name=project_name)
+    criterion, columns = binning_params(project)
+    if not criterion:
+        return JsonResponse({"error": "Project parameters are not saved"}, status=409)
+    
+    found = cached_bins(input_digest(project), columns, criterion)
+    missing = [column for column in columns if column not in found]
+    response = {
+        "criterion_column": criterion,
+        "columns": sorted(found.values(), key=lambda result: result.get("iv", -1), reverse=True),
+        "missing": missing,
+    }
+    if missing:
+        run = project.runs.filter(stage=ProjectRun.STAGE_BINNING, status__in=ProjectRun.RUNNING_STATUSES).first()
+        if run is not None:
+            return JsonResponse({**response, "task_id": run.task_id}, status=202)
+        result = compute_optimal_bins.delay(request.user.get_username(), project.name)
+        logger.info(f"Started binning task with ID: {result.id}")
+        return JsonResponse({**response, "task_id": result.id}, status=202)
+    return JsonResponse(response)
\ No newline at end of file
@@ -4,24 +4,37 @@ from typing import Optional
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
+from django.db.models.functions import Lower
 from django.http import HttpRequest
 import logging
-import sys
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),  # Log to console
-    ]
-)
 
 logger = logging.getLogger(__name__)
 
 class EmailBackend(ModelBackend):
     """Custom authentication backend that allows login with email or username."""
+    def get_login_user(self, login: str) -> Optional[AbstractBaseUser]:
+        """Find the user a login name belongs to, ignoring case.
+
+        A login containing ``@`` is looked up by email first, anything else by
+        username only, so each query compares ``LOWER(column)`` and can use the
+        matching functional index on ``CustomUser``. Usernames may contain ``@``
+        too, so an email-shaped login that matches no email is tried as a
+        username.
+
+        :param login: The username or email address
+        :return: The user, or None when no user or more than one user matches
+        """
+        user_model = get_user_model()
+        fields = ["email", "username"] if "@" in login else ["username"]
+        for field in fields:
+            users = list(user_model.objects.alias(login_key=Lower(field)).filter(login_key=login.lower())[:2])
+            if len(users) > 1:
+                logger.warning("Authentication failed: '%s' matches more than one %s.", login, field)
+                return None
+            if users:
+                return users[0]
+        return None
+
     def authenticate(
         self, 
         request: Optional[HttpRequest], 
@@ -42,17 +55,15 @@ class EmailBackend(ModelBackend):
         """
 
         logger.debug("Attempting to authenticate user with username/email: %s", username)
-        user_model = get_user_model()
-        try:
-            user = user_model.objects.get(Q(username__iexact=username) | Q(email__iexact=username))
-            logger.debug("User found: %s", user)
-        except user_model.DoesNotExist:
+        if username is None or password is None:
+            return None
+        user = self.get_login_user(username)
+        if user is None:
             logger.warning("Authentication failed: User with username/email '%s' does not exist.", username)
             return None
-        else:
-            if user.check_password(password):
-                logger.info("Authentication successful for user: %s", user)
-                return user
-            else:
-                logger.warning("Authentication failed: Incorrect password for user '%s'.", username)
+        logger.debug("User found: %s", user)
+        if user.check_password(password):
+            logger.info("Authentication successful for user: %s", user)
+            return user
+        logger.warning("Authentication failed: Incorrect password for user '%s'.", username)
         return None
\ No newline at end of file
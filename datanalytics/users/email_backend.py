@@ -1,51 +1,35 @@
 """Email authentication backend for Django."""
 
+from django.conf import settings
 from django.core.mail.backends.base import BaseEmailBackend
-from .tasks import send_email_task
+from .outbox import get_outbox, serialize_message
+from .tasks import drain_outbox
 import logging
-import sys
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),  # Log to console
-    ]
-)
 
 logger = logging.getLogger(__name__)
 
 class CeleryEmailBackend(BaseEmailBackend):
     """Custom email backend that sends emails using Celery tasks."""
     def send_messages(self, email_messages: list) -> int:
-        """Send email messages using Celery tasks.
+        """Queue email messages for the batching mail task.
+        
+        Messages go to the outbox in ``users.outbox``. A ``drain_outbox`` task is
+        scheduled ``EMAIL_BATCH_DELAY`` seconds out unless one already is, so a
+        burst of messages is sent over one SMTP connection.
         
         :param email_messages: List of email messages to be sent.
         :type email_messages: list
         :return: Number of successfully queued messages.
         :rtype: int
         """
-        tasks = []
-        for msg in email_messages:
-            logger.info(f"Queueing email to {msg.to}")
-            
-            # Check if the message has alternatives and get the HTML content if available
-            html_content = None
-            if hasattr(msg, "alternatives") and msg.alternatives:
-                for content, mimetype in msg.alternatives:
-                    if mimetype == 'text/html':
-                        html_content = content
-                        break
-            
-            task = send_email_task.delay(
-                subject=msg.subject,
-                body=msg.body,
-                from_email=msg.from_email,
-                recipient_list=msg.to,
-                html_message=html_content
-            )
-            tasks.append(task)
-            logger.info(f"Email queued with task id: {task.id}")
+        if not email_messages:
+            return 0
+        outbox = get_outbox()
+        outbox.push([serialize_message(msg) for msg in email_messages])
+        logger.info(f"Queued {len(email_messages)} emails to {[msg.to for msg in email_messages]}")
+        
+        if outbox.claim_drain():
+            task = drain_outbox.apply_async(countdown=settings.EMAIL_BATCH_DELAY)
+            logger.info(f"Outbox drain scheduled with task id: {task.id}")
             
-        return len(tasks)  # Return number of queued messages
\ No newline at end of file
+        return len(email_messages)  # Return number of queued messages
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""Compare per-message email tasks with the batching outbox drain against a local SMTP sink.
+
+The sink is a small threaded SMTP server that accepts and discards every
+message. ``--connect-delay`` makes it wait before its greeting, standing in for
+the TLS handshake of the real server, which is what one connection per message
+pays over and over.
+
+Both modes run the Celery tasks in this process: ``per-message`` calls
+``send_email_task`` once per message, each opening its own connection, and
+``batched`` queues everything in a memory outbox and runs ``drain_outbox`` once.
+
+Example::
+
+    python manage.py benchmark_email --messages 500 --connect-delay 50
+"""
+
+import socketserver
+import threading
+import time
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from users.outbox import build_message, get_outbox, serialize_message
+from users.tasks import drain_outbox, send_email_task
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP to accept messages and count them."""
+
+    def handle(self) -> None:
+        """Serve one connection until QUIT."""
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+        self.wfile.write(b"220 sink ESMTP\r\n")
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line in (b".\r\n", b".\n"):
+                    in_data = False
+                    with self.server.lock:
+                        self.server.received += 1
+                    self.wfile.write(b"250 OK\r\n")
+                continue
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.wfile.write(b"250-sink\r\n250 8BITMIME\r\n")
+            elif command == b"DATA":
+                in_data = True
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Threaded SMTP server that discards what it receives."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay: float) -> None:
+        """Listen on a free local port."""
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.connect_delay = connect_delay
+        self.lock = threading.Lock()
+        self.received = 0
+        self.connections = 0
+
+
+class Command(BaseCommand):
+    """Benchmark email delivery modes against a local SMTP sink."""
+
+    help = "Report messages per second sent one task per message and through the batching outbox."
+
+    def add_arguments(self, parser) -> None:
+        """Add command line arguments."""
+        parser.add_argument("--messages", type=int, default=200, help="Messages sent in each mode")
+        parser.add_argument("--connect-delay", type=float, default=50,
+                            help="Milliseconds the sink waits before greeting a new connection")
+        parser.add_argument("--batch-size", type=int, default=100, help="EMAIL_BATCH_SIZE of the batched mode")
+
+    def handle(self, *args, **options) -> None:
+        """Run both modes and print their throughput."""
+        with ExitStack() as stack:
+            sink = SmtpSink(options["connect_delay"] / 1000)
+            stack.callback(sink.server_close)
+            stack.callback(sink.shutdown)
+            threading.Thread(target=sink.serve_forever, daemon=True).start()
+            stack.enter_context(override_settings(
+                EMAIL_HOST="127.0.0.1",
+                EMAIL_PORT=sink.server_address[1],
+                EMAIL_HOST_USER="",
+                EMAIL_HOST_PASSWORD="",
+                EMAIL_USE_SSL=False,
+                EMAIL_USE_TLS=False,
+                CELERY_EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+                EMAIL_OUTBOX_BACKEND="memory",
+                EMAIL_BATCH_SIZE=options["batch_size"],
+            ))
+            messages = [
+                build_message(f"Welcome {i}", "Please activate your account.", "noreply@example.com",
+                              [f"analyst{i}@example.com"], html_message="<p>Please activate your account.</p>")
+                for i in range(options["messages"])
+            ]
+
+            self.stdout.write(f"{'mode':<14}{'messages':>10}{'seconds':>10}{'msg/s':>10}{'connections':>13}")
+            for mode in ("per-message", "batched"):
+                received, connections = sink.received, sink.connections
+                start = time.perf_counter()
+                if mode == "per-message":
+                    for message in messages:
+                        send_email_task.apply(kwargs={
+                            "subject": message.subject, "body": message.body, "from_email": message.from_email,
+                            "recipient_list": message.to, "html_message": message.alternatives[0][0],
+                        }).get()
+                else:
+                    get_outbox().push([serialize_message(message) for message in messages])
+                    get_outbox().claim_drain()
+                    drain_outbox.apply().get()
+                seconds = time.perf_counter() - start
+                self.stdout.write(
+                    f"{mode:<14}{sink.received - received:>10}{seconds:>10.2f}"
+                    f"{(sink.received - received) / seconds:>10.1f}{sink.connections - connections:>13}"
+                )
@@ -0,0 +1,125 @@
+"""Measure login latency through ``users.backends.EmailBackend`` as the user table grows.
+
+The user table is filled in steps up to the largest population requested. After
+each step the command authenticates a random mix of existing users by email and
+by username, each with a random letter case, and prints p50/p95/p99 latency of
+the user lookup alone and of the full ``authenticate`` call. With the functional
+indexes on the lowercased username and email, both stay flat as the table grows.
+The query plan of each lookup is printed for the largest population.
+
+Users are inserted with ``bulk_create`` and share one password hash, and the
+fast MD5 hasher is used so password checking does not drown the lookup.
+
+The users go into a throwaway test database created from the configured
+``DATABASES``; run it against PostgreSQL for figures that match production.
+
+Example::
+
+    python manage.py benchmark_login --users 10000,100000,1000000 --logins 500
+"""
+
+import logging
+import random
+import time
+from contextlib import ExitStack
+from typing import List
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Lower
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+
+from projects.management.commands.loadtest import percentile
+from users.backends import EmailBackend
+
+PASSWORD = "bench-pass-123"
+
+
+def random_case(value: str, rng: random.Random) -> str:
+    """Return the value with the case of each letter chosen at random."""
+    return "".join(char.upper() if rng.random() < 0.5 else char for char in value)
+
+
+class Command(BaseCommand):
+    """Benchmark login lookups at growing user counts."""
+
+    help = "Report login latency percentiles through the email backend as the number of users grows."
+
+    def add_arguments(self, parser) -> None:
+        """Add command line arguments."""
+        parser.add_argument("--users", default="10000,100000,1000000",
+                            help="Comma separated user counts to measure at, in increasing order")
+        parser.add_argument("--logins", type=int, default=500, help="Logins timed at each user count")
+        parser.add_argument("--batch", type=int, default=10_000, help="Users inserted per bulk_create")
+        parser.add_argument("--seed", type=int, default=7, help="Seed of the login mix")
+
+    def handle(self, *args, **options) -> None:
+        """Run the benchmark."""
+        try:
+            counts = sorted(int(count) for count in options["users"].split(","))
+        except ValueError:
+            raise CommandError("--users must be a comma separated list of integers")
+        rng = random.Random(options["seed"])
+
+        with ExitStack() as stack:
+            stack.enter_context(override_settings(
+                PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+            ))
+            old_config = setup_databases(verbosity=0, interactive=False)
+            stack.callback(teardown_databases, old_config, verbosity=0)
+            # One log line per login would dominate the timings
+            backend_logger = logging.getLogger("users.backends")
+            stack.callback(backend_logger.setLevel, backend_logger.level)
+            backend_logger.setLevel(logging.ERROR)
+
+            user_model = get_user_model()
+            backend = EmailBackend()
+            password = make_password(PASSWORD)
+            prefix = f"bench{int(time.time())}"
+            created = 0
+
+            self.stdout.write(f"{'users':>10}{'lookup p50':>12}{'p95':>8}{'p99':>8}"
+                              f"{'login p50':>12}{'p95':>8}{'p99':>8}  (ms)")
+            for count in counts:
+                start = time.perf_counter()
+                while created < count:
+                    size = min(options["batch"], count - created)
+                    user_model.objects.bulk_create([
+                        user_model(username=f"{prefix}_{i}", email=f"{prefix}_{i}@{settings.CORPORATE_EMAIL_DOMAIN}",
+                                   password=password)
+                        for i in range(created, created + size)
+                    ])
+                    created += size
+                self.stderr.write(f"Inserted users up to {count:,} in {time.perf_counter() - start:.1f}s")
+
+                lookups: List[float] = []
+                logins: List[float] = []
+                for _ in range(options["logins"]):
+                    i = rng.randrange(created)
+                    login = f"{prefix}_{i}@{settings.CORPORATE_EMAIL_DOMAIN}" if rng.random() < 0.5 else f"{prefix}_{i}"
+                    login = random_case(login, rng)
+
+                    start = time.perf_counter()
+                    user = backend.get_login_user(login)
+                    lookups.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    authenticated = backend.authenticate(None, username=login, password=PASSWORD)
+                    logins.append(time.perf_counter() - start)
+                    if user is None or authenticated is None:
+                        raise CommandError(f"Login {login} failed")
+
+                self.stdout.write(
+                    f"{count:>10,}"
+                    f"{percentile(lookups, 50) * 1000:>12.2f}{percentile(lookups, 95) * 1000:>8.2f}"
+                    f"{percentile(lookups, 99) * 1000:>8.2f}"
+                    f"{percentile(logins, 50) * 1000:>12.2f}{percentile(logins, 95) * 1000:>8.2f}"
+                    f"{percentile(logins, 99) * 1000:>8.2f}"
+                )
+
+            for field in ("email", "username"):
+                queryset = user_model.objects.alias(login_key=Lower(field)).filter(login_key=f"{prefix}_0")
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\nQuery plan of the {field} lookup"))
+                self.stdout.write(queryset.explain())
@@ -1,9 +1,19 @@
 """Models for the users app."""
 
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 
 class CustomUser(AbstractUser):
     """Custom user model that extends AbstractUser."""
     email = models.EmailField(_("email address"), unique=True, blank=False)
+
+    class Meta(AbstractUser.Meta):
+        """Meta class for the CustomUser model."""
+        # Login looks users up by lowercased username or email, see users.backends
+        indexes = [
+            models.Index(Lower("username"), name="user_username_lower_idx"),
+            models.Index(Lower("email"), name="user_email_lower_idx"),
+        ]
+
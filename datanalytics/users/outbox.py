@@ -0,0 +1,203 @@
+"""Outbox of emails waiting for the batching mail task.
+
+``CeleryEmailBackend`` appends each message to the outbox and makes sure one
+``drain_outbox`` task is scheduled; the task then sends everything queued over
+a single SMTP connection. Messages are stored as JSON so any worker can send
+them.
+
+The task moves each batch to a processing list before sending it and removes it
+only once it is sent. A batch whose connection fails is put back at the head of
+the outbox, and one left behind by a worker that died is put back by the next
+drain, so a message is sent at least once.
+
+The outbox lives in a Redis list shared by every process. Set
+``EMAIL_OUTBOX_BACKEND = "memory"`` to keep it in the current process, which is
+what the tests and an eager Celery setup need.
+"""
+
+import json
+import threading
+from collections import deque
+from typing import Any, List, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def serialize_message(message: EmailMessage) -> str:
+    """Return the parts of a message the mail task sends, as JSON.
+
+    :param message: The message
+    :return: JSON with subject, body, sender, recipients and the HTML alternative if any
+    """
+    html_message = None
+    for content, mimetype in getattr(message, "alternatives", None) or []:
+        if mimetype == "text/html":
+            html_message = content
+            break
+    return json.dumps({
+        "subject": message.subject,
+        "body": message.body,
+        "from_email": message.from_email,
+        "recipient_list": list(message.to),
+        "html_message": html_message,
+    })
+
+
+def build_message(subject: str, body: str, from_email: str, recipient_list: List[str],
+                  html_message: Optional[str] = None, connection=None) -> EmailMessage:
+    """Build a message, with an HTML alternative when one is given.
+
+    :param subject: The subject of the email
+    :param body: The plain text body
+    :param from_email: The sender's email address
+    :param recipient_list: Recipient email addresses
+    :param html_message: Optional HTML alternative
+    :param connection: Mail backend the message is sent through
+    :return: The message
+    """
+    if html_message:
+        message = EmailMultiAlternatives(subject=subject, body=body, from_email=from_email, to=recipient_list,
+                                         connection=connection)
+        message.attach_alternative(html_message, "text/html")
+        return message
+    return EmailMessage(subject=subject, body=body, from_email=from_email, to=recipient_list, connection=connection)
+
+
+class MemoryOutbox:
+    """Keeps queued messages in the memory of the current process."""
+
+    def __init__(self) -> None:
+        """Initialize an empty outbox."""
+        self._messages: deque = deque()
+        self._processing: deque = deque()
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def push(self, payloads: List[str]) -> None:
+        """Append serialized messages."""
+        with self._lock:
+            self._messages.extend(payloads)
+
+    def take(self, count: int) -> List[str]:
+        """Move up to ``count`` messages, oldest first, to the processing list and return them."""
+        with self._lock:
+            batch = [self._messages.popleft() for _ in range(min(count, len(self._messages)))]
+            self._processing.extend(batch)
+            return batch
+
+    def ack(self, count: int) -> None:
+        """Drop the ``count`` oldest messages of the processing list, once they are sent."""
+        with self._lock:
+            for _ in range(min(count, len(self._processing))):
+                self._processing.popleft()
+
+    def requeue(self) -> None:
+        """Put the messages of the processing list back at the head of the outbox."""
+        with self._lock:
+            self._messages.extendleft(reversed(self._processing))
+            self._processing.clear()
+
+    def size(self) -> int:
+        """Return the number of queued messages."""
+        return len(self._messages)
+
+    def claim_drain(self) -> bool:
+        """Mark a drain task as scheduled; False when one already is."""
+        with self._lock:
+            if self._scheduled:
+                return False
+            self._scheduled = True
+            return True
+
+    def release_drain(self) -> None:
+        """Clear the scheduled drain mark."""
+        self._scheduled = False
+
+
+class RedisOutbox:
+    """Keeps queued messages in a Redis list so every web and worker process shares them."""
+
+    def __init__(self, url: str, key: str) -> None:
+        """Initialize the outbox without connecting yet."""
+        self.url = url
+        self.key = key
+        self._client = None
+
+    @property
+    def client(self):
+        """The Redis client, created on first use."""
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def push(self, payloads: List[str]) -> None:
+        """Append serialized messages."""
+        if payloads:
+            self.client.rpush(self.key, *payloads)
+
+    @property
+    def processing_key(self) -> str:
+        """Key of the list holding the batch being sent."""
+        return f"{self.key}:processing"
+
+    def take(self, count: int) -> List[str]:
+        """Move up to ``count`` messages, oldest first, to the processing list and return them.
+
+        The moves run in one transaction, so a message is always in one of the two lists.
+        """
+        pipe = self.client.pipeline(transaction=True)
+        for _ in range(count):
+            pipe.lmove(self.key, self.processing_key, "LEFT", "RIGHT")
+        return [payload.decode() for payload in pipe.execute() if payload is not None]
+
+    def ack(self, count: int) -> None:
+        """Drop the ``count`` oldest messages of the processing list, once they are sent."""
+        self.client.ltrim(self.processing_key, count, -1)
+
+    def requeue(self) -> None:
+        """Put the messages of the processing list back at the head of the outbox."""
+        while self.client.lmove(self.processing_key, self.key, "RIGHT", "LEFT") is not None:
+            pass
+
+    def size(self) -> int:
+        """Return the number of queued messages."""
+        return self.client.llen(self.key)
+
+    def claim_drain(self) -> bool:
+        """Mark a drain task as scheduled; False when one already is.
+
+        The mark expires on its own, so a lost task cannot stall the outbox.
+        """
+        return bool(self.client.set(f"{self.key}:drain", 1, nx=True, ex=settings.EMAIL_DRAIN_CLAIM_SECONDS))
+
+    def release_drain(self) -> None:
+        """Clear the scheduled drain mark."""
+        self.client.delete(f"{self.key}:drain")
+
+
+_outbox = None
+
+
+def get_outbox():
+    """Return the outbox selected by ``EMAIL_OUTBOX_BACKEND``, creating it on first use."""
+    global _outbox
+    if _outbox is None:
+        if settings.EMAIL_OUTBOX_BACKEND == "memory":
+            _outbox = MemoryOutbox()
+        else:
+            _outbox = RedisOutbox(settings.EMAIL_OUTBOX_REDIS_URL, settings.EMAIL_OUTBOX_KEY)
+    return _outbox
+
+
+@receiver(setting_changed)
+def reset_outbox(setting: str, **kwargs: Any) -> None:
+    """Drop the cached outbox when an outbox setting is overridden."""
+    global _outbox
+    if setting.startswith("EMAIL_OUTBOX"):
+        _outbox = None
+
@@ -2,19 +2,12 @@
 
 from celery import shared_task
 from django.core.mail.backends.smtp import EmailBackend
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail import get_connection
 from django.conf import settings
+from typing import List
+from .outbox import build_message, get_outbox
+import json
 import logging
-import sys
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),  # Log to console
-    ]
-)
 
 logger = logging.getLogger(__name__)
 
@@ -47,24 +40,7 @@ def send_email_task(self, subject: str, body: str, from_email: str, recipient_li
             use_tls=settings.EMAIL_USE_TLS,
             use_ssl=settings.EMAIL_USE_SSL
         )
-
-        if html_message:
-            email = EmailMultiAlternatives(
-                subject=subject,
-                body=body,
-                from_email=from_email,
-                to=recipient_list,
-                connection=backend
-            )
-            email.attach_alternative(html_message, "text/html")
-        else:
-            email = EmailMessage(
-                subject=subject,
-                body=body,
-                from_email=from_email,
-                to=recipient_list,
-                connection=backend
-            )
+        email = build_message(subject, body, from_email, recipient_list, html_message, connection=backend)
         
         result = email.send(fail_silently=False)
         logger.info(f"Email sent successfully to {recipient_list}")
@@ -72,4 +48,102 @@ def send_email_task(self, subject: str, body: str, from_email: str, recipient_li
         
     except Exception as exc:
         logger.exception(f"Failed to send email to {recipient_list}")
-        raise self.retry(exc=exc, countdown=5 * 60)  # Retry after 5 minutes
\ No newline at end of file
+        raise self.retry(exc=exc, countdown=5 * 60)  # Retry after 5 minutes
+
+def send_batch(connection, payloads: List[str]) -> int:
+    """Send serialized messages over an open connection.
+
+    When a message fails the connection is reopened and the message tried once
+    more; if that fails too it is handed to ``send_email_task``, which retries it
+    on its own, and the batch goes on.
+
+    :param connection: Open mail backend
+    :param payloads: Messages serialized by ``users.outbox.serialize_message``
+    :return: The number of messages sent in the batch
+    """
+    sent = 0
+    for payload in payloads:
+        message = json.loads(payload)
+        try:
+            sent += build_message(**message, connection=connection).send()
+            continue
+        except Exception:
+            logger.warning(f"Sending to {message['recipient_list']} failed, reconnecting")
+        try:
+            connection.close()
+        except Exception:
+            pass
+        try:
+            connection.open()
+            sent += build_message(**message, connection=connection).send()
+        except Exception:
+            logger.exception(f"Failed to send email to {message['recipient_list']}, retrying it on its own")
+            send_email_task.delay(**message)
+    return sent
+
+@shared_task(bind=True, max_retries=3)
+def drain_outbox(self) -> int:
+    """Send the queued emails in batches over one SMTP connection.
+
+    Runs until the outbox is empty. The connection is opened before any message
+    is taken; when it cannot be, the scheduled mark is released and the task
+    retried, with every message left in the outbox. Each batch stays in the
+    outbox's processing list until it is sent, and is put back if sending it
+    raises. The scheduled mark is released before the last look at the outbox,
+    so a message queued while the task was finishing is either picked up here or
+    schedules the next drain.
+
+    :param self: The current task instance.
+    :type self: celery.Task
+    :return: The number of messages sent
+    """
+    outbox = get_outbox()
+    # A retry runs after the mark was released, another drain may have taken over since
+    if self.request.retries and not outbox.claim_drain():
+        return 0
+    connection = get_connection(settings.CELERY_EMAIL_BACKEND, fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        logger.warning(f"Could not connect to the mail server, retrying the drain: {exc}")
+        outbox.release_drain()
+        raise self.retry(exc=exc, countdown=60)
+    sent = 0
+    try:
+        # A batch left by a worker that died while sending it
+        outbox.requeue()
+        while True:
+            payloads = outbox.take(settings.EMAIL_BATCH_SIZE)
+            if not payloads:
+                outbox.release_drain()
+                if not outbox.size() or not outbox.claim_drain():
+                    break
+                continue
+            try:
+                sent += send_batch(connection, payloads)
+            except Exception:
+                outbox.requeue()
+                outbox.release_drain()
+                raise
+            outbox.ack(len(payloads))
+            logger.info(f"Sent {sent} queued emails so far")
+    finally:
+        connection.close()
+    return sent
+
+@shared_task
+def sweep_outbox() -> bool:
+    """Schedule a drain for emails left in the outbox with none scheduled.
+
+    A drain that gave up, after its connection retries or on a batch that
+    raised, leaves its messages queued; run periodically by Celery beat, this
+    sends them once the mail server is back instead of with the next email.
+
+    :return: Whether a drain was scheduled
+    """
+    outbox = get_outbox()
+    if not outbox.size() or not outbox.claim_drain():
+        return False
+    logger.info(f"Scheduling a drain for {outbox.size()} emails left in the outbox")
+    drain_outbox.delay()
+    return True
\ No newline at end of file
@@ -1,12 +1,16 @@
 """Tests for the users app."""
 
-from django.test import TestCase, Client, RequestFactory
+from unittest.mock import Mock, patch
+
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core import mail
 from .forms import CustomUserForm, UserProfileForm
 from .models import CustomUser
 from .backends import EmailBackend
+from .outbox import get_outbox, reset_outbox, serialize_message
+from .tasks import drain_outbox, send_batch, sweep_outbox
 from django.conf import settings
 
 class UserModelTests(TestCase):
@@ -188,6 +192,19 @@ class EmailBackendTests(TestCase):
         )
         self.assertIsNone(authenticated_user)
 
+    def test_authenticate_ignores_case(self) -> None:
+        """Test that email and username logins match whatever their case."""
+        for login in (f"TEST@{settings.CORPORATE_EMAIL_DOMAIN.upper()}", "TestUser"):
+            self.assertEqual(self.backend.authenticate(None, username=login, password="testpass123"), self.user)
+
+    def test_username_with_at_sign(self) -> None:
+        """Test that an email-shaped username still logs in when no email matches it."""
+        user = CustomUser.objects.create_user(
+            username="team@lead", email=f"lead@{settings.CORPORATE_EMAIL_DOMAIN}", password="testpass123"
+        )
+        self.assertEqual(self.backend.authenticate(None, username="Team@Lead", password="testpass123"), user)
+        self.assertIsNone(self.backend.authenticate(None, username="nobody@nowhere", password="testpass123"))
+
 class CeleryEmailBackendTests(TestCase):
     """Tests for the Celery email backend."""
     def test_email_queuing(self) -> None:
@@ -201,3 +218,86 @@ class CeleryEmailBackendTests(TestCase):
         )
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "Test Subject")
+
+@override_settings(
+    EMAIL_OUTBOX_BACKEND="memory",
+    CELERY_EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    EMAIL_BACKEND="users.email_backend.CeleryEmailBackend",
+    EMAIL_BATCH_SIZE=2,
+)
+class OutboxTests(TestCase):
+    """Tests for batched delivery through the email outbox."""
+    def setUp(self) -> None:
+        """Start each test with an empty outbox."""
+        reset_outbox(setting="EMAIL_OUTBOX_BACKEND")
+
+    def test_messages_share_one_drain(self) -> None:
+        """Test that queued messages schedule a single drain task."""
+        with patch("users.email_backend.drain_outbox.apply_async") as apply_async:
+            for i in range(3):
+                mail.send_mail(f"Subject {i}", "Body", "from@example.com", [f"to{i}@example.com"])
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(get_outbox().size(), 3)
+
+    def test_drain_sends_everything(self) -> None:
+        """Test that the drain task sends every queued message in batches."""
+        with patch("users.email_backend.drain_outbox.apply_async"):
+            for i in range(5):
+                mail.send_mail(f"Subject {i}", "Body", "from@example.com", [f"to{i}@example.com"],
+                               html_message="<p>Body</p>")
+        self.assertEqual(drain_outbox.apply().get(), 5)
+        self.assertEqual([message.subject for message in mail.outbox], [f"Subject {i}" for i in range(5)])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertEqual(get_outbox().size(), 0)
+        self.assertTrue(get_outbox().claim_drain())
+
+    def test_failed_connect_keeps_the_outbox(self) -> None:
+        """Test that a drain that cannot connect leaves every message queued and releases its mark."""
+        with patch("users.email_backend.drain_outbox.apply_async"):
+            for i in range(3):
+                mail.send_mail(f"Subject {i}", "Body", "from@example.com", [f"to{i}@example.com"])
+        connection = Mock()
+        connection.open.side_effect = OSError("connection refused")
+        with patch("users.tasks.get_connection", return_value=connection):
+            result = drain_outbox.apply()
+        self.assertIsInstance(result.result, OSError)
+        self.assertEqual(connection.open.call_count, 4)
+        self.assertEqual(get_outbox().size(), 3)
+
+        # The periodic sweep schedules one drain for the messages left behind
+        with patch("users.tasks.drain_outbox.delay") as delay:
+            self.assertTrue(sweep_outbox())
+            self.assertFalse(sweep_outbox())
+        delay.assert_called_once_with()
+        self.assertEqual(drain_outbox.apply().get(), 3)
+        self.assertEqual([message.subject for message in mail.outbox], [f"Subject {i}" for i in range(3)])
+
+    def test_sweep_ignores_an_empty_outbox(self) -> None:
+        """Test that the sweep schedules nothing when no message is queued."""
+        with patch("users.tasks.drain_outbox.delay") as delay:
+            self.assertFalse(sweep_outbox())
+        delay.assert_not_called()
+        self.assertTrue(get_outbox().claim_drain())
+
+    def test_unsent_batch_is_put_back(self) -> None:
+        """Test that a batch taken but never sent goes back to the head of the outbox."""
+        outbox = get_outbox()
+        outbox.push(["a", "b", "c"])
+        self.assertEqual(outbox.take(2), ["a", "b"])
+        outbox.requeue()
+        self.assertEqual(outbox.take(3), ["a", "b", "c"])
+        outbox.ack(3)
+        outbox.requeue()
+        self.assertEqual(outbox.size(), 0)
+
+    def test_failed_message_is_retried_on_its_own(self) -> None:
+        """Test that a message failing after a reconnect is handed to the single message task."""
+        connection = Mock()
+        connection.send_messages.side_effect = [OSError("connection lost"), 1, OSError("rejected"), OSError("rejected")]
+        payloads = [serialize_message(mail.EmailMessage(f"Subject {i}", "Body", "from@example.com", ["to@example.com"]))
+                    for i in range(2)]
+        with patch("users.tasks.send_email_task.delay") as delay:
+            self.assertEqual(send_batch(connection, payloads), 1)
+        self.assertEqual(connection.open.call_count, 2)
+        delay.assert_called_once()
+        self.assertEqual(delay.call_args.kwargs["subject"], "Subject 1")
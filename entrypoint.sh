@@ -121,7 +121,7 @@ elif [[ "$1" == *"celery"* ]] || [[ "$1" == "celery" ]]; then
     sleep 30
     
     echo "Starting Celery worker..."
-    exec celery -A datanalytics worker --loglevel=info --concurrency=5
+    exec celery -A datanalytics worker --loglevel=info --concurrency=5 --beat
 
 # For any other command, just execute it
 else